@@ -0,0 +1,221 @@
+"""
+Replays a weighted mix of requests against the API of main.py at a given concurrency, and reports the
+latency percentiles and the throughput of every kind of request.
+
+The app runs in this process and is called through httpx's ASGI transport, so no server is started and
+no network is involved: the numbers measure the app and the KB alone. The KB is started on a copy of
+KB_original.owl, or of a synthetic ontology (see synthetic.py) with --kpis, in a temporary folder,
+so that the KPIs added by the replay never reach the backups.
+
+With --health, /health is also probed every 10 ms, first while the app is idle ('health_idle') and then
+during the replay ('health'): with --mix typo=100 --kpis 100000 the approximate matches saturate the KB
+executor, and the two rows show how much longer the event loop takes to answer meanwhile. The matches run
+in main.MATCH_PROCESSES processes, as in the app; --match-processes 0 runs them in the threads of the
+executor instead.
+
+Usage:
+    python benchmarks/load.py [--requests 2000] [--concurrency 16] [--kpis 10000]
+                              [--mix exact=60,typo=25,all_formulas=10,add_kpi=5] [--health]
+                              [--match-processes N] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import pathlib as pl
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+import suite  # noqa: E402
+
+MIX = {'exact': 60, 'typo': 25, 'all_formulas': 10, 'add_kpi': 5}  # Default weights of the kinds of request
+# Endpoints of the exact and misspelled lookups, with the query parameter naming the label
+LOOKUPS = (('/kpi-formulas', 'kpi'), ('/class-instances', 'owl_class_label'), ('/object-properties', 'label'))
+HEALTH_INTERVAL = 0.01  # Seconds between two /health probes
+HEALTH_KINDS = ('health_idle', 'health')  # Probes of /health, left out of the 'all' row
+
+
+def _mix(text):
+    """
+    Parses a mix such as 'exact=60,typo=25' into {kind: weight}.
+    """
+    mix = {}
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in MIX:
+            raise argparse.ArgumentTypeError('unknown kind of request: ' + kind)
+        mix[kind] = float(weight)
+    return mix
+
+
+def requests(mix, count, seed, kpis, classes, page):
+    """
+    Draws the requests replayed, as (kind, method, path, query parameters, JSON body) tuples.
+
+    Parameters:
+    - mix (dict): The weight of every kind of request: 'exact' and 'typo' look up a KPI or class label,
+      spelled right or misspelled, through one of LOOKUPS; 'all_formulas' reads a page of
+      /get_all_formulas/; 'add_kpi' adds a new KPI referencing two existing ones.
+    - count (int): The number of requests.
+    - seed (int): The seed of the random choices.
+    - kpis (list): The labels of the KPIs of the KB.
+    - classes (list): The labels of its classes.
+    - page (int): The KPIs per page of /get_all_formulas/.
+
+    Returns:
+    - list: The requests, in the order they are sent.
+    """
+    rng = random.Random(seed)
+    kinds = rng.choices(list(mix), list(mix.values()), k=count)
+    drawn = []
+    for i, kind in enumerate(kinds):
+        if kind in ('exact', 'typo'):
+            path, parameter = rng.choice(LOOKUPS)
+            label = rng.choice(classes if parameter == 'owl_class_label' else kpis)
+            if kind == 'typo':
+                label = suite._typo(rng, label)
+            drawn.append((kind, 'GET', path, {parameter: label}, None))
+        elif kind == 'all_formulas':
+            # A page starting at a random KPI, as a client walking the list would read it
+            position = rng.randrange(len(kpis))
+            params = {'limit': page}
+            if position:
+                params['cursor'] = kpis[position - 1]
+            drawn.append((kind, 'GET', '/get_all_formulas/', params, None))
+        else:
+            references = rng.sample(kpis, 2)
+            body = {'superclass': 'kpi', 'label': 'load_kpi_%d_%d' % (seed, i), 'description': 'Load KPI',
+                    'unit_of_measure': 's',
+                    'parsable_computation_formula': 'A°sum°mo[S°/[ R°%s°T°m°o° ; R°%s°T°m°o° ]]' % tuple(references)}
+            drawn.append((kind, 'POST', '/add_kpi/', None, body))
+    return drawn
+
+
+async def probe_health(client, kind, results, stop):
+    """
+    Requests /health every HEALTH_INTERVAL seconds until stop is set, recording each answer under kind.
+    """
+    while not stop.is_set():
+        begin = time.perf_counter()
+        response = await client.get('/health')
+        results.append((kind, response.status_code, time.perf_counter() - begin))
+        await asyncio.sleep(HEALTH_INTERVAL)
+
+
+async def replay(app, drawn, concurrency, health=False):
+    """
+    Sends the requests through an ASGI transport, concurrency of them at a time.
+
+    Parameters:
+    - app: The ASGI app.
+    - drawn (list): The requests, from requests().
+    - concurrency (int): The requests in flight at a time.
+    - health (bool, optional): Probe /health for a second before the replay and during it (see probe_health).
+
+    Returns:
+    - tuple: The (kind, status code, seconds) of every request, and the seconds the replay took.
+    """
+    transport = httpx.ASGITransport(app=app)
+    results = []
+    pending = iter(drawn)
+
+    async def client_loop(client):
+        # Every client sends its next request as soon as the previous one is answered
+        for kind, method, path, params, body in pending:
+            begin = time.perf_counter()
+            response = await client.request(method, path, params=params, json=body)
+            await response.aread()
+            results.append((kind, response.status_code, time.perf_counter() - begin))
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://kb') as client:
+        if health:
+            stop = asyncio.Event()
+            asyncio.get_running_loop().call_later(1, stop.set)
+            await probe_health(client, 'health_idle', results, stop)
+            stop = asyncio.Event()
+            probe = asyncio.ensure_future(probe_health(client, 'health', results, stop))
+        begin = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - begin
+        if health:
+            stop.set()
+            await probe
+    return results, elapsed
+
+
+def report(results, elapsed):
+    """
+    Summarizes the replay: latency percentiles (see suite._summary), errors and requests per second, by kind
+    of request and overall (without the /health probes). Answers of 400 and above count as errors, except
+    the 404 of a lookup that matched nothing.
+    """
+    summary = {}
+    for kind in sorted({kind for kind, _, _ in results}) + ['all']:
+        selected = [(status, seconds) for k, status, seconds in results
+                    if kind == k or (kind == 'all' and k not in HEALTH_KINDS)]
+        summary[kind] = suite._summary([seconds for _, seconds in selected])
+        summary[kind]['errors'] = sum(1 for status, _ in selected if status >= 400 and status != 404)
+        summary[kind]['requests_per_second'] = round(len(selected) / elapsed, 2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='requests replayed')
+    parser.add_argument('--concurrency', type=int, default=16, help='requests in flight at a time')
+    parser.add_argument('--mix', type=_mix, default=MIX, help='weights of the kinds of request, e.g. exact=60,typo=25')
+    parser.add_argument('--page', type=int, default=100, help='KPIs per page of /get_all_formulas/')
+    parser.add_argument('--kpis', type=int, default=0, help='synthetic KPIs of the ontology (default is KB_original.owl)')
+    parser.add_argument('--health', action='store_true', help='probe /health while idle and during the replay')
+    parser.add_argument('--match-processes', type=int, help='processes of the approximate matches '
+                                                             '(default is main.MATCH_PROCESSES, 0 for none)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the ontology and of the requests')
+    parser.add_argument('--cache', type=pl.Path, default=suite.CACHE, help='folder of the generated ontologies')
+    parser.add_argument('--output', type=pl.Path, help='JSON file of the results')
+    args = parser.parse_args()
+
+    source = ROOT / 'KB_original.owl'
+    if args.kpis:
+        source, _ = suite.ontology(args.cache, args.kpis, args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        import kb_interface as kbi
+        import main as api
+        kbi.MAIN_DIR = pl.Path(tmp)
+        kbi.CONFIG_PATH = kbi.MAIN_DIR / 'config.cfg'
+        shutil.copy(source, kbi.MAIN_DIR / '0.owl')
+        # The transport does not run the startup event of the app
+        kbi.MATCH_PROCESSES = api.MATCH_PROCESSES if args.match_processes is None else args.match_processes
+        kbi.start(1)
+        for future in kbi.start_match_processes():
+            future.result()
+
+        records = kbi.SNAPSHOT['read_model']['entities'].values()
+        kpis = kbi.get_kpi_page()[0]
+        classes = sorted(record['label'] for record in records if record['kind'] == 'class')
+        drawn = requests(args.mix, args.requests, args.seed, kpis, classes, args.page)
+        results, elapsed = asyncio.run(replay(api.app, drawn, args.concurrency, args.health))
+        kbi.shutdown()
+
+    summary = report(results, elapsed)
+    print('%-13s %8s %7s %10s %10s %10s %10s %10s' % ('kind', 'requests', 'errors', 'p50 (ms)', 'p95 (ms)',
+                                                      'p99 (ms)', 'max (ms)', 'req/s'))
+    for kind, row in summary.items():
+        print('%-13s %8d %7d %10.3f %10.3f %10.3f %10.3f %10.1f' % (
+            kind, row['count'], row['errors'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['max_ms'],
+            row['requests_per_second']))
+    if args.output is not None:
+        document = {'commit': suite._commit(), 'kpis': len(kpis), 'requests': args.requests,
+                   'concurrency': args.concurrency, 'mix': args.mix, 'seconds': round(elapsed, 4),
+                   'kinds': summary}
+        args.output.write_text(json.dumps(document, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
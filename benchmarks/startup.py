@@ -0,0 +1,128 @@
+"""
+Compares the time start() takes with the 'owl' and the 'sqlite' backends, with and without the read
+model saved with the backup, on KB_original.owl and on a copy of it enlarged with synthetic KPIs.
+Every start runs in a new process, as after a restart.
+
+Usage:
+    python benchmarks/startup.py [--kpis 20000] [--repeat 3]
+
+Prints one JSON object per measurement, then a summary table.
+"""
+import argparse
+import json
+import pathlib as pl
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+import kb_interface as kbi  # noqa: E402
+
+# Run in a new interpreter: loads backup 0 of the given folder and prints how long start() took
+START_SCRIPT = """
+import os, pathlib, sys, time
+sys.path.append({root!r})
+sys.stdout = open(os.devnull, 'w')
+import kb_interface as kbi
+kbi.MAIN_DIR = pathlib.Path({folder!r})
+kbi.CONFIG_PATH = kbi.MAIN_DIR / 'config.cfg'
+kbi.BACKEND = {backend!r}
+begin = time.perf_counter()
+kbi.start(1, read_only={read_only!r})
+elapsed = time.perf_counter() - begin
+sys.stdout = sys.__stdout__
+print(elapsed, len(kbi.get_instances('kpi')))
+"""
+
+
+def enlarge(source, folder, kpis):
+    """
+    Writes to folder/0.owl the ontology in source with kpis synthetic KPIs added, each one referencing
+    a data series and up to two earlier KPIs, so that formulas nest like the real ones.
+    """
+    shutil.copy(source, folder / '0.owl')
+    kbi.MAIN_DIR = folder
+    kbi.CONFIG_PATH = folder / 'config.cfg'
+    kbi.BACKEND = 'owl'
+    kbi.start(1)
+    with kbi.KB_LOCK:
+        draft = kbi._draft()
+        for i in range(kpis):
+            formula = 'A°sum°mo[ R°time_sum°T°m°o° ]'
+            if i:
+                formula = 'S°+[ R°synthetic_' + str(i // 2) + '°T°m°o° ; ' + formula + ' ]'
+            if i > 2:
+                formula = 'S°/[ ' + formula + ' ; R°synthetic_' + str(i - 3) + '°T°m°o° ]'
+            kbi._create_kpi(draft, 'downtime_kpi', 'synthetic_' + str(i), 'Synthetic KPI', 's', formula,
+                            depends_on_machine=True, depends_on_operation=True)
+        kbi._publish(draft)
+    kbi.export_ontology(folder / '0.owl')
+    for path in folder.iterdir():
+        if path.name != '0.owl':
+            path.unlink()
+
+
+# Configurations measured: name -> (backend, read_only, files of backup 0 deleted before each start)
+CONFIGURATIONS = {
+    'owl': ('owl', False, ['0.model']),
+    'sqlite_import': ('sqlite', False, ['0.model', '0.sqlite3']),
+    'sqlite': ('sqlite', False, ['0.model']),
+    'owl_read_model': ('owl', False, []),
+    'read_only': ('owl', True, []),
+}
+
+
+def measure(folder, configuration):
+    """
+    Starts the KB on backup 0 of folder in a new process, returning the seconds start() took and the
+    number of KPIs it found.
+    """
+    backend, read_only, stale = CONFIGURATIONS[configuration]
+    for name in stale:
+        if (folder / name).exists():
+            (folder / name).unlink()
+    script = START_SCRIPT.format(root=str(ROOT), folder=str(folder), backend=backend, read_only=read_only)
+    output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True)
+    elapsed, kpis = output.stdout.split()
+    return float(elapsed), int(kpis)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--kpis', type=int, default=20000, help='synthetic KPIs in the enlarged ontology')
+    parser.add_argument('--repeat', type=int, default=3, help='starts measured per backend and ontology')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        ontologies = {'KB_original': pl.Path(tmp) / 'original', 'KB_enlarged': pl.Path(tmp) / 'enlarged'}
+        for folder in ontologies.values():
+            folder.mkdir()
+        shutil.copy(ROOT / 'KB_original.owl', ontologies['KB_original'] / '0.owl')
+        enlarge(ROOT / 'KB_original.owl', ontologies['KB_enlarged'], args.kpis)
+
+        for name, folder in ontologies.items():
+            size = (folder / '0.owl').stat().st_size
+            # 'sqlite_import' is the first 'sqlite' start, which imports the RDF/XML backup into a quadstore;
+            # 'owl_read_model' and 'read_only' load the read model the previous starts saved
+            for configuration in CONFIGURATIONS:
+                for _ in range(1 if configuration == 'sqlite_import' else args.repeat):
+                    seconds, kpis = measure(folder, configuration)
+                    result = {'ontology': name, 'owl_bytes': size, 'kpis': kpis, 'configuration': configuration,
+                              'start_seconds': round(seconds, 4)}
+                    results.append(result)
+                    print(json.dumps(result))
+
+    print()
+    print('%-12s %-15s %8s %10s' % ('ontology', 'configuration', 'kpis', 'best (s)'))
+    for name in ontologies:
+        for configuration in CONFIGURATIONS:
+            runs = [r for r in results if r['ontology'] == name and r['configuration'] == configuration]
+            print('%-12s %-15s %8d %10.3f' % (name, configuration, runs[0]['kpis'],
+                                               min(r['start_seconds'] for r in runs)))
+
+
+if __name__ == '__main__':
+    main()
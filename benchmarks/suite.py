@@ -0,0 +1,248 @@
+"""
+Times the main operations of the knowledge base on synthetic ontologies of growing size (see
+synthetic.py), and writes the results as JSON so that runs on different commits can be compared.
+
+Every size is measured in new processes, as after a restart: a first start() builds the read model
+and saves it with the backup, a second one loads it, and then runs the queries. The generated
+ontologies are cached, so that later runs with the same size and seed reuse them.
+
+Usage:
+    python benchmarks/suite.py [--sizes 1000 10000] [--seed 0] [--samples 200] [--output results.json]
+    python benchmarks/suite.py --sizes 1000 10000 100000 1000000  # The large sizes take minutes to hours
+    python benchmarks/suite.py compare BEFORE.json AFTER.json
+"""
+import argparse
+import json
+import pathlib as pl
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+import synthetic  # noqa: E402
+
+SIZES = (1000, 10000)  # Default sizes; 100000 and 1000000 are measured when asked for
+CACHE = pl.Path(tempfile.gettempdir()) / 'kb_benchmarks'  # Default folder of the generated ontologies
+
+# Run in a new interpreter: starts the KB on backup 0 of the given folder, times the queries when asked
+# to, and prints the results as JSON
+RUN_SCRIPT = """
+import json, os, pathlib, sys
+sys.path.append({root!r})
+sys.path.append({here!r})
+sys.stdout = open(os.devnull, 'w')
+import suite
+results = suite.run(pathlib.Path({folder!r}), pathlib.Path({labels!r}), {seed!r}, {samples!r}, {queries!r})
+sys.stdout = sys.__stdout__
+print(json.dumps(results))
+"""
+
+
+def _percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values falls (nearest rank).
+    """
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def _summary(seconds):
+    """
+    Summarizes the durations of an operation in milliseconds: count, mean, p50, p95, p99 and max.
+    """
+    values = sorted(value * 1000 for value in seconds)
+    return {'count': len(values), 'mean_ms': round(sum(values) / len(values), 4),
+            'p50_ms': round(_percentile(values, 0.50), 4), 'p95_ms': round(_percentile(values, 0.95), 4),
+            'p99_ms': round(_percentile(values, 0.99), 4), 'max_ms': round(values[-1], 4)}
+
+
+def _time(function, arguments):
+    """
+    Calls function once per argument, returning the duration of every call in seconds.
+    """
+    seconds = []
+    for argument in arguments:
+        begin = time.perf_counter()
+        function(argument)
+        seconds.append(time.perf_counter() - begin)
+    return seconds
+
+
+def _typo(rng, label):
+    """
+    Returns label with one character replaced, deleted or swapped with the next one, as a misspelled query.
+    """
+    position = rng.randrange(len(label) - 1)
+    change = rng.choice(('replace', 'delete', 'swap'))
+    if change == 'replace':
+        return label[:position] + rng.choice('abcdefghijklmnopqrstuvwxyz') + label[position + 1:]
+    if change == 'delete':
+        return label[:position] + label[position + 1:]
+    return label[:position] + label[position + 1] + label[position] + label[position + 2:]
+
+
+def run(folder, labels, seed, samples, queries):
+    """
+    Starts the KB on backup 0 of folder and, if queries is set, times its operations on samples labels.
+
+    Parameters:
+    - folder (pathlib.Path): The backup folder, holding 0.owl and possibly 0.model.
+    - labels (pathlib.Path): The JSON file of the labels of the synthetic KPIs.
+    - seed (int): The seed of the samples and of the misspelled queries.
+    - samples (int): The calls timed per operation.
+    - queries (bool): Whether to time the queries and add_kpi, or only start().
+
+    Returns:
+    - dict: The summary of the durations of every operation (see _summary), by operation name.
+    """
+    import kb_interface as kbi
+    kbi.MAIN_DIR = folder
+    kbi.CONFIG_PATH = folder / 'config.cfg'
+    # No backup is taken while add_kpi is timed
+    kbi.SNAPSHOT_EVERY = samples + 1
+    kbi.SNAPSHOT_INTERVAL = 24 * 3600.0
+    begin = time.perf_counter()
+    kbi.start(1)
+    results = {'start': _summary([time.perf_counter() - begin])}
+    if not queries:
+        kbi.shutdown()
+        return results
+
+    rng = random.Random(seed)
+    labels = json.loads(labels.read_text())
+    kpis = rng.sample(labels, min(samples, len(labels)))
+    typos = [_typo(rng, label) for label in kpis]
+    entities = kbi.SNAPSHOT['read_model']['entities'].values()
+    classes = sorted(record['label'] for record in entities if record['kind'] == 'class')
+    classes = [rng.choice(classes) for _ in kpis]
+    class_typos = [_typo(rng, label) for label in classes]
+
+    # Formulas are expanded on the first call and reused afterwards
+    results['get_formulas_cold'] = _summary(_time(kbi.get_formulas, kpis))
+    results['get_formulas_warm'] = _summary(_time(kbi.get_formulas, kpis))
+    results['get_closest_kpi_formulas_hit'] = _summary(_time(kbi.get_closest_kpi_formulas, kpis))
+    results['get_closest_kpi_formulas_miss'] = _summary(_time(kbi.get_closest_kpi_formulas, typos))
+    results['get_closest_kpi_formulas_w2v_miss'] = _summary(_time(
+        lambda label: kbi.get_closest_kpi_formulas(label, 'w2v'), typos))
+    results['get_instances'] = _summary(_time(kbi.get_instances, classes))
+    results['get_closest_class_instances_hit'] = _summary(_time(kbi.get_closest_class_instances, classes))
+    results['get_closest_class_instances_miss'] = _summary(_time(kbi.get_closest_class_instances, class_typos))
+    results['get_object_properties'] = _summary(_time(kbi.get_object_properties, kpis))
+    results['get_closest_object_properties_hit'] = _summary(_time(kbi.get_closest_object_properties, kpis))
+    results['get_closest_object_properties_miss'] = _summary(_time(kbi.get_closest_object_properties, typos))
+
+    def add(i):
+        formula = 'A°sum°mo[S°/[ R°%s°T°m°o° ; R°%s°T°m°o° ]]' % (kpis[i], kpis[-1 - i])
+        kbi.add_kpi('kpi', 'benchmark_kpi_' + str(i), 'Benchmark KPI', 's', formula)
+    results['add_kpi'] = _summary(_time(add, range(len(kpis))))
+    kbi.shutdown()
+    return results
+
+
+def measure(folder, labels, seed, samples, queries):
+    """
+    Runs run() in a new process, returning its results.
+    """
+    script = RUN_SCRIPT.format(root=str(ROOT), here=str(pl.Path(__file__).parent), folder=str(folder),
+                               labels=str(labels), seed=seed, samples=samples, queries=queries)
+    output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def ontology(cache, kpis, seed):
+    """
+    Returns the path of the synthetic ontology with kpis KPIs and the path of the JSON list of the labels of
+    its KPIs, generating them unless cached.
+    """
+    cache.mkdir(parents=True, exist_ok=True)
+    path = cache / ('synthetic_%d_%d.owl' % (kpis, seed))
+    labels_path = path.with_suffix('.json')
+    if not path.exists() or not labels_path.exists():
+        labels = synthetic.generate(path, kpis, seed)
+        labels_path.write_text(json.dumps(labels))
+    return path, labels_path
+
+
+def _commit():
+    """
+    Returns the commit the benchmark runs on, or None outside of a git repository.
+    """
+    try:
+        output = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, check=True, capture_output=True, text=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(sizes, seed, samples, cache):
+    """
+    Measures every size, returning the results with the metadata needed to compare them.
+    """
+    results = {'commit': _commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+               'seed': seed, 'samples': samples, 'sizes': {}}
+    for kpis in sizes:
+        begin = time.perf_counter()
+        path, labels = ontology(cache, kpis, seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = pl.Path(tmp)
+            shutil.copy(path, folder / '0.owl')
+            cold = measure(folder, labels, seed, samples, False)
+            operations = measure(folder, labels, seed, samples, True)
+        operations['start_read_model'] = operations.pop('start')
+        operations['start'] = cold['start']
+        results['sizes'][str(kpis)] = {'owl_bytes': path.stat().st_size, 'operations': operations}
+        print('%d KPIs measured in %.1f s' % (kpis, time.perf_counter() - begin), file=sys.stderr)
+    return results
+
+
+def compare(before, after):
+    """
+    Prints the p50 and p95 of every operation measured by both runs, and their ratio (after / before).
+    """
+    print('%-9s %-36s %12s %12s %7s %12s %12s %7s' % ('kpis', 'operation', 'p50 before', 'p50 after', 'ratio',
+                                                      'p95 before', 'p95 after', 'ratio'))
+    for size, measured in after['sizes'].items():
+        if size not in before['sizes']:
+            continue
+        for operation, summary in measured['operations'].items():
+            previous = before['sizes'][size]['operations'].get(operation)
+            if previous is None:
+                continue
+            ratios = [summary[key] / previous[key] if previous[key] else float('nan') for key in ('p50_ms', 'p95_ms')]
+            print('%-9s %-36s %12.3f %12.3f %7.2f %12.3f %12.3f %7.2f' % (
+                size, operation, previous['p50_ms'], summary['p50_ms'], ratios[0],
+                previous['p95_ms'], summary['p95_ms'], ratios[1]))
+
+
+def main():
+    if sys.argv[1:2] == ['compare']:
+        parser = argparse.ArgumentParser(description='Compares the results of two runs of the suite.')
+        parser.add_argument('command')
+        parser.add_argument('before', type=pl.Path)
+        parser.add_argument('after', type=pl.Path)
+        args = parser.parse_args()
+        compare(json.loads(args.before.read_text()), json.loads(args.after.read_text()))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='synthetic KPIs per ontology')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the ontologies and of the samples')
+    parser.add_argument('--samples', type=int, default=200, help='calls timed per operation')
+    parser.add_argument('--cache', type=pl.Path, default=CACHE, help='folder of the generated ontologies')
+    parser.add_argument('--output', type=pl.Path, help='JSON file of the results (default is standard output)')
+    args = parser.parse_args()
+
+    results = benchmark(args.sizes, args.seed, args.samples, args.cache)
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        args.output.write_text(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Generates synthetic ontologies of any size from the schema of KB_original.owl: its classes and
+properties are kept, and KPI individuals are added whose labels, superclasses, formulas and depth
+of R° references follow the distributions of the real KPIs. The same arguments always give the
+same file, so that benchmarks run on different commits measure the same ontology.
+
+The individuals are written as RDF/XML text rather than through owlready2, so that ontologies with
+a million KPIs are generated in seconds.
+
+Usage:
+    python benchmarks/synthetic.py OUTPUT.owl [--kpis 10000] [--seed 0]
+"""
+import argparse
+import pathlib as pl
+import random
+import sys
+from xml.sax.saxutils import escape
+
+import owlready2 as or2
+
+ROOT = pl.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+import kb_formula as kbf  # noqa: E402
+import kb_interface as kbi  # noqa: E402
+
+NAMESPACE = 'http://webprotege.stanford.edu/'  # Namespace of the classes and properties of the schema
+DC_NAMESPACE = 'http://purl.org/dc/elements/1.1/'  # Namespace of the description annotation
+
+# Distributions measured on the KPIs of KB_original.owl
+LEVEL_WEIGHTS = {0: 28, 1: 13, 2: 2, 3: 1}  # Depth of R° references: 0 for KPIs computed from data only
+REFERENCE_WEIGHTS = {1: 6, 2: 8, 3: 2}  # KPIs referenced by the formula of a KPI of depth 1 or more
+OPERATIONS = ('idle', 'offline', 'working')
+
+
+def _schema(source):
+    """
+    Reads from the source ontology what the synthetic KPIs are built from.
+
+    Returns:
+    - dict: The IRIs of the properties and classes used, the KPI classes weighted by the number of real
+      KPIs they have, and the words of the real KPI labels.
+    """
+    onto = or2.World().get_ontology(str(source)).load()
+
+    def by_label(label):
+        return onto.search_one(label=label)
+
+    kpi_class = by_label('kpi')
+    weights = {cls: 1 for cls in kpi_class.descendants()}
+    words = set()
+    for ind in kpi_class.instances():
+        for cls in ind.is_a:
+            if cls in weights:
+                weights[cls] += 1
+        words.update(str(ind.label.first()).split('_'))
+    properties = {name: by_label(name).iri for name in ('parsable_computation_formula', 'human_readable_formula',
+                                                        'unit_of_measure', 'depends_on')}
+    properties['description'] = next(prop.iri for prop in onto.annotation_properties() if prop._name == 'description')
+    return {'properties': properties, 'classes': [cls.iri for cls in weights],
+            'class_weights': list(weights.values()), 'machine': by_label('machine').iri,
+            'operation': by_label('operation').iri, 'words': sorted(word for word in words if word.isalpha())}
+
+
+def _element(iri):
+    """
+    Returns the qualified name of a property, with the prefixes generate() declares.
+    """
+    if iri.startswith(NAMESPACE):
+        return 'syn:' + iri[len(NAMESPACE):]
+    return 'syndc:' + iri[len(DC_NAMESPACE):]
+
+
+def _formula(rng, label, references):
+    """
+    Builds a parsable formula shaped like the real ones, referencing the given KPIs.
+    """
+    if not references:
+        aggregation = rng.choice(kbf.AGGREGATIONS)
+        return 'A°%s°mo[ A°%s°t[ D°%s°t°m°o° ] ]' % (aggregation, aggregation, label)
+    terms = ['R°' + ref + '°T°m°o°' for ref in references]
+    if len(terms) == 1:
+        return 'A°%s°mo[S°*[ %s ; C°%d° ]]' % (rng.choice(kbf.AGGREGATIONS), terms[0], rng.choice((100, 400, 1000)))
+    if len(terms) == 2:
+        return 'A°sum°mo[S°/[ %s ; %s ]]' % tuple(terms)
+    return 'S°+[ ' + ' ; '.join('R°%s°T°M°%s°' % (ref, operation)
+                                 for ref, operation in zip(references, OPERATIONS)) + ' ]'
+
+
+def generate(output, kpis, seed=0, source=ROOT / 'KB_original.owl'):
+    """
+    Writes to output the source ontology with kpis synthetic KPIs added.
+
+    Every KPI gets a depth drawn from LEVEL_WEIGHTS; a KPI of depth d references one KPI of depth d - 1
+    and, following REFERENCE_WEIGHTS, other KPIs of lower depths, so that its formula nests exactly d levels.
+
+    Parameters:
+    - output (pathlib.Path): The RDF/XML file to write.
+    - kpis (int): The number of synthetic KPIs.
+    - seed (int, optional): The seed of the random choices (default is 0).
+    - source (pathlib.Path, optional): The ontology providing the schema (default is KB_original.owl).
+
+    Returns:
+    - list: The labels of the synthetic KPIs, in the order they were written.
+    """
+    rng = random.Random(seed)
+    schema = _schema(source)
+    properties = {name: _element(iri) for name, iri in schema['properties'].items()}
+    levels = {level: [] for level in LEVEL_WEIGHTS}  # Labels of the KPIs written so far, by depth
+    labels = []
+
+    # Declare the prefixes of the synthetic individuals, whatever those the source file uses
+    text = pl.Path(source).read_text(encoding='utf-8')
+    root = text.index('>', text.index('<rdf:RDF'))
+    text = text[:root] + ' xmlns:syn="%s" xmlns:syndc="%s"' % (NAMESPACE, DC_NAMESPACE) + text[root:]
+    end = text.rindex('</rdf:RDF>')
+    with open(output, 'w', encoding='utf-8') as owl:
+        owl.write(text[:end])
+        for i in range(kpis):
+            # Labels made of the words of real labels, made unique by a number
+            label = '_'.join(rng.sample(schema['words'], rng.choice((1, 2, 2, 3))) + [str(i)])
+            level = rng.choices(list(LEVEL_WEIGHTS), list(LEVEL_WEIGHTS.values()))[0]
+            while level and not levels[level - 1]:
+                level -= 1
+            references = []
+            if level:
+                count = rng.choices(list(REFERENCE_WEIGHTS), list(REFERENCE_WEIGHTS.values()))[0]
+                references.append(rng.choice(levels[level - 1]))
+                for _ in range(count - 1):
+                    ref = rng.choice(levels[rng.randrange(level)])
+                    if ref not in references:
+                        references.append(ref)
+            formula = _formula(rng, label, references)
+            levels[level].append(label)
+            labels.append(label)
+
+            superclass = rng.choices(schema['classes'], schema['class_weights'])[0]
+            depends_on = rng.choice(([schema['machine'], schema['operation']], [schema['operation']],
+                                     [schema['machine']], []))
+            lines = ['<owl:NamedIndividual rdf:about="%sS%s">' % (NAMESPACE, kbi._generate_hash_code(label)),
+                     '  <rdf:type rdf:resource="%s"/>' % superclass]
+            lines += ['  <%s rdf:resource="%s"/>' % (properties['depends_on'], iri) for iri in depends_on]
+            lines += ['  <%s rdf:datatype="http://www.w3.org/2001/XMLSchema#string">%s</%s>'
+                      % (properties['parsable_computation_formula'], escape(formula),
+                         properties['parsable_computation_formula']),
+                      '  <%s xml:lang="en">Synthetic KPI %d</%s>' % (properties['description'], i,
+                                                                      properties['description']),
+                      '  <%s xml:lang="en">s</%s>' % (properties['unit_of_measure'], properties['unit_of_measure']),
+                      '  <%s xml:lang="en">%s</%s>' % (properties['human_readable_formula'], escape(formula),
+                                                       properties['human_readable_formula']),
+                      '  <rdfs:label xml:lang="en">%s</rdfs:label>' % label,
+                      '</owl:NamedIndividual>', '', '']
+            owl.write('\n'.join(lines))
+        owl.write(text[end:])
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('output', type=pl.Path, help='the RDF/XML file to write')
+    parser.add_argument('--kpis', type=int, default=10000, help='synthetic KPIs to add')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random choices')
+    args = parser.parse_args()
+    generate(args.output, args.kpis, args.seed)
+
+
+if __name__ == '__main__':
+    main()
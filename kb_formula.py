@@ -0,0 +1,485 @@
+import re  # Regular expressions for tokenizing formulas
+from dataclasses import dataclass  # Immutable AST node definitions
+from functools import reduce  # Left folds of S° operands
+
+import numpy as np  # Vectorized evaluation of formulas
+
+# === FORMULA GRAMMAR ===
+# A parsable_computation_formula is one expression of the following grammar, where blanks
+# between tokens are ignored:
+#
+#   expression  := aggregation | operation | data | reference | constant
+#   aggregation := 'A°' FUNCTION '°' AXES '[' expression ']'
+#   operation   := 'S°' OPERATOR '[' expression { ';' expression } ']'
+#   data        := 'D°' NAME '°' ARGUMENT '°' ARGUMENT '°' ARGUMENT '°'
+#   reference   := 'R°' NAME '°' ARGUMENT '°' ARGUMENT '°' ARGUMENT '°'
+#   constant    := 'C°' NUMBER '°'
+#
+# AXES is a non-empty combination of the time (t), machine (m) and operation (o) axes, and the
+# three arguments of data series and KPI references refer to these axes, in this order.
+
+AGGREGATIONS = ('sum', 'mean', 'min', 'max')  # Functions allowed in A° aggregations
+OPERATORS = ('+', '-', '*', '/')  # Operators allowed in S° operations
+AXES = 'tmo'  # Time, machine and operation axes, in canonical order
+
+# NumPy implementations of the aggregations and operators
+_AGGREGATE = {'sum': np.sum, 'mean': np.mean, 'min': np.min, 'max': np.max}
+_OPERATE = {'+': np.add, '-': np.subtract, '*': np.multiply, '/': np.divide}
+
+_NAME = re.compile(r'\s*([A-Za-z0-9_]+)')
+_ARGUMENT = re.compile(r'\s*([A-Za-z0-9_]*)')
+_NUMBER = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+_SYMBOL = re.compile(r'\s*(\S)')
+
+
+class FormulaSyntaxError(ValueError):
+    """
+    Raised when a formula does not follow the grammar, reporting where parsing failed.
+    """
+
+    def __init__(self, message, formula, position):
+        super().__init__(f'{message} at position {position} of {formula!r}')
+        self.formula = formula
+        self.position = position
+
+
+class ReferenceCycleError(ValueError):
+    """
+    Raised when evaluating a formula reaches a KPI whose own evaluation is in progress, reporting the cycle.
+    """
+
+    def __init__(self, cycle):
+        super().__init__('Cycle of KPI references: ' + ' -> '.join(cycle))
+        self.cycle = cycle
+
+
+@dataclass(frozen=True)
+class Aggregation:
+    """A°function°axes[ operand ]: reduces the operand over the given axes."""
+    function: str
+    axes: str
+    operand: object
+
+
+@dataclass(frozen=True)
+class Operation:
+    """S°operator[ operand ; ... ]: applies the operator element-wise, left to right."""
+    operator: str
+    operands: tuple
+
+
+@dataclass(frozen=True)
+class DataRef:
+    """D°name°time°machine°operation°: a raw data series."""
+    name: str
+    time: str
+    machine: str
+    operation: str
+
+
+@dataclass(frozen=True)
+class KpiRef:
+    """R°name°time°machine°operation°: the value of another KPI."""
+    name: str
+    time: str
+    machine: str
+    operation: str
+
+
+@dataclass(frozen=True)
+class Constant:
+    """C°value°: a numeric constant."""
+    value: float
+
+
+def parse_formula(formula):
+    """
+    Parses a parsable_computation_formula into its abstract syntax tree.
+
+    Parameters:
+    - formula (str): The formula to parse.
+
+    Returns:
+    - node: The root node (Aggregation, Operation, DataRef, KpiRef or Constant) of the formula.
+
+    Raises:
+    - FormulaSyntaxError: If the formula does not follow the grammar.
+    """
+    node, position = _parse_expression(formula, 0)
+    if formula[position:].strip():
+        raise FormulaSyntaxError('Unexpected trailing text', formula, position)
+    return node
+
+
+def _expect(pattern, formula, position, what):
+    """
+    Matches a token at the given position, raising a FormulaSyntaxError if it is missing.
+
+    Returns:
+    - tuple: The matched text and the position right after it.
+    """
+    match = pattern.match(formula, position)
+    if not match:
+        raise FormulaSyntaxError('Expected ' + what, formula, position)
+    return match.group(1), match.end()
+
+
+def _expect_symbol(symbol, formula, position):
+    """
+    Consumes the given single-character symbol, raising a FormulaSyntaxError if it is missing.
+
+    Returns:
+    - int: The position right after the symbol.
+    """
+    found, end = _expect(_SYMBOL, formula, position, repr(symbol))
+    if found != symbol:
+        raise FormulaSyntaxError(f'Expected {symbol!r} but found {found!r}', formula, position)
+    return end
+
+
+def _parse_expression(formula, position):
+    """
+    Parses the expression starting at the given position.
+
+    Returns:
+    - tuple: The parsed node and the position right after it.
+    """
+    kind, position = _expect(_SYMBOL, formula, position, 'an expression')
+    position = _expect_symbol('°', formula, position)
+
+    if kind == 'A':
+        function, position = _expect(_NAME, formula, position, 'an aggregation function')
+        if function not in AGGREGATIONS:
+            raise FormulaSyntaxError(f'Unknown aggregation {function!r}', formula, position)
+        position = _expect_symbol('°', formula, position)
+        axes, position = _expect(_NAME, formula, position, 'aggregation axes')
+        if any(axis not in AXES for axis in axes) or len(set(axes)) != len(axes):
+            raise FormulaSyntaxError(f'Invalid aggregation axes {axes!r}', formula, position)
+        position = _expect_symbol('[', formula, position)
+        operand, position = _parse_expression(formula, position)
+        position = _expect_symbol(']', formula, position)
+        return Aggregation(function, axes, operand), position
+
+    if kind == 'S':
+        operator, position = _expect(_SYMBOL, formula, position, 'an operator')
+        if operator not in OPERATORS:
+            raise FormulaSyntaxError(f'Unknown operator {operator!r}', formula, position)
+        position = _expect_symbol('[', formula, position)
+        operands = []
+        while True:
+            operand, position = _parse_expression(formula, position)
+            operands.append(operand)
+            separator, position = _expect(_SYMBOL, formula, position, "';' or ']'")
+            if separator == ']':
+                break
+            if separator != ';':
+                raise FormulaSyntaxError(f"Expected ';' or ']' but found {separator!r}", formula, position - 1)
+        return Operation(operator, tuple(operands)), position
+
+    if kind in ('D', 'R'):
+        name, position = _expect(_NAME, formula, position, 'a name')
+        position = _expect_symbol('°', formula, position)
+        arguments = []
+        for _ in AXES:
+            argument, position = _expect(_ARGUMENT, formula, position, 'an argument')
+            position = _expect_symbol('°', formula, position)
+            arguments.append(argument)
+        return (DataRef if kind == 'D' else KpiRef)(name, *arguments), position
+
+    if kind == 'C':
+        value, position = _expect(_NUMBER, formula, position, 'a number')
+        position = _expect_symbol('°', formula, position)
+        return Constant(float(value)), position
+
+    raise FormulaSyntaxError(f'Unknown expression type {kind!r}', formula, position - 1)
+
+
+def iter_nodes(node):
+    """
+    Walks a formula tree in pre-order, i.e. in the order its tokens appear in the formula.
+
+    Parameters:
+    - node: The root of the tree to walk.
+
+    Returns:
+    - generator: Every node of the tree, the root included.
+    """
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        if isinstance(current, Aggregation):
+            stack.append(current.operand)
+        elif isinstance(current, Operation):
+            stack.extend(reversed(current.operands))
+
+
+def kpi_references(node):
+    """
+    Lists the KPI labels referenced (R°) by a formula tree, in order of appearance.
+
+    Parameters:
+    - node: The root of the formula tree.
+
+    Returns:
+    - list: The referenced KPI labels, with repetitions.
+    """
+    return [current.name for current in iter_nodes(node) if isinstance(current, KpiRef)]
+
+
+# === EVALUATION ===
+# Values are (array, axes) pairs, where axes lists the axes of the array in canonical order
+# ('mo' for an array indexed by machine and operation, '' for a scalar).
+#
+# Each KPI is evaluated in a context binding every axis to one of:
+#   'all'       the KPI aggregates over the axis as its formula says;
+#   'keep'      the caller wants one value per position, so aggregations leave the axis alone;
+#   ('select', name)  the axis is restricted to the named machine or operation.
+# A reference R°name°t°m°o° derives the context of the referenced KPI from its arguments: an
+# uppercase axis letter means 'all', a lowercase one 'keep' (or the selection already in force),
+# and any other name selects that machine or operation.
+
+_TOP_CONTEXT = ('all', 'all', 'all')  # Context of a KPI evaluated on its own
+
+
+def evaluate(node, data, references, machines=None, operations=None, memo=None):
+    """
+    Evaluates a formula tree over data series given as time x machine x operation arrays.
+
+    Parameters:
+    - node: The root of the formula tree.
+    - data (dict): Maps the name of every D° data series to a NumPy array of shape
+      (time, machine, operation).
+    - references (callable): Returns the formula tree of the KPI with the given label, for R° references.
+    - machines (list, optional): Names of the machines along the machine axis, for references selecting one.
+    - operations (list, optional): Names of the operations along the operation axis, for references selecting one.
+    - memo (dict, optional): Cache of evaluated subexpressions, shared across calls to reuse their values.
+
+    Returns:
+    - tuple: The value as a NumPy array and the string of its remaining axes, in canonical order.
+
+    Raises:
+    - ValueError: If a data series, a referenced KPI or a selected machine or operation is unknown.
+    - ReferenceCycleError: If the referenced KPIs reference each other in a cycle.
+    """
+    env = _environment(data, references, machines, operations, memo)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _evaluate(node, _TOP_CONTEXT, env)
+
+
+def evaluate_many(nodes, data, references, machines=None, operations=None):
+    """
+    Evaluates several formula trees together, computing every common subexpression only once.
+
+    Two subexpressions are shared when they are structurally identical and evaluated in the same
+    context, whether they appear in different formulas or in a KPI referenced by several of them.
+
+    Parameters:
+    - nodes (dict): Maps labels to the formula trees to evaluate. Evaluating them in topological
+      order lets later formulas reuse the values of the KPIs they reference.
+    - data, references, machines, operations: As for evaluate.
+
+    Returns:
+    - tuple:
+      - results (dict): Maps every label to its (value, axes) pair, or to the ValueError (or
+        ReferenceCycleError) raised while evaluating it.
+      - stats (dict): How much work sharing saved:
+        - 'naive_evaluations': Node evaluations needed to evaluate every formula on its own.
+        - 'evaluations': Node evaluations actually performed.
+        - 'reused': Times an already computed subexpression was reused.
+        - 'shared_subexpressions': Distinct subexpressions reused at least once.
+        - 'saved_fraction': Share of the naive evaluations that were avoided.
+    """
+    env = _environment(data, references, machines, operations, {})
+    results = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for label, node in nodes.items():
+            try:
+                results[label] = _evaluate(node, _TOP_CONTEXT, env)
+            except ValueError as e:
+                results[label] = e
+
+    costs = {}
+    naive = sum(_cost(node, _TOP_CONTEXT, references, costs) for node in nodes.values())
+    evaluations = len(env['memo'])
+    stats = {
+        'naive_evaluations': naive,
+        'evaluations': evaluations,
+        'reused': sum(env['hits'].values()),
+        'shared_subexpressions': len(env['hits']),
+        'saved_fraction': 1 - evaluations / naive if naive else 0.0,
+    }
+    return results, stats
+
+
+def _environment(data, references, machines, operations, memo):
+    """
+    Bundles what every step of an evaluation needs to look up.
+    """
+    return {
+        'data': data,
+        'references': references,
+        'positions': {'t': {}, 'm': {name: i for i, name in enumerate(machines or ())},
+                      'o': {name: i for i, name in enumerate(operations or ())}},
+        'memo': memo,
+        'hits': {},  # Maps memo keys to the number of times they were reused
+        'aggregated': {},  # Maps nodes to the axes they aggregate over (see _aggregated_axes)
+        'expanding': [],  # Labels of the referenced KPIs being evaluated, outermost first
+    }
+
+
+def _cost(node, context, references, costs):
+    """
+    Counts the node evaluations needed to evaluate a node without sharing any subexpression.
+
+    Returns:
+    - int: The number of nodes evaluated, those of referenced formulas included.
+    """
+    key = (node, context)
+    if key not in costs:
+        costs[key] = 1  # Reached again only through a cycle of references, which counts once
+        if isinstance(node, Aggregation):
+            costs[key] = 1 + _cost(node.operand, context, references, costs)
+        elif isinstance(node, Operation):
+            costs[key] = 1 + sum(_cost(operand, context, references, costs) for operand in node.operands)
+        elif isinstance(node, KpiRef) and references(node.name) is not None:
+            costs[key] = 1 + _cost(references(node.name), _reference_context(node, context), references, costs)
+        else:
+            costs[key] = 1
+    return costs[key]
+
+
+def _evaluate(node, context, env):
+    """
+    Evaluates a node in the given context, going through the memo when there is one.
+
+    Returns:
+    - tuple: The value as a NumPy array and the string of its axes.
+    """
+    memo = env['memo']
+    if memo is None:
+        return _evaluate_node(node, context, env)
+
+    # 'keep' only differs from 'all' on the axes the node aggregates over
+    aggregated = _aggregated_axes(node, env)
+    key = (node, tuple('all' if binding == 'keep' and axis not in aggregated else binding
+                       for axis, binding in zip(AXES, context)))
+    if key in memo:
+        env['hits'][key] = env['hits'].get(key, 0) + 1
+    else:
+        memo[key] = _evaluate_node(node, context, env)
+    return memo[key]
+
+
+def _evaluate_node(node, context, env):
+    """
+    Computes the value of a node in the given context.
+
+    Returns:
+    - tuple: The value as a NumPy array and the string of its axes.
+    """
+    if isinstance(node, Constant):
+        return np.asarray(node.value), ''
+
+    if isinstance(node, DataRef):
+        if node.name not in env['data']:
+            raise ValueError(f'Data series {node.name!r} not provided')
+        array = np.asarray(env['data'][node.name], dtype=float)
+        if array.ndim != len(AXES):
+            raise ValueError(f'Data series {node.name!r} must have shape (time, machine, operation)')
+
+        # Restrict the axes selected by the series itself or by the context
+        index, axes = [], ''
+        for axis, argument, binding in zip(AXES, (node.time, node.machine, node.operation), context):
+            if argument.lower() != axis and argument:
+                binding = ('select', argument)
+            if isinstance(binding, tuple):
+                index.append(_position(axis, binding[1], env))
+            else:
+                index.append(slice(None))
+                axes += axis
+        return array[tuple(index)], axes
+
+    if isinstance(node, Aggregation):
+        array, axes = _evaluate(node.operand, context, env)
+        reduced = tuple(axes.index(axis) for axis in node.axes
+                        if axis in axes and context[AXES.index(axis)] != 'keep')
+        if not reduced:
+            return array, axes
+        remaining = ''.join(axis for i, axis in enumerate(axes) if i not in reduced)
+        return _AGGREGATE[node.function](array, axis=reduced), remaining
+
+    if isinstance(node, Operation):
+        values = [_evaluate(operand, context, env) for operand in node.operands]
+        axes = ''.join(axis for axis in AXES if any(axis in value[1] for value in values))
+        arrays = [_align(array, value_axes, axes) for array, value_axes in values]
+        return reduce(_OPERATE[node.operator], arrays), axes
+
+    if isinstance(node, KpiRef):
+        formula = env['references'](node.name)
+        if formula is None:
+            raise ValueError(f'Referenced KPI {node.name!r} not found')
+        expanding = env['expanding']
+        if node.name in expanding:
+            raise ReferenceCycleError(expanding[expanding.index(node.name):] + [node.name])
+        expanding.append(node.name)
+        try:
+            return _evaluate(formula, _reference_context(node, context), env)
+        finally:
+            expanding.pop()
+
+    raise ValueError(f'Cannot evaluate {node!r}')
+
+
+def _aggregated_axes(node, env):
+    """
+    Lists the axes a node aggregates over. Only on these axes does a 'keep' binding change the
+    value of the node: data series keep both kinds of axes, and references rebind them anyway.
+
+    Returns:
+    - str: The axes, in any order.
+    """
+    cache = env['aggregated']
+    if node not in cache:
+        if isinstance(node, Aggregation):
+            cache[node] = ''.join(set(node.axes) | set(_aggregated_axes(node.operand, env)))
+        elif isinstance(node, Operation):
+            cache[node] = ''.join(set().union(*(_aggregated_axes(operand, env) for operand in node.operands)))
+        else:
+            cache[node] = ''
+    return cache[node]
+
+
+def _reference_context(node, context):
+    """
+    Derives the context in which a referenced KPI is evaluated from the arguments of the reference.
+
+    Returns:
+    - tuple: The binding of every axis for the referenced formula.
+    """
+    inner = []
+    for axis, argument, binding in zip(AXES, (node.time, node.machine, node.operation), context):
+        if not argument or argument == axis.upper():
+            inner.append('all')
+        elif argument == axis:
+            inner.append(binding if isinstance(binding, tuple) else 'keep')
+        else:
+            inner.append(('select', argument))
+    return tuple(inner)
+
+
+def _position(axis, name, env):
+    """
+    Returns the index of a named machine or operation along its axis.
+    """
+    positions = env['positions'][axis]
+    if name not in positions:
+        raise ValueError(f'Unknown {dict(t="time", m="machine", o="operation")[axis]} {name!r}')
+    return positions[name]
+
+
+def _align(array, axes, target):
+    """
+    Inserts unit dimensions so that an array with the given axes broadcasts against the target axes.
+    """
+    return array[tuple(slice(None) if axis in axes else np.newaxis for axis in target)]
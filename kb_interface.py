@@ -1,12 +1,38 @@
 import owlready2 as or2  # Library for working with OWL ontologies
-import re  # Regular expressions for string pattern matching
 import hashlib  # For generating secure hash codes
 import base64  # For encoding hash values
 import pathlib as pl  # For handling file paths
 import math  # Mathematical operations
 import os  # Operating system utilities
+import heapq  # Priority queues for top-k selection
+import threading  # Background persistence of the ontology
+import json  # Records of the mutation journal
+import time  # Age of the mutations not yet in a snapshot
+import atexit  # Flush pending backups when the interpreter exits
+import sqlite3  # Copies of the quadstore backups
+import pickle  # Read model saved with the backups
+import copy  # Copy-on-write of the published snapshot
+import mmap  # Generation counter shared by the processes serving the same backups
+import struct  # Layout of the shared generation counter
+import zlib  # Stable hashing of the character n-grams of the 'w2v' vectors
+import gzip  # Compressed RDF/XML backups
+import io  # Ontology serialized in memory before it is compressed
+from multiprocessing import connection  # Mutations forwarded to the writer process
+import multiprocessing  # Start method of the matching processes
+from concurrent.futures import ProcessPoolExecutor  # Processes running the approximate label matches
+from concurrent.futures.process import BrokenProcessPool  # A matching process that died
+from collections import deque, OrderedDict  # FIFO queues for graph traversals, LRU of closest-label matches
+
+try:
+    import fcntl  # Lock electing the writer process (POSIX only)
+except ImportError:
+    fcntl = None
 
 import Levenshtein  # Library for calculating Levenshtein distance (string similarity)
+import numpy as np  # Vectorized candidate filtering for approximate label matching
+
+import kb_formula as kbf  # Parser for the parsable_computation_formula grammar
+import kb_metrics as kbm  # Counters and histograms exposed by the /metrics endpoint
 
 # === GLOBAL VARIABLES ===
 # Directory for ontology backup files
@@ -18,6 +44,10 @@ ONTO_PATH = ['KB_original']
 # Path to the configuration file
 CONFIG_PATH = pl.Path('./config.cfg')
 
+# Format of the backups: 'owl' keeps them as RDF/XML files (N.owl), 'sqlite' as owlready2 quadstores
+# (N.sqlite3), which start() opens without parsing the whole ontology again
+BACKEND = 'owl'
+
 # === ONTOLOGY RELATED GLOBAL VARIABLES ===
 # These variables store ontology objects or classes extracted during initialization
 ONTO = None  # The global ontology object
@@ -30,141 +60,2051 @@ OPERATION_CASS = None  # Ontology class for operations
 MACHINE_CASS = None  # Ontology class for machines
 KPI_CLASS = None  # Ontology class for Key Performance Indicators (KPIs)
 
-# === FUNCTION DEFINITIONS ===
+# === LABEL INDEX ===
+# Built by start() so that lookups by label do not have to query the ontology
+LABEL_INDEX = {}  # Maps every label to the list of entities (classes, individuals, properties) carrying it
+DUPLICATE_LABELS = set()  # Labels shared by more than one entity, which cannot be resolved unambiguously
+
+# === READ MODEL ===
+# Plain Python copy of what the read functions return, so that they do not walk owlready2 objects. It is
+# saved next to every backup (N.model) with the indexes below, keyed by a hash of the backup file, and
+# start() loads it instead of rebuilding everything from the ontology.
+READ_MODEL_VERSION = 6  # Bumped whenever the saved layout changes, making older files stale
+READ_ONLY = False  # Set by start(read_only=True): mutations are refused
+
+# === FUZZY LABEL INDEX ===
+# Bigram indexes over the labels each get_closest_* function compares against, keyed by kind
+FUZZY_KINDS = ('kpi_formulas', 'class_instances', 'object_properties')
+# The 'w2v' method compares labels as vectors of the counts of their character n-grams, hashed into
+# W2V_DIMENSIONS buckets; the vectors of the labels of every kind form one matrix of the index
+W2V_DIMENSIONS = 128
+W2V_NGRAMS = (2, 3, 4)  # Lengths of the n-grams counted
+_NGRAM_BUCKETS = {}  # Memoized bucket of every n-gram met so far
+# The posting lists of the bigram indexes as NumPy arrays, converted by the searches that read them. They are
+# kept out of the SNAPSHOT, which readers must not modify: an entry is valid as long as its list is the one
+# of the index (lists are replaced, not modified, when a label is added).
+_POSTING_ARRAYS = {}  # Maps (kind, bigram) to (posting list, the list as a NumPy array)
+
+# === CLOSEST-LABEL CACHE ===
+# Matches of the queries get_closest_labels answered recently, so that the labels clients misspell over and
+# over are matched only once. The entries of a kind are only valid for the labels they were matched against:
+# adding a label replaces the 'fuzzy_labels' list of its kinds (copy-on-write), which invalidates them.
+CLOSEST_CACHE_SIZE = 4096  # Entries kept per kind, the least recently used being dropped first
+_CLOSEST_CACHE = {}  # Maps each kind to [the 'fuzzy_labels' list of the entries, OrderedDict of the entries]
+_CLOSEST_STATS = {'hits': 0, 'misses': 0}
+_CLOSEST_LOCK = threading.Lock()
+_CLOSURE_LOCK = threading.Lock()  # Guards the 'kpi_closure' memo of the snapshots, filled by readers
+
+# === MATCHING PROCESSES ===
+# An approximate label match holds the GIL for much of its time, so the threads matching at once stall every
+# other thread of the process, such as the event loop of the API. With MATCH_PROCESSES set, the matches of
+# the kinds with at least MATCH_PROCESS_MIN_LABELS labels run in a pool of that many processes instead. Each
+# of them starts the KB read-only on the same backups folder, and catches up with the journal to match
+# against the very revision of the SNAPSHOT it is asked for (see _reach_revision). A revision it cannot
+# reach, such as one whose last mutation is not journaled yet, is matched in the calling thread.
+MATCH_PROCESSES = 0  # Processes of the pool, 0 to match in the calling thread
+MATCH_PROCESS_MIN_LABELS = 10000  # Below that, sending the queries costs more than matching them
+MATCH_PROCESS_NICENESS = 10  # Added to the niceness of the processes of the pool (POSIX only)
+_MATCH_STATE = {'pool': None}
+_MATCH_LOCK = threading.Lock()  # Guards the creation of the pool
+
+# === KPI PAGE CURSORS ===
+# Position of every KPI label in the list get_kpi_page pages through, so that a cursor is found without
+# scanning the list. KPIs are only appended, so a position stays right in later versions: it is checked
+# against the list read, and the positions are only rebuilt for a cursor added since.
+_KPI_POSITIONS = {'positions': {}}
+
+# === PUBLISHED SNAPSHOT ===
+# Everything the read functions answer from, as one immutable version of the KB. A read function takes
+# the current SNAPSHOT once and only reads that version, so it needs no lock and never sees a mutation
+# half applied. Writers build the next version as a draft (see _draft), copying the containers they
+# change, and replace SNAPSHOT with it in a single assignment (see _publish). The keys are:
+# - 'generation': Number of the version, increased by every publication.
+# - 'revision': (epoch, backup number, mutations applied after it), which names the same content in every
+#   process serving the backups folder, unlike the generation. The epoch is drawn by every start() of the
+#   writer (see _new_epoch), so that a restart never names different content like an earlier run did.
+# - 'read_model': See _build_read_model.
+# - 'formula_ast': Maps every KPI label to the syntax tree of its parsable_computation_formula.
+# - 'kpi_dependencies': Maps every KPI label to the distinct KPI labels its formula references, in order.
+# - 'kpi_dependents': Maps a KPI label to the set of KPI labels whose formula references it.
+# - 'kpi_order': KPI labels in topological order, every KPI after the KPIs it references.
+# - 'kpi_closure': Memoized get_formulas results: KPI label -> {label: formula} (None if unresolvable).
+#   The only container readers add to, under _CLOSURE_LOCK; it is never saved with the read model.
+# - 'property_views': Maps the IRI of every entity with a label of its own to what get_object_properties returns.
+# - 'hierarchy': Interval numbering, ancestors and instances of every class (see _build_hierarchy).
+# - 'fuzzy_index': Maps each of FUZZY_KINDS to its bigram index and 'w2v' vectors (see _fuzzy_insert).
+# - 'fuzzy_labels': Maps each kind to its labels, in the order the linear scan used to visit them.
+SNAPSHOT = {'generation': 0, 'revision': (0, 0, 0), 'read_model': {'labels': {}, 'entities': {}}, 'formula_ast': {},
+            'kpi_dependencies': {}, 'kpi_dependents': {}, 'kpi_order': [], 'kpi_closure': {},
+            'property_views': {}, 'hierarchy': {'intervals': {}, 'ancestors': {}, 'instances': {}},
+            'fuzzy_index': {}, 'fuzzy_labels': {}}
+
+# === PERSISTENCE ===
+# Every mutation is appended to the journal of the latest backup (N.journal next to N.owl.gz) by a
+# background worker, which writes every mutation made while it was busy with a single fsync
+# (group commit). A full backup of the ontology is only taken every SNAPSHOT_EVERY mutations or
+# SNAPSHOT_INTERVAL seconds, and start() replays the journal of the backup it loads.
+DURABILITY = 'flush'  # 'flush': add_kpi returns once its mutation is journaled; 'enqueue': once it is scheduled
+SNAPSHOT_EVERY = 64  # Journaled mutations after which a new backup is taken
+SNAPSHOT_INTERVAL = 60.0  # Seconds after which a journaled mutation is included in a new backup
+BACKUP_COMPRESSLEVEL = 6  # gzip level of the RDF/XML backups (N.owl.gz)
+RETRY_DELAY = 1.0  # Seconds the worker waits before writing again after a failed journal append or backup
+KB_LOCK = threading.RLock()  # Serializes mutations and saves of the ontology
+_PERSIST_CONDITION = threading.Condition()  # Guards _PERSIST_STATE and signals its changes
+_PERSIST_STATE = {
+    'requested': 0,  # Sequence number of the last mutation scheduled for saving
+    'saved': 0,  # Sequence number of the last mutation written to the journal
+    'records': [],  # Journal records of the mutations scheduled but not written yet
+    'journaled': 0,  # Mutations in the journal of the latest backup
+    'journal_started': None,  # time.monotonic() of the first of them
+    'failed': (0, None),  # Last sequence number whose journal append failed, and the exception raised
+    'worker': None,  # The background thread, started on the first scheduled backup
+    'stop': False,  # Set by shutdown() to let the worker exit once everything is saved
+    'backing_up': False,  # Set while the worker writes a backup, which it does without holding KB_LOCK
+}
+
+# === MULTI-PROCESS DEPLOYMENT ===
+# Several processes can serve the same backups folder (e.g. uvicorn --workers N) when they are started
+# with start_shared(). The process holding the writer lock (backups/writer.lock) is the only one to
+# load the ontology and write files; it applies the mutations the others forward to it over a Unix
+# socket (backups/writer.sock), and bumps a counter shared through a memory map (backups/generation)
+# whenever the journal or the latest backup changes. The other processes, followers, answer reads from
+# the read model and catch up in refresh() when the counter moves: they apply the new journal records,
+# or load the read model of the new backup.
+_SHARED_STATE = {
+    'role': None,  # 'writer' or 'follower' once start_shared() ran, None for a process started by start()
+    'lock': None,  # The open writer lock file (writer)
+    'listener': None,  # The socket accepting forwarded mutations (writer)
+    'generation': None,  # Memory map of the shared generation counter
+    'seen': 0,  # Value of the counter the published SNAPSHOT is up to date with (follower)
+    'journal_offset': 0,  # Bytes of the journal of the loaded backup already applied
+}
+
+# === FUNCTION DEFINITIONS ===
+
+def start(backup_number=1, read_only=False):
+    """
+    Initializes the global ontology and related variables. 
+    This function must necessarily be called every time it is desired 
+    to initialize the KB and use other methods to interact.
+    
+    Parameters:
+    - backup_number (int, optional): The number indicating which backup file to load, inside the backup folder.
+      If not specified, it reads the configuration file to determine the latest backup.
+      The mutations journaled after that backup are replayed on top of it.
+    - read_only (bool, optional): Serve reads only, from the read model saved with the backup, without
+      loading the ontology unless mutations have to be replayed. add_kpi is refused and the configuration
+      file is left untouched.
+
+    Global Variables Modified:
+    - SAVE_INT: Save interval value read or set.
+    - ONTO: The ontology object loaded from the backup (None if read_only spared loading it).
+    - PARSABLE_FORMULA, HUMAN_READABLE_FORMULA, UNIT_OF_MEASURE, DEPENDS_ON,
+      OPERATION_CASS, MACHINE_CASS, KPI_CLASS: Specific ontology classes extracted.
+    - LABEL_INDEX, DUPLICATE_LABELS: Label lookup tables rebuilt from the loaded ontology.
+    - SNAPSHOT, READ_ONLY: What the read functions answer from: read model, parsed formulas,
+      dependency graph between KPIs and approximate-match index of the get_closest_* functions.
+    """
+    # Write the pending backups of the ontology being replaced
+    flush()
+
+    # Declare global variables to ensure they are modified globally
+    global SAVE_INT, ONTO, PARSABLE_FORMULA, HUMAN_READABLE_FORMULA
+    global UNIT_OF_MEASURE, DEPENDS_ON, OPERATION_CASS, MACHINE_CASS, KPI_CLASS
+    global LABEL_INDEX, DUPLICATE_LABELS, READ_ONLY
+
+    if backup_number:
+        SAVE_INT = backup_number
+        # Update the configuration file with the new backup number
+        if not read_only:
+            _write_config(backup_number)
+    else:
+        # Read the latest save interval from the configuration file
+        with open(CONFIG_PATH, 'r') as cfg:
+            SAVE_INT = int(cfg.read())
+
+    READ_ONLY = read_only
+    epoch = _read_epoch() if read_only else _new_epoch()
+    saved_state = _load_read_model(SAVE_INT - 1)
+
+    ONTO = LABEL_INDEX = DUPLICATE_LABELS = None
+    PARSABLE_FORMULA = HUMAN_READABLE_FORMULA = UNIT_OF_MEASURE = DEPENDS_ON = None
+    OPERATION_CASS = MACHINE_CASS = KPI_CLASS = None
+    # A read-only KB only needs the ontology to build the read model, or to replay mutations journaled
+    # without the read model changes they made
+    replayable = saved_state and all('read_model' in kpi for record in _read_journal(0)[0]
+                                     for kpi in record.get('kpis', [record]))
+    if not (read_only and replayable):
+        # Load ontology corresponding to the save interval
+        ONTO = _load_backup(SAVE_INT - 1)
+
+        # Index every class, individual and property by its labels
+        LABEL_INDEX = {}
+        DUPLICATE_LABELS = set()
+        for entity in list(ONTO.classes()) + list(ONTO.individuals()) + list(ONTO.properties()):
+            _index_entity(entity)
+
+        # Search and assign specific ontology classes by their labels
+        PARSABLE_FORMULA = _search('parsable_computation_formula')[0]
+        HUMAN_READABLE_FORMULA = _search('human_readable_formula')[0]
+        UNIT_OF_MEASURE = _search('unit_of_measure')[0]
+        DEPENDS_ON = _search('depends_on')[0]
+        OPERATION_CASS = _search('operation')[0]
+        MACHINE_CASS = _search('machine')[0]
+        KPI_CLASS = _search('kpi')[0]
+
+    if saved_state:
+        # The read model and the indexes derived from the ontology were saved with the backup
+        draft = _draft(dict(saved_state, generation=SNAPSHOT['generation'], kpi_closure={}))
+    else:
+        draft = _draft(_empty_snapshot())
+        _build_read_model(draft)
+        _build_hierarchy(draft)
+
+        # Parse the formula of every KPI once
+        formula_ast = _writable(draft, draft, 'formula_ast')
+        for ind in KPI_CLASS.instances():
+            if ind.label and PARSABLE_FORMULA[ind]:
+                try:
+                    formula_ast[str(ind.label.first())] = kbf.parse_formula(PARSABLE_FORMULA[ind][0])
+                except kbf.FormulaSyntaxError as e:
+                    print('INVALID FORMULA FOR KPI', ind.label.first(), ':', e)
+
+        # Build the dependency graph between KPIs and sort it
+        for lab in formula_ast:
+            _add_dependencies(draft, lab)
+        draft['kpi_order'] = _sort_kpis(draft)
+
+        # Build the approximate-match index for every kind of get_closest_* lookup
+        for kind in FUZZY_KINDS:
+            for lab in _fuzzy_candidates(kind):
+                _fuzzy_insert(draft, kind, lab)
+
+        # Materialize what get_object_properties returns for every entity
+        _build_property_views(draft)
+
+        # Save them so that the next start on this backup can skip all of the above
+        if not read_only:
+            _save_read_model(SAVE_INT - 1, draft)
+
+    with KB_LOCK:
+        # Apply the mutations made after the backup was taken, then let the readers see the result
+        _SHARED_STATE['journal_offset'] = 0
+        draft['revision'] = (epoch, SAVE_INT - 1, 0)
+        replayed = _replay_journal(draft)
+        _publish(draft)
+    with _PERSIST_CONDITION:
+        _PERSIST_STATE['journaled'] = replayed
+        _PERSIST_STATE['journal_started'] = time.monotonic() if replayed else None
+
+    # Print success message
+    print("Ontology successfully initialized!")
+
+def _new_epoch():
+    """
+    Draws the epoch of a start() of the KB from the clock and saves it (backups/epoch) for the read-only
+    processes serving the same backups folder.
+
+    Returns:
+    - int: The epoch, in nanoseconds since 1970.
+    """
+    epoch = time.time_ns()
+    _write_atomic(MAIN_DIR / 'epoch', str(epoch).encode())
+    return epoch
+
+def _read_epoch():
+    """
+    Returns the epoch saved by the last start() of the writer, or 0 if it never started on this folder.
+    """
+    try:
+        with open(MAIN_DIR / 'epoch', 'r') as file:
+            return int(file.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def _empty_snapshot():
+    """
+    Returns a snapshot of an empty KB, with an empty approximate-match index for every kind.
+    """
+    return {'generation': 0, 'revision': (0, 0, 0), 'read_model': {'labels': {}, 'entities': {}}, 'formula_ast': {},
+            'kpi_dependencies': {}, 'kpi_dependents': {}, 'kpi_order': [], 'kpi_closure': {},
+            'property_views': {}, 'hierarchy': {'intervals': {}, 'ancestors': {}, 'instances': {}},
+            'fuzzy_index': {kind: {'positions': {}, 'lengths': np.zeros(0, dtype=np.int64),
+                                   'gram_counts': np.zeros(0, dtype=np.int64),
+                                   'vectors': np.zeros((0, W2V_DIMENSIONS), dtype=np.float32),
+                                   'postings': {}}
+                            for kind in FUZZY_KINDS},
+            'fuzzy_labels': {kind: [] for kind in FUZZY_KINDS}}
+
+def _draft(snapshot=None):
+    """
+    Starts the next version of a snapshot, to be modified by a writer and then published with _publish.
+
+    Only the top-level dict is copied here: the functions modifying a draft get every container they
+    change through _writable, which copies it the first time, so the snapshot itself is never modified
+    and readers holding it are unaffected.
+
+    Parameters:
+    - snapshot (dict, optional): The version to start from (default is the published SNAPSHOT).
+
+    Returns:
+    - dict: The draft, sharing every unchanged container with the snapshot.
+    """
+    draft = dict(SNAPSHOT if snapshot is None else snapshot)
+    draft['owned'] = {id(draft): draft}  # Containers copied or created for this draft, keyed by id
+    return draft
+
+def _writable(draft, parent, key, factory=dict):
+    """
+    Returns parent[key] as a container that belongs to the draft and may be modified in place.
+
+    Parameters:
+    - draft (dict): The draft being built.
+    - parent (dict): A container of the draft, itself obtained through _writable (or the draft).
+    - key: The key of the container in parent.
+    - factory (callable, optional): Creates the container if parent has none under key (default is dict).
+
+    Returns:
+    - The container: parent[key] if the draft already owns it, otherwise a copy that replaces it in parent.
+    """
+    value = parent.get(key)
+    if value is not None and id(value) in draft['owned']:
+        return value
+    value = factory() if value is None else copy.copy(value)
+    parent[key] = value
+    draft['owned'][id(value)] = value
+    return value
+
+def _publish(draft):
+    """
+    Makes a draft the SNAPSHOT the read functions answer from. Must be called while holding KB_LOCK.
+    """
+    global SNAPSHOT
+    del draft['owned']
+    draft['generation'] = SNAPSHOT['generation'] + 1
+    SNAPSHOT = draft
+
+def _load_backup(number):
+    """
+    Loads a backup into a fresh world, so that a backup loaded again does not keep earlier mutations.
+
+    With the 'sqlite' backend the quadstore of the backup is copied to a working store of the process,
+    which is opened without reading the ontology: entities are loaded when they are first used. A backup
+    that only exists as an RDF/XML file is imported into a quadstore first.
+
+    Parameters:
+    - number (int): The number of the backup.
+
+    Returns:
+    - The ontology of the backup.
+    """
+    if BACKEND != 'sqlite':
+        return _load_rdfxml(or2.World(), number)
+
+    store = MAIN_DIR / (str(number) + '.sqlite3')
+    if not os.path.exists(store):
+        _import_store(number)
+
+    # The store of a backup is only read: mutations go to the working store of the process, since every
+    # process sharing the backups folder (see start_shared) loads and mutates its own copy
+    working = _working_store(os.getpid())
+    if ONTO is not None and ONTO.world.filename == str(working):
+        ONTO.world.close()
+    _remove_stale_stores()
+    source = sqlite3.connect('file:' + str(store) + '?mode=ro', uri=True)
+    try:
+        _copy_store(source, working)
+    finally:
+        source.close()
+    world = or2.World(filename=str(working))
+    return next(onto for iri, onto in world.ontologies.items() if iri != 'http://anonymous/')
+
+def _working_store(pid):
+    """
+    Returns the path of the working store of process pid.
+    """
+    return MAIN_DIR / ('working.' + str(pid) + '.sqlite3')
+
+def _remove_stale_stores():
+    """
+    Removes the working stores left by processes that are no longer running.
+    """
+    for path in MAIN_DIR.glob('working.*.sqlite3'):
+        pid = path.name.split('.')[1]
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            path.unlink(missing_ok=True)
+        except PermissionError:
+            pass  # Running under another user
+
+def _remove_working_store():
+    """
+    Removes the working store of the process when it exits.
+    """
+    _working_store(os.getpid()).unlink(missing_ok=True)
+
+atexit.register(_remove_working_store)
+
+def _import_store(number):
+    """
+    Creates the quadstore of a backup from its RDF/XML file. Processes importing the same backup at once
+    each write their own temporary file, the last one replacing the other's identical store.
+    """
+    store = MAIN_DIR / (str(number) + '.sqlite3')
+    tmp = MAIN_DIR / (str(number) + '.sqlite3.' + str(os.getpid()) + '.tmp')
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    world = or2.World(filename=str(tmp))
+    _load_rdfxml(world, number)
+    world.save()
+    world.close()
+    os.replace(tmp, store)
+
+def _load_rdfxml(world, number):
+    """
+    Loads the RDF/XML file of backup number into world, from N.owl.gz or, for the backups written before
+    they were compressed, N.owl. The file must match the manifest of the backup, if it has one.
+
+    Raises:
+    - RuntimeError: If the file does not match its manifest.
+    """
+    path = _rdfxml_file(number)
+    manifest = _read_manifest(number)
+    if manifest is not None and manifest['file'] == path.name and manifest['sha256'] != _file_hash(path):
+        print('CORRUPTED BACKUP', number)
+        raise RuntimeError('Backup ' + str(number) + ' does not match its manifest')
+    if path.suffix != '.gz':
+        return world.get_ontology(str(path)).load()
+    with gzip.open(path, 'rb') as owl:
+        return world.get_ontology(str(MAIN_DIR / (str(number) + '.owl'))).load(fileobj=owl)
+
+def _rdfxml_file(number):
+    """
+    Returns the path of the RDF/XML file of backup number: N.owl.gz, or N.owl if there is none.
+    """
+    compressed = MAIN_DIR / (str(number) + '.owl.gz')
+    return compressed if os.path.exists(compressed) else MAIN_DIR / (str(number) + '.owl')
+
+def _write_atomic(path, data):
+    """
+    Writes data to path through a temporary file, flushed to disk and renamed over path, so that a crash
+    leaves either the previous file or the complete new one.
+    """
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+    _fsync_dir()
+
+def _fsync_dir():
+    """
+    Flushes the entries of the backups folder to disk, so that the files renamed into it survive a crash
+    (POSIX only).
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    folder = os.open(MAIN_DIR, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(folder)
+    finally:
+        os.close(folder)
+
+def _manifest_path(number):
+    """
+    Returns the path of the manifest of backup number.
+    """
+    return MAIN_DIR / (str(number) + '.manifest')
+
+def _read_manifest(number):
+    """
+    Returns the manifest of backup number, or None if it has none (e.g. 0.owl) or it cannot be read.
+    """
+    try:
+        with open(_manifest_path(number), 'r', encoding='utf-8') as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return None
+
+def list_backups():
+    """
+    Lists the backups kept in the backup folder, any of which start(number + 1) restores.
+
+    Returns:
+    - list: The manifests of the backups, by increasing number. Each one is a dictionary with the keys:
+      - 'number' (int): The number of the backup.
+      - 'file' (str): The file it is loaded from, e.g. '3.owl.gz' ('3.sqlite3' with the 'sqlite' BACKEND).
+      - 'bytes' (int): The size of that file.
+      - 'sha256' (str): The SHA-256 hex digest of that file, checked when it is loaded.
+      - 'generation' (int): The generation of the SNAPSHOT it was taken from.
+      - 'entities' (dict): Its entity counts, as get_entity_counts returns them.
+      - 'created' (float): When it was taken, in seconds since the epoch.
+      Backups without a manifest, such as the initial 0.owl, are listed with 'number' and 'file' only.
+    """
+    numbers = set()
+    for path in MAIN_DIR.iterdir():
+        number, _, suffix = path.name.partition('.')
+        if number.isdigit() and suffix in ('owl', 'owl.gz', 'sqlite3'):
+            numbers.add(int(number))
+    backups = []
+    for number in sorted(numbers):
+        manifest = _read_manifest(number)
+        backups.append(manifest if manifest is not None else {'number': number, 'file': _backup_file(number).name})
+    return backups
+
+def _copy_store(source, path):
+    """
+    Copies a quadstore, replacing path only once the copy is complete.
+
+    Parameters:
+    - source (sqlite3.Connection): Connection to the quadstore, without pending changes.
+    - path (pathlib.Path): Where to write the copy.
+    """
+    tmp = path.with_name(path.name + '.tmp')
+    target = sqlite3.connect(tmp)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+    os.replace(tmp, path)
+
+def export_ontology(path, format='rdfxml'):
+    """
+    Writes the current ontology to a file, e.g. to get an RDF/XML copy of a 'sqlite' backup.
+
+    Parameters:
+    - path (str): The file to write.
+    - format (str, optional): 'rdfxml' (default) or 'ntriples'.
+    """
+    with KB_LOCK:
+        ONTO.save(file=str(path), format=format)
+
+def _write_config(number):
+    """
+    Writes the number of the next backup to the configuration file, replacing it at once so that
+    other processes never read it half written.
+    """
+    tmp = CONFIG_PATH.with_name(CONFIG_PATH.name + '.tmp')
+    with open(tmp, 'w') as cfg:
+        cfg.write(str(number))
+    os.replace(tmp, CONFIG_PATH)
+
+def _remove_backup(number):
+    """
+    Deletes the files of backup number, in whichever format they were written. The manifest goes first,
+    so that a backup is never listed with files missing.
+    """
+    for suffix in ('.manifest', '.owl', '.owl.gz', '.sqlite3', '.model'):
+        try:
+            os.remove(MAIN_DIR / (str(number) + suffix))
+        except FileNotFoundError:
+            pass
+
+def _backup_file(number):
+    """
+    Returns the path of the file backup number is loaded from with the current BACKEND.
+    """
+    if BACKEND == 'sqlite' and os.path.exists(MAIN_DIR / (str(number) + '.sqlite3')):
+        return MAIN_DIR / (str(number) + '.sqlite3')
+    return _rdfxml_file(number)
+
+def _file_hash(path):
+    """
+    Returns the SHA-256 hex digest of the content of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _entity_record(entity, relations=None):
+    """
+    Builds the read model record of an entity, holding what get_instances and get_object_properties return.
+
+    Parameters:
+    - entity: The ontology class, individual or property.
+    - relations (dict, optional): The result of _property_relations(), when building many records.
+
+    Returns:
+    - dict: The record, with the keys:
+      - 'kind': 'class', 'instance' or 'property'.
+      - 'label': The label of the entity.
+      - 'facts': The (name, value) pairs of its annotation, object and data properties, in the order
+        get_object_properties lists them ('depends_on_other_kpi' is filled in from the parsed formula when read).
+      - 'superclasses': Labels of its superclasses (classes and individuals).
+      - 'subclasses': IRIs of its direct subclasses (classes).
+      - 'instances': Labels of its instances, including those of its subclasses, when the record was built
+        (classes). The instances added later are only listed by the hierarchy index (see _build_hierarchy).
+      - 'kpi': Whether it is a KPI or a KPI class.
+      - 'formula': Its parsable computation formula, or None.
+    """
+    if relations is None:
+        relations = dict.fromkeys(_record_properties())
+    facts = []
+    formula = None
+    for (prop, name, kind), assertions in relations.items():
+        values = prop[entity] if assertions is None else assertions.get(entity)
+        if not values:
+            continue
+        if kind == 'object':
+            facts.append((name, [_extract_label(x.label) for x in values]))
+        else:
+            facts.append((name, str(values[0])))
+        if prop == PARSABLE_FORMULA:
+            facts.append(('depends_on_other_kpi', None))
+            formula = values[0]
+
+    record = {'kind': 'property', 'label': _extract_label(entity.label), 'facts': facts,
+              'superclasses': [], 'subclasses': [], 'instances': [], 'kpi': False, 'formula': formula}
+    if isinstance(entity, (or2.ThingClass, or2.Thing)):
+        record['kind'] = 'class' if isinstance(entity, or2.ThingClass) else 'instance'
+        record['superclasses'] = [_extract_label(superclass.label) for superclass in entity.is_a if
+                                  isinstance(superclass, or2.ThingClass) and
+                                  _extract_label(superclass.label) != 'None']
+        record['kpi'] = any(isinstance(cls, or2.ThingClass) and issubclass(cls, KPI_CLASS) for cls in entity.is_a)
+    if record['kind'] == 'class':
+        record['subclasses'] = [subclass.iri for subclass in entity.subclasses()]
+        record['instances'] = [i.label.en.first() for i in entity.instances()]
+    return record
+
+def _record_properties():
+    """
+    Lists the annotation, object and data properties of the ontology in the order get_object_properties
+    lists them, as (property, name in get_object_properties, 'annotation' / 'object' / 'data') triples.
+    """
+    return ([(prop, 'description' if prop._name == 'description' else _extract_label(prop.label), 'annotation')
+             for prop in ONTO.annotation_properties()] +
+            [(prop, _extract_label(prop.label), 'object') for prop in ONTO.object_properties()] +
+            [(prop, _extract_label(prop.label), 'data') for prop in ONTO.data_properties()])
+
+def _property_relations():
+    """
+    Reads every property assertion of the ontology with one query per property.
+
+    Returns:
+    - dict: Maps each triple of _record_properties(), in order, to {subject: its values, in the order
+      prop[subject] lists them}.
+    """
+    relations = {}
+    for key in _record_properties():
+        relations[key] = {}
+        for subject, value in key[0].get_relations():
+            relations[key].setdefault(subject, []).append(value)
+    return relations
+
+def _build_read_model(draft):
+    """
+    Builds the read model of the loaded ontology into a draft, as its 'read_model':
+    {'labels': label -> IRIs of the entities carrying it, 'entities': IRI -> record (see _entity_record)},
+    over every class, individual and property.
+    """
+    relations = _property_relations()
+    for entity in list(ONTO.classes()) + list(ONTO.individuals()) + list(ONTO.properties()):
+        _model_insert(draft, entity, relations)
+
+def _model_insert(draft, entity, relations=None):
+    """
+    Adds the record of an entity to the read model of a draft and registers it under each of its labels.
+    """
+    model = _writable(draft, draft, 'read_model')
+    _writable(draft, model, 'entities')[entity.iri] = _entity_record(entity, relations)
+    labels = _writable(draft, model, 'labels')
+    for lab in entity.label:
+        iris = _writable(draft, labels, str(lab), list)
+        if entity.iri not in iris:
+            iris.append(entity.iri)
+
+def _lookup(snapshot, label):
+    """
+    Looks up the read model records of the entities carrying a given label, like _search does for entities.
+
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - label (str): The label to look up.
+
+    Returns:
+    - list: The records of the entities with that label, empty if there are none.
+    """
+    kbm.tally('kb_label_lookups_total', labels=(('index', 'read_model'),))
+    model = snapshot['read_model']
+    return [model['entities'][iri] for iri in model['labels'].get(label, ())]
+
+def _build_hierarchy(draft):
+    """
+    Indexes the class hierarchy of the read model of a draft, as its 'hierarchy':
+    - 'intervals': Maps every class IRI to the [pre, end) intervals numbering its positions in a depth-first
+      traversal of the subclass forest, end being the first number after its subclasses. A class is a
+      subclass of another if one of its intervals lies within one of the other's. A class has one interval
+      per path from a root class, so a single one unless it has several superclasses.
+    - 'ancestors': Maps every class IRI to the set of IRIs of the classes it is a subclass of, itself included.
+    - 'instances': Maps every class IRI to the labels of its instances and of those of its subclasses, in
+      the order get_instances returns them.
+    """
+    entities = draft['read_model']['entities']
+    classes = [iri for iri, record in entities.items() if record['kind'] == 'class']
+    children = {iri: [sub for sub in entities[iri]['subclasses'] if sub in entities] for iri in classes}
+    has_parent = {sub for subs in children.values() for sub in subs}
+
+    hierarchy = _writable(draft, draft, 'hierarchy')
+    intervals = hierarchy['intervals'] = {iri: [] for iri in classes}
+    ancestors = hierarchy['ancestors'] = {iri: set() for iri in classes}
+    number = 0
+    for root in classes:
+        if root in has_parent:
+            continue
+        path = []  # Classes from the root to the current one
+        stack = [(root, None)]  # (class, None) enters it, (class, pre number) leaves it
+        while stack:
+            iri, pre = stack.pop()
+            if pre is not None:
+                # Every subclass has been numbered: close the interval
+                intervals[iri].append((pre, number))
+                path.pop()
+                continue
+            path.append(iri)
+            ancestors[iri].update(path)
+            stack.append((iri, number))
+            number += 1
+            # Push the subclasses in reverse to number them in order, skipping any that would close a cycle
+            stack.extend((sub, None) for sub in reversed(children[iri]) if sub not in path)
+
+    # Gather the instances of every class and of its subclasses, walked like get_instances used to
+    class_instances = hierarchy['instances'] = {}
+    for iri in classes:
+        instances = {}  # Insertion-ordered set of the instances
+        classes_to_process = [iri]
+        visited = {iri}
+        while classes_to_process:
+            current_class = classes_to_process.pop()
+            instances.update(dict.fromkeys(entities[current_class]['instances']))
+            for sub in children[current_class]:
+                if sub not in visited:
+                    visited.add(sub)
+                    classes_to_process.append(sub)
+        class_instances[iri] = list(instances)
+
+def _is_subclass(snapshot, subclass, superclass):
+    """
+    Tells whether a class is a subclass of another (or the class itself) from their hierarchy intervals,
+    in constant time unless they have several superclasses.
+
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - subclass (str): The IRI of the candidate subclass.
+    - superclass (str): The IRI of the candidate superclass.
+
+    Returns:
+    - bool: True if subclass is superclass or one of its descendants, False otherwise or if either is not a class.
+    """
+    intervals = snapshot['hierarchy']['intervals']
+    return any(outer[0] <= inner[0] < outer[1]
+               for inner in intervals.get(subclass, ()) for outer in intervals.get(superclass, ()))
+
+def _save_read_model(number, snapshot):
+    """
+    Saves the read model and the indexes derived from the ontology of a snapshot next to backup number,
+    keyed by the hash of the backup file.
+    """
+    state = {key: snapshot[key] for key in ('read_model', 'formula_ast', 'kpi_dependencies', 'kpi_dependents',
+                                            'kpi_order', 'property_views', 'hierarchy', 'fuzzy_index',
+                                            'fuzzy_labels')}
+    path = MAIN_DIR / (str(number) + '.model')
+    tmp = MAIN_DIR / (str(number) + '.model.tmp')
+    with open(tmp, 'wb') as file:
+        pickle.dump({'version': READ_MODEL_VERSION, 'hash': _file_hash(_backup_file(number)), 'state': state},
+                    file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+def _load_read_model(number):
+    """
+    Loads the read model saved next to backup number.
+
+    Returns:
+    - dict: The saved snapshot, without its 'generation' and 'kpi_closure', or None if there is no
+      read model, it was saved by another version or for another content of the backup file.
+    """
+    path = MAIN_DIR / (str(number) + '.model')
+    if not os.path.exists(path) or not os.path.exists(_backup_file(number)):
+        return None
+    try:
+        with open(path, 'rb') as file:
+            saved = pickle.load(file)
+    except Exception as e:
+        print('UNREADABLE READ MODEL:', e)
+        return None
+    if saved.get('version') != READ_MODEL_VERSION or saved.get('hash') != _file_hash(_backup_file(number)):
+        print('STALE READ MODEL, REBUILDING')
+        return None
+    return saved['state']
+
+def _index_entity(entity):
+    """
+    Registers an entity in the label index under each of its labels.
+
+    Parameters:
+    - entity: The ontology class, individual or property to register.
+    """
+    for lab in entity.label:
+        entities = LABEL_INDEX.setdefault(str(lab), [])
+        if entity not in entities:
+            entities.append(entity)
+            if len(entities) > 1:
+                DUPLICATE_LABELS.add(str(lab))
+
+def _search(label):
+    """
+    Looks up the entities carrying a given label, as ONTO.search(label=label) would.
+
+    Parameters:
+    - label (str): The label to look up.
+
+    Returns:
+    - list: The entities with that label, empty if there are none.
+    """
+    kbm.tally('kb_label_lookups_total', labels=(('index', 'ontology'),))
+    return list(LABEL_INDEX.get(label, ()))
+
+def _generate_hash_code(input_data):
+    """
+    Generates a compact, alphanumeric hash code for a given input string.
+
+    Parameters:
+    - input_data (str): The input string to generate the hash code from.
+
+    Returns:
+    - hash_code (str): A shortened alphanumeric hash code derived from the input data.
+    """
+    # Compute a SHA-256 hash of the input string
+    hash_obj = hashlib.sha256(input_data.encode())
+    # Convert the hash to a URL-safe Base64 encoded string
+    hash_b64 = base64.urlsafe_b64encode(hash_obj.digest()).decode()
+    # Clean up unwanted characters ('-' and '_')
+    hash_b64_clean = hash_b64.replace('-', '').replace('_', '')
+    # Truncate the hash to 22 characters for brevity
+    hash_code = hash_b64_clean[:22]
+    return hash_code
+
+def _label_vector(label):
+    """
+    Embeds a label for the 'w2v' method: the counts of its character n-grams (the label being framed
+    by '<' and '>', so that its first and last characters count) hashed into W2V_DIMENSIONS buckets.
+
+    Parameters:
+    - label (str): The label to embed.
+
+    Returns:
+    - numpy.ndarray: The vector of the label, of unit length unless the label is empty.
+    """
+    framed = '<' + label + '>'
+    buckets = []
+    for n in W2V_NGRAMS:
+        for i in range(len(framed) - n + 1):
+            gram = framed[i:i + n]
+            bucket = _NGRAM_BUCKETS.get(gram)
+            if bucket is None:
+                bucket = _NGRAM_BUCKETS[gram] = zlib.crc32(gram.encode('utf-8')) % W2V_DIMENSIONS
+            buckets.append(bucket)
+    vector = np.bincount(buckets, minlength=W2V_DIMENSIONS).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def _get_similarity(a, b, method='w2v'):
+    """
+    Computes similarity between two strings using a chosen method.
+
+    Parameters:
+    - a (str): First string to compare.
+    - b (str): Second string to compare.
+    - method (str, optional): 'levenshtein' or 'w2v' (cosine of the n-gram vectors of _label_vector),
+      default is 'w2v'.
+
+    Returns:
+    - similarity (float): A value between 0 and 1 indicating similarity.
+    """
+    if method == 'levenshtein':
+        # Compute Levenshtein distance
+        distance = Levenshtein.distance(a, b)
+        # Convert distance to a similarity score
+        similarity = 1 - distance / max(len(a), len(b))
+        return similarity
+    elif method == 'w2v':
+        return min(1.0, float(_label_vector(a) @ _label_vector(b)))
+    else:
+        # Print error if method is not recognized
+        print('METHOD NOT FOUND')
+        return 
+
+def _fuzzy_candidates(kind):
+    """
+    Yields the labels a get_closest_* function compares against, in the order it visits them.
+
+    Parameters:
+    - kind (str): One of FUZZY_KINDS.
+
+    Returns:
+    - generator: Labels of the candidate entities; unlabeled entities are skipped.
+    """
+    if kind == 'kpi_formulas':
+        groups = [KPI_CLASS.instances()]
+    elif kind == 'class_instances':
+        groups = [ONTO.classes(), ONTO.individuals()]
+    else:
+        groups = [ONTO.classes(), ONTO.individuals(), ONTO.object_properties(),
+                  ONTO.data_properties(), ONTO.annotation_properties()]
+
+    for group in groups:
+        for ind in group:
+            if ind.label:
+                yield str(ind.label.first())
+
+def _label_grams(label):
+    """
+    Returns the set of distinct character bigrams of a label.
+
+    Parameters:
+    - label (str): The label to split.
+
+    Returns:
+    - set: The bigrams occurring in the label.
+    """
+    return {label[i:i + 2] for i in range(len(label) - 1)}
+
+def _fuzzy_insert(draft, kind, label):
+    """
+    Adds a label to the n-gram index of the given kind in a draft, unless it is already there.
+
+    The index of a kind is a dict holding the positions of the labels in 'fuzzy_labels' order (used
+    to break ties like the linear scan did), their lengths, number of distinct bigrams and 'w2v' vectors
+    in growable NumPy arrays, and an inverted index from each bigram to the positions of the labels
+    containing it.
+
+    Parameters:
+    - draft (dict): The draft being built.
+    - kind (str): One of FUZZY_KINDS.
+    - label (str): The label to add.
+    """
+    index = _writable(draft, _writable(draft, draft, 'fuzzy_index'), kind)
+    if label in index['positions']:
+        return
+
+    labels = _writable(draft, _writable(draft, draft, 'fuzzy_labels'), kind, list)
+    position = len(labels)
+    grams = _label_grams(label)
+
+    # The per-label arrays are not copied: earlier snapshots only read the rows of their own labels, so
+    # the row of the new label can be written in place, the arrays growing geometrically when full.
+    # A commit still costs O(n) in the labels of the kind, since the draft copies the label list, the
+    # positions and the postings of every bigram of the label (once per draft, whatever the batch size).
+    for name, value in (('lengths', len(label)), ('gram_counts', len(grams)),
+                        ('vectors', _label_vector(label))):
+        values = index[name]
+        if position == len(values):
+            values = index[name] = np.resize(values, (max(16, 2 * position),) + values.shape[1:])
+        values[position] = value
+
+    postings = _writable(draft, index, 'postings')
+    for gram in grams:
+        _writable(draft, postings, gram, list).append(position)
+
+    _writable(draft, index, 'positions')[label] = position
+    labels.append(label)
+
+def _fuzzy_bounds(snapshot, kind, queries):
+    """
+    Computes, in one pass over the candidate labels of a kind, an upper bound on the similarity
+    of every label to each of the queries.
+
+    The bigrams a label shares with a query give a lower bound on their edit distance, since each
+    edit destroys at most two bigrams; together with the length difference this bounds the
+    similarity from above.
+
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - kind (str): One of FUZZY_KINDS.
+    - queries (list): The labels to match.
+
+    Returns:
+    - numpy.ndarray: Array of shape (len(queries), number of labels) holding the bounds.
+    """
+    index = snapshot['fuzzy_index'][kind]
+    size = len(snapshot['fuzzy_labels'][kind])
+    lengths = index['lengths'][:size]
+    gram_counts = index['gram_counts'][:size]
+
+    # Count the bigrams every label shares with every query, reading each posting list once
+    query_grams = [_label_grams(query) for query in queries]
+    rows_by_gram = {}
+    for row, grams in enumerate(query_grams):
+        for gram in grams:
+            rows_by_gram.setdefault(gram, []).append(row)
+
+    shared = np.zeros((len(queries), size), dtype=np.int64)
+    for gram, rows in rows_by_gram.items():
+        if gram in index['postings']:
+            shared[np.array(rows)[:, None], _posting_array(index, kind, gram)] += 1
+
+    query_lengths = np.array([len(query) for query in queries])[:, None]
+    query_gram_counts = np.array([len(grams) for grams in query_grams])[:, None]
+
+    # Lower bound on the distance, then upper bound on the similarity, of every label
+    min_distance = np.maximum(np.abs(lengths - query_lengths),
+                              (np.maximum(gram_counts, query_gram_counts) - shared + 1) // 2)
+    longest = np.maximum(np.maximum(lengths, query_lengths), 1)
+    return 1 - min_distance / longest
+
+def _posting_array(index, kind, gram):
+    """
+    Returns the posting list of a bigram in the index of a kind as a NumPy array, converting it once per
+    version of the list.
+    """
+    postings = index['postings'][gram]
+    cached = _POSTING_ARRAYS.get((kind, gram))
+    if cached is None or cached[0] is not postings:
+        cached = _POSTING_ARRAYS[(kind, gram)] = (postings, np.array(postings, dtype=np.int64))
+    return cached[1]
+
+def _fuzzy_verify(snapshot, kind, query, bound, top_k, threshold):
+    """
+    Ranks the labels of a kind against a query, checking the exact Levenshtein similarity in
+    decreasing order of their bound and stopping as soon as no remaining label can enter the top_k.
+
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - kind (str): One of FUZZY_KINDS.
+    - query (str): The label to match.
+    - bound (numpy.ndarray): Upper bound on the similarity of every label, from _fuzzy_bounds.
+    - top_k (int): Number of matches to return.
+    - threshold (float): Minimum similarity of the returned matches.
+
+    Returns:
+    - list: (label, similarity) tuples sorted from the most to the least similar.
+    """
+    labels = snapshot['fuzzy_labels'][kind]
+    best = []  # Min-heap of (similarity, -order, label) holding the current top_k
+    pending = np.flatnonzero(bound >= threshold)
+    batch = max(2 * top_k, 64)
+    verified = 0  # Labels whose exact similarity was computed
+
+    while pending.size:
+        # Verify the most promising labels first, doubling the batch at every round
+        if pending.size > batch:
+            chosen = np.argpartition(-bound[pending], batch)[:batch]
+            keep = np.ones(pending.size, dtype=bool)
+            keep[chosen] = False
+            verify, pending = pending[chosen], pending[keep]
+            batch *= 2
+        else:
+            verify, pending = pending, pending[:0]
+
+        for position in verify[np.argsort(-bound[verify], kind='stable')].tolist():
+            if len(best) == top_k and bound[position] < best[0][0]:
+                break
+            label = labels[position]
+            verified += 1
+            distance = Levenshtein.distance(query, label)
+            similarity = 1 - distance / max(len(query), len(label), 1)
+            if similarity < threshold:
+                continue
+            item = (similarity, -position, label)
+            if len(best) < top_k:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+
+        # Drop the labels that can no longer beat the worst retained match
+        if len(best) == top_k:
+            pending = pending[bound[pending] >= best[0][0]]
+
+    kbm.observe('kb_fuzzy_verified', verified, kbm.SIZE_BUCKETS, (('kind', kind),))
+    return [(label, similarity) for similarity, _, label in sorted(best, reverse=True)]
+
+def _fuzzy_search(snapshot, kind, query, top_k=1, threshold=0):
+    """
+    Finds the labels of the given kind most similar to the query under the Levenshtein similarity.
+
+    Results are identical to a full scan, ties being resolved in favour of the label the scan
+    would meet first, but only the labels whose bound allows them to compete are compared exactly.
+
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - kind (str): One of FUZZY_KINDS.
+    - query (str): The label to match.
+    - top_k (int, optional): Number of matches to return (default is 1).
+    - threshold (float, optional): Minimum similarity of the returned matches (default is 0).
+
+    Returns:
+    - list: (label, similarity) tuples sorted from the most to the least similar.
+    """
+    return _fuzzy_search_many(snapshot, kind, [query], top_k, threshold)[0]
+
+def _fuzzy_search_many(snapshot, kind, queries, top_k=1, threshold=0):
+    """
+    Applies _fuzzy_search to several queries, sharing the pass over the candidate labels.
+
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - kind (str): One of FUZZY_KINDS.
+    - queries (list): The labels to match.
+    - top_k (int, optional): Number of matches to return per query (default is 1).
+    - threshold (float, optional): Minimum similarity of the returned matches (default is 0).
+
+    Returns:
+    - list: For each query, (label, similarity) tuples sorted from the most to the least similar.
+    """
+    size = len(snapshot['fuzzy_labels'][kind])
+    if not size or top_k < 1:
+        return [[] for _ in queries]
+
+    begin = time.perf_counter()
+    # Bound the memory of the (queries x labels) matrices by processing the queries in chunks
+    chunk = max(1, (1 << 22) // size)
+    results = []
+    for start in range(0, len(queries), chunk):
+        block = queries[start:start + chunk]
+        bounds = _fuzzy_bounds(snapshot, kind, block)
+        results.extend(_fuzzy_verify(snapshot, kind, query, bound, top_k, threshold)
+                       for query, bound in zip(block, bounds))
+
+    kbm.inc('kb_fuzzy_searches_total', len(queries), (('kind', kind),))
+    kbm.observe('kb_fuzzy_candidates', size, kbm.SIZE_BUCKETS, (('kind', kind),))
+    kbm.observe('kb_fuzzy_search_duration_seconds', time.perf_counter() - begin, labels=(('kind', kind),))
+    return results
+
+def _vector_search(snapshot, kind, query, top_k=1, threshold=0):
+    """
+    Finds the labels of the given kind most similar to the query under the 'w2v' similarity, with one
+    product of the vectors of the labels by the vector of the query.
+
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - kind (str): One of FUZZY_KINDS.
+    - query (str): The label to match.
+    - top_k (int, optional): Number of matches to return (default is 1).
+    - threshold (float, optional): Minimum similarity of the returned matches (default is 0).
+
+    Returns:
+    - list: (label, similarity) tuples sorted from the most to the least similar, ties in 'fuzzy_labels' order.
+    """
+    labels = snapshot['fuzzy_labels'][kind]
+    if not labels or top_k < 1:
+        return []
+
+    begin = time.perf_counter()
+    scores = snapshot['fuzzy_index'][kind]['vectors'][:len(labels)] @ _label_vector(query)
+    positions = np.flatnonzero(scores >= threshold)
+    if positions.size > top_k:
+        # Keep the top_k scores and every label tied with the last of them, then order by score and position
+        cutoff = np.partition(scores[positions], positions.size - top_k)[positions.size - top_k]
+        positions = positions[scores[positions] >= cutoff]
+    best = positions[np.lexsort((positions, -scores[positions]))][:top_k]
+
+    kbm.inc('kb_fuzzy_searches_total', labels=(('kind', kind),))
+    kbm.observe('kb_fuzzy_candidates', len(labels), kbm.SIZE_BUCKETS, (('kind', kind),))
+    kbm.observe('kb_fuzzy_search_duration_seconds', time.perf_counter() - begin, labels=(('kind', kind),))
+    return [(labels[position], min(1.0, float(scores[position]))) for position in best.tolist()]
+
+def get_closest_labels(label, kind='object_properties', method='levenshtein', top_k=1, threshold=0, snapshot=None):
+    """
+    Finds the labels most similar to a given one among the entities a get_closest_* function considers.
+
+    Parameters:
+    - label (str): The label to match.
+    - kind (str, optional): 'kpi_formulas' (KPIs), 'class_instances' (classes and individuals) or
+      'object_properties' (classes, individuals and properties). Default is 'object_properties'.
+    - method (str, optional): The similarity method to use, 'levenshtein' or 'w2v' (default is 'levenshtein').
+    - top_k (int, optional): Number of matches to return (default is 1).
+    - threshold (float, optional): Minimum similarity of the returned matches (default is 0).
+    - snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
+
+    Returns:
+    - list: (label, similarity) tuples sorted from the most to the least similar.
+    """
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+    return _closest_labels(snapshot, kind, method, [label], top_k, threshold)[0]
+
+def _closest_labels(snapshot, kind, method, queries, top_k=1, threshold=0):
+    """
+    Applies get_closest_labels to several queries, answering from the closest-label cache those it holds
+    and matching the others together.
+
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - kind (str): One of FUZZY_KINDS.
+    - method (str): The similarity method to use.
+    - queries (list): The labels to match.
+    - top_k (int, optional): Number of matches to return per query (default is 1).
+    - threshold (float, optional): Minimum similarity of the returned matches (default is 0).
+
+    Returns:
+    - list: For each query, (label, similarity) tuples sorted from the most to the least similar.
+    """
+    labels = snapshot['fuzzy_labels'][kind]
+    matches = {}
+    with _CLOSEST_LOCK:
+        cache = _CLOSEST_CACHE.get(kind)
+        if cache is not None and cache[0] is labels:
+            for query in queries:
+                key = (query, method, top_k, threshold)
+                if key in cache[1]:
+                    cache[1].move_to_end(key)
+                    matches[query] = cache[1][key]
+    misses = [query for query in dict.fromkeys(queries) if query not in matches]
+
+    if misses:
+        found = None
+        if len(labels) >= MATCH_PROCESS_MIN_LABELS:
+            found = _match_in_pool(snapshot, kind, method, misses, top_k, threshold)
+        if found is None:
+            found = _match_labels(snapshot, kind, method, misses, top_k, threshold)
+        matches.update(zip(misses, found))
+
+    hits = len(queries) - len(misses)
+    with _CLOSEST_LOCK:
+        _CLOSEST_STATS['hits'] += hits
+        _CLOSEST_STATS['misses'] += len(misses)
+        cache = _CLOSEST_CACHE.get(kind)
+        if (cache is None or cache[0] is not labels) and snapshot is SNAPSHOT:
+            # The labels changed since the entries were matched: start over from the published ones
+            cache = _CLOSEST_CACHE[kind] = [labels, OrderedDict()]
+        if misses and cache is not None and cache[0] is labels:
+            for query in misses:
+                cache[1][(query, method, top_k, threshold)] = matches[query]
+            while len(cache[1]) > CLOSEST_CACHE_SIZE:
+                cache[1].popitem(last=False)
+    kbm.inc('kb_closest_cache_lookups_total', hits, (('kind', kind), ('result', 'hit')))
+    kbm.inc('kb_closest_cache_lookups_total', len(misses), (('kind', kind), ('result', 'miss')))
+    return [list(matches[query]) for query in queries]
+
+def _match_labels(snapshot, kind, method, queries, top_k, threshold):
+    """
+    Matches several queries against the labels of a kind with a similarity method, without the
+    closest-label cache.
+
+    Returns:
+    - list: For each query, (label, similarity) tuples sorted from the most to the least similar.
+    """
+    if method == 'levenshtein':
+        return _fuzzy_search_many(snapshot, kind, queries, top_k, threshold)
+    if method == 'w2v':
+        return [_vector_search(snapshot, kind, query, top_k, threshold) for query in queries]
+    return [_scan_labels(snapshot, kind, query, method, top_k, threshold) for query in queries]
+
+def _match_in_pool(snapshot, kind, method, queries, top_k, threshold):
+    """
+    Has a process of the matching pool apply _match_labels to a version of the KB, blocking the calling
+    thread (but not the others) until it is done. The metrics the process records are added to this one's.
+
+    Returns:
+    - list: What _match_labels returns, or None if there is no pool or the process could not reach the
+      revision of the snapshot.
+    """
+    pool = _match_pool()
+    if pool is None:
+        return None
+
+    try:
+        reply = pool.submit(_match_in_process, snapshot['revision'], kind, method, queries, top_k, threshold).result()
+    except BrokenProcessPool:
+        print('A MATCHING PROCESS DIED: THE POOL IS STARTED AGAIN')
+        with _MATCH_LOCK:
+            if _MATCH_STATE['pool'] is pool:
+                _MATCH_STATE['pool'] = None
+        return None
+    if reply is None:
+        return None
+    found, metrics = reply
+    kbm.merge(metrics)
+    return found
+
+def start_match_processes():
+    """
+    Starts the MATCH_PROCESSES processes of the matching pool, each of them loading the revision of the
+    published SNAPSHOT, so that the first approximate matches do not wait for them. Otherwise they are
+    started by the first match that needs them.
+
+    Returns:
+    - list: The futures of the processes loading the revision, e.g. to wait for them (empty without a pool).
+    """
+    pool = _match_pool()
+    if pool is None:
+        return []
+    return [pool.submit(_reach_revision, SNAPSHOT['revision']) for _ in range(MATCH_PROCESSES)]
+
+def _match_pool():
+    """
+    Returns the pool of matching processes, creating it if needed, or None if MATCH_PROCESSES is 0.
+    """
+    with _MATCH_LOCK:
+        if _MATCH_STATE['pool'] is None and MATCH_PROCESSES:
+            # Spawned rather than forked: the process may hold locks in other threads
+            _MATCH_STATE['pool'] = ProcessPoolExecutor(MATCH_PROCESSES, multiprocessing.get_context('spawn'),
+                                                       _init_match_process, (MAIN_DIR, CONFIG_PATH, BACKEND))
+        return _MATCH_STATE['pool']
+
+def _init_match_process(main_dir, config_path, backend):
+    """
+    Points a process of the matching pool to the backups folder of the process that started it, and lowers
+    its priority so that the processor goes to the threads of that process first when they have work.
+    """
+    global MAIN_DIR, CONFIG_PATH, BACKEND
+    MAIN_DIR, CONFIG_PATH, BACKEND = main_dir, config_path, backend
+    if hasattr(os, 'nice'):
+        os.nice(MATCH_PROCESS_NICENESS)
+
+def _match_in_process(revision, kind, method, queries, top_k, threshold):
+    """
+    Applies _match_labels in a process of the matching pool, to the given revision of the KB.
+
+    Returns:
+    - tuple: What _match_labels returns and the metrics it recorded (see kb_metrics.export), or None if the
+      process cannot reach the revision.
+    """
+    if not _reach_revision(revision):
+        return None
+    kbm.reset()
+    found = _match_labels(SNAPSHOT, kind, method, queries, top_k, threshold)
+    return found, kbm.export()
+
+def _reach_revision(revision):
+    """
+    Brings the SNAPSHOT of a process of the matching pool to the given revision: the backup of the revision
+    is started read-only if the process has another one, then the mutations journaled after it are replayed.
+
+    Returns:
+    - bool: False if the revision cannot be reached: the writer was started again or its backup is gone,
+      the journal holds fewer mutations than the revision, or the process already replayed more (it never
+      goes back).
+    """
+    epoch, number, mutations = revision
+    if SNAPSHOT['revision'][:2] != (epoch, number):
+        if _read_epoch() != epoch:
+            return False
+        try:
+            start(number + 1, read_only=True)
+        except (OSError, RuntimeError) as e:
+            print('THE MATCHING PROCESS CANNOT START BACKUP', number, ':', e)
+            return False
+    if SNAPSHOT['revision'][:2] == (epoch, number) and SNAPSHOT['revision'][2] < mutations:
+        with KB_LOCK:
+            draft = _draft()
+            if _replay_journal(draft):
+                _publish(draft)
+    return SNAPSHOT['revision'] == revision
+
+def _scan_labels(snapshot, kind, query, method, top_k, threshold):
+    """
+    Ranks every candidate label of a kind against the query with _get_similarity, for the methods that
+    have no index.
+    """
+    scored = []
+    for order, lab in enumerate(snapshot['fuzzy_labels'][kind]):
+        similarity = _get_similarity(query, lab, method)
+        if similarity >= threshold:
+            scored.append((-similarity, order, lab))
+    return [(lab, -similarity) for similarity, _, lab in heapq.nsmallest(top_k, scored)]
+
+def get_closest_cache_info():
+    """
+    Reports the use of the closest-label cache since the process started.
+
+    Returns:
+    - dict: The number of queries answered from the cache ('hits') and matched against the labels ('misses'),
+      the entries it holds ('size', over every kind) and the entries it keeps per kind ('capacity').
+    """
+    with _CLOSEST_LOCK:
+        return {'hits': _CLOSEST_STATS['hits'], 'misses': _CLOSEST_STATS['misses'],
+                'size': sum(len(entries) for _, entries in _CLOSEST_CACHE.values()),
+                'capacity': CLOSEST_CACHE_SIZE}
+
+def _backup():
+    """
+    Creates a backup of the current ontology and manages cleanup of old backups.
+
+    Global Variables Used:
+    - SAVE_INT: Determines the naming and management of backups.
+    - ONTO: The ontology object being saved.
+
+    File Management:
+    - Saves the ontology as compressed RDF/XML, or as a quadstore with the 'sqlite' BACKEND, its read model
+      and its manifest.
+    - Deletes older backups based on the fine and coarse grain intervals.
+    - Deletes the journal of the previous backup, whose mutations the new backup contains.
+    """
+    with KB_LOCK:
+        capture = _capture_backup()
+    _write_backup(capture)
+
+def _capture_backup():
+    """
+    Takes what the next backup is written from: the ontology serialized to RDF/XML in memory (or, with the
+    'sqlite' BACKEND, the quadstore already copied) and the published SNAPSHOT. Must be called while holding
+    KB_LOCK, right after the pending mutations were journaled, so that the backup holds exactly them.
+
+    Returns:
+    - dict: The number of the backup, its RDF/XML content (None for a quadstore), its SNAPSHOT and the
+      time its capture began, for _write_backup.
+    """
+    begin = time.perf_counter()
+    # Files with the number of the new backup were left by a timeline that start() rolled back
+    _remove_backup(SAVE_INT)
+    _remove_journal(SAVE_INT)
+
+    data = None
+    if BACKEND == 'sqlite':
+        ONTO.world.save()
+        _copy_store(ONTO.world.graph.db, MAIN_DIR / (str(SAVE_INT) + '.sqlite3'))
+    else:
+        owl = io.BytesIO()
+        ONTO.save(file=owl, format="rdfxml")
+        data = owl.getvalue()
+    return {'number': SAVE_INT, 'data': data, 'snapshot': SNAPSHOT, 'begin': begin}
+
+def _write_backup(capture):
+    """
+    Writes the backup taken by _capture_backup, then moves on to the next backup number. Compressing and
+    writing the files holds no lock on the KB: the mutations made meanwhile are journaled after the backup,
+    in the journal of the new backup.
+
+    Parameters:
+    - capture (dict): The result of _capture_backup.
+    """
+    global SAVE_INT
+    coarse_grain = 8  # Defines the coarse-grain interval
+    max_fine_b = 3  # Maximum fine-grain backups to keep
+    max_coarse_b = 2  # Maximum coarse-grain backups to keep
+    number = capture['number']
+
+    # Make sure the backup is complete on disk before its journal goes away
+    if capture['data'] is not None:
+        _write_atomic(MAIN_DIR / (str(number) + '.owl.gz'),
+                      gzip.compress(capture['data'], BACKUP_COMPRESSLEVEL, mtime=0))
+    path = _backup_file(number)
+    _save_read_model(number, capture['snapshot'])
+    manifest = {'number': number, 'file': path.name, 'bytes': os.path.getsize(path), 'sha256': _file_hash(path),
+                'generation': capture['snapshot']['generation'],
+                'entities': get_entity_counts(capture['snapshot']), 'created': time.time()}
+    _write_atomic(_manifest_path(number), json.dumps(manifest).encode('utf-8'))
+    kbm.observe('kb_backup_duration_seconds', time.perf_counter() - capture['begin'])
+    kbm.inc('kb_backup_bytes_total', manifest['bytes'] + os.path.getsize(MAIN_DIR / (str(number) + '.model')))
+
+    with KB_LOCK:
+        # Delete old backups based on the fine-grain interval
+        if (number - max_fine_b) % coarse_grain == 0:
+            # Delete the corresponding coarse-grain backup if it exceeds limits
+            if (number - max_fine_b) / coarse_grain - max_coarse_b > 0:
+                _remove_backup(number - max_fine_b - max_coarse_b * coarse_grain)
+        else:
+            # Delete excess fine-grain backups
+            if number - max_fine_b > 0:
+                _remove_backup(number - max_fine_b)
+
+        # Increment the save interval and update the configuration file
+        SAVE_INT = number + 1
+        _write_config(SAVE_INT)
+
+        # The journaled mutations are now in the backup
+        _remove_journal(SAVE_INT - 2)
+        with _PERSIST_CONDITION:
+            _PERSIST_STATE['journaled'] = 0
+            _PERSIST_STATE['journal_started'] = None
+
+        # Count the mutations applied since from the new backup, as the processes loading it do
+        draft = _draft()
+        draft['revision'] = (SNAPSHOT['revision'][0], number,
+                             SNAPSHOT['revision'][2] - capture['snapshot']['revision'][2])
+        _publish(draft)
+
+def _journal_path(number):
+    """
+    Returns the path of the journal of the mutations made after backup number.
+    """
+    return MAIN_DIR / (str(number) + '.journal')
+
+def _remove_journal(number):
+    """
+    Deletes the journal of backup number, if there is one.
+    """
+    if os.path.exists(_journal_path(number)):
+        os.remove(_journal_path(number))
+
+def _append_journal(records):
+    """
+    Appends mutation records to the journal of the latest backup, with a single fsync.
+
+    Parameters:
+    - records (list): JSON-serializable records, one per mutation, in the order they were applied.
+    """
+    content = b''.join((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8') for record in records)
+    with open(_journal_path(SAVE_INT - 1), 'ab') as journal:
+        end = journal.tell()
+        try:
+            journal.write(content)
+            journal.flush()
+            os.fsync(journal.fileno())
+        except Exception:
+            # Leave no partial record, which would hide the records appended when the write is retried
+            journal.truncate(end)
+            raise
+    kbm.inc('kb_journal_appends_total')
+    kbm.inc('kb_journal_bytes_total', len(content))
+    with _PERSIST_CONDITION:
+        if not _PERSIST_STATE['journaled']:
+            _PERSIST_STATE['journal_started'] = time.monotonic()
+        _PERSIST_STATE['journaled'] += len(records)
+
+def _read_journal(offset):
+    """
+    Reads the records of the journal of the loaded backup from a byte offset, stopping before the first
+    record not completely written (still being appended by the writer, or cut short by a crash).
+
+    Parameters:
+    - offset (int): Where to start reading, at the beginning of a record.
+
+    Returns:
+    - tuple: The list of records, the offset following the last of them and the offset of the end of the file.
+    """
+    try:
+        with open(_journal_path(SAVE_INT - 1), 'rb') as journal:
+            journal.seek(offset)
+            content = journal.read()
+    except FileNotFoundError:
+        return [], offset, offset
+
+    records = []
+    end = 0  # End of the last complete record
+    while True:
+        newline = content.find(b'\n', end)
+        if newline < 0:
+            break
+        try:
+            records.append(json.loads(content[end:newline].decode('utf-8')))
+        except ValueError:
+            break
+        end = newline + 1
+    return records, offset + end, offset + len(content)
+
+def _replay_journal(draft):
+    """
+    Applies to a draft the mutations recorded in the journal of the loaded backup that were not applied
+    yet. They are created again in the ontology when it is loaded; otherwise the read model changes
+    journaled with them are inserted. Unless the KB is read-only, a record cut short by a crash while it
+    was being written is dropped from the journal.
+
+    Returns:
+    - int: The number of mutations replayed.
+    """
+    records, end, size = _read_journal(_SHARED_STATE['journal_offset'])
+    for record in records:
+        mutation = record.pop('mutation')
+        if mutation == 'add_kpi':
+            kpis = [record]
+        elif mutation == 'add_kpis':
+            kpis = record['kpis']  # Journaled in the order they were created
+        else:
+            print('UNKNOWN MUTATION IN JOURNAL:', mutation)
+            continue
+        for kpi in kpis:
+            change = kpi.pop('read_model', None)
+            if ONTO is not None:
+                _create_kpi(draft, **kpi)
+            else:
+                _insert_kpi(draft, kpi['label'], kbf.parse_formula(kpi['parsable_computation_formula']), change)
+    _SHARED_STATE['journal_offset'] = end
+    epoch, number, mutations = draft['revision']
+    draft['revision'] = (epoch, number, mutations + len(records))
+
+    if end < size and not READ_ONLY:
+        print('TRUNCATED JOURNAL RECORD DISCARDED')
+        with open(_journal_path(SAVE_INT - 1), 'r+b') as journal:
+            journal.truncate(end)
+            os.fsync(journal.fileno())
+    return len(records)
+
+def _schedule_mutation(record):
+    """
+    Schedules the journaling of a mutation, starting the worker if needed.
+    Must be called while holding KB_LOCK, right after mutating the ontology.
+
+    Parameters:
+    - record (dict): The journal record of the mutation: its 'mutation' name and arguments.
+
+    Returns:
+    - int: The sequence number of the mutation, to be passed to _wait_for_mutation.
+    """
+    with _PERSIST_CONDITION:
+        _PERSIST_STATE['requested'] += 1
+        _PERSIST_STATE['records'].append(record)
+        _PERSIST_STATE['stop'] = False
+        if _PERSIST_STATE['worker'] is None or not _PERSIST_STATE['worker'].is_alive():
+            _PERSIST_STATE['worker'] = threading.Thread(target=_persistence_worker, name='kb-persistence',
+                                                        daemon=True)
+            _PERSIST_STATE['worker'].start()
+        _PERSIST_CONDITION.notify_all()
+        return _PERSIST_STATE['requested']
+
+def _snapshot_due():
+    """
+    Tells whether the journaled mutations are many or old enough to take a new backup.
+    """
+    if not _PERSIST_STATE['journaled']:
+        return False
+    return (_PERSIST_STATE['journaled'] >= SNAPSHOT_EVERY
+            or time.monotonic() - _PERSIST_STATE['journal_started'] >= SNAPSHOT_INTERVAL)
+
+def _persistence_worker():
+    """
+    Journals the pending mutations, all of them with one append, and takes a backup when it is due.
+    """
+    while True:
+        with _PERSIST_CONDITION:
+            while not _PERSIST_STATE['records'] and not _snapshot_due() and not _PERSIST_STATE['stop']:
+                timeout = None
+                if _PERSIST_STATE['journaled']:
+                    timeout = _PERSIST_STATE['journal_started'] + SNAPSHOT_INTERVAL - time.monotonic()
+                _PERSIST_CONDITION.wait(timeout)
+            if not _PERSIST_STATE['records'] and not _snapshot_due():
+                # Stopping: the journaled mutations are replayed by the next start()
+                _PERSIST_STATE['worker'] = None
+                return
+
+        appended = failed = False
+        capture = None
+        with KB_LOCK:
+            # Every mutation scheduled up to now is applied and goes into this append
+            with _PERSIST_CONDITION:
+                target = _PERSIST_STATE['requested']
+                records = _PERSIST_STATE['records']
+                _PERSIST_STATE['records'] = []
+            try:
+                if records:
+                    _append_journal(records)
+                appended = True
+            except Exception as e:
+                print('JOURNAL WRITE FAILED:', e)
+                failed = True
+                with _PERSIST_CONDITION:
+                    # Keep the records, ahead of those scheduled since, to write them again
+                    _PERSIST_STATE['records'] = records + _PERSIST_STATE['records']
+                    _PERSIST_STATE['failed'] = (target, e)
+                    _PERSIST_CONDITION.notify_all()
+            if not failed and _snapshot_due():
+                try:
+                    capture = _capture_backup()
+                    with _PERSIST_CONDITION:
+                        _PERSIST_STATE['backing_up'] = True
+                except Exception as e:
+                    print('BACKUP FAILED:', e)
+                    failed = True
+
+        # Mutations go on while the backup is compressed and written
+        if capture is not None:
+            try:
+                _write_backup(capture)
+            except Exception as e:
+                # The mutations are journaled, the backup is taken again on the next pass
+                print('BACKUP FAILED:', e)
+                failed = True
+
+        with KB_LOCK:
+            if _SHARED_STATE['role'] == 'writer':
+                _bump_generation()  # Let the followers catch up
+
+        with _PERSIST_CONDITION:
+            if appended:
+                _PERSIST_STATE['saved'] = target
+            _PERSIST_STATE['backing_up'] = False
+            _PERSIST_CONDITION.notify_all()
+            if failed:
+                _PERSIST_CONDITION.wait(RETRY_DELAY)
+
+def _wait_for_mutation(sequence):
+    """
+    Blocks until the mutation with the given sequence number is written to the journal.
+
+    Raises:
+    - RuntimeError: If writing it to the journal failed, and it has not been written by a retry since. The
+      worker keeps retrying, so it may still be journaled later.
+    """
+    with _PERSIST_CONDITION:
+        while _PERSIST_STATE['saved'] < sequence:
+            failed_upto, error = _PERSIST_STATE['failed']
+            if sequence <= failed_upto:
+                raise RuntimeError('Journal write failed: ' + str(error))
+            _PERSIST_CONDITION.wait()
+
+def flush():
+    """
+    Blocks until every mutation made so far is written to the journal, and the backup being written,
+    if any, is complete.
+    """
+    with _PERSIST_CONDITION:
+        sequence = _PERSIST_STATE['requested']
+        while _PERSIST_STATE['backing_up']:
+            _PERSIST_CONDITION.wait()
+    _wait_for_mutation(sequence)
+
+def shutdown():
+    """
+    Journals every pending mutation and stops the persistence worker and the matching processes. Meant to be
+    called when the application stops; a later mutation starts a new worker, a later match new processes.
+    A process started by start_shared() also gives up its role, letting another process become the writer.
+    """
+    flush()
+    with _PERSIST_CONDITION:
+        _PERSIST_STATE['stop'] = True
+        worker = _PERSIST_STATE['worker']
+        _PERSIST_CONDITION.notify_all()
+    if worker is not None:
+        worker.join()
+
+    if _SHARED_STATE['listener'] is not None:
+        _SHARED_STATE['listener'].close()
+    if _SHARED_STATE['lock'] is not None:
+        _SHARED_STATE['lock'].close()  # Releases the writer lock
+    if _SHARED_STATE['generation'] is not None:
+        _SHARED_STATE['generation'].close()
+    _SHARED_STATE.update(role=None, lock=None, listener=None, generation=None)
+
+    with _MATCH_LOCK:
+        pool, _MATCH_STATE['pool'] = _MATCH_STATE['pool'], None
+    if pool is not None:
+        pool.shutdown()
+
+atexit.register(flush)
+
+def start_shared(backup_number=1):
+    """
+    Initializes the KB in one of several processes serving the same backups folder, such as the workers
+    of uvicorn --workers N. The first process to take the writer lock starts the KB with start() and
+    becomes the only one to mutate it; the others start it read-only and forward their mutations to
+    the writer. Every process must call refresh() before answering a request.
+
+    Parameters:
+    - backup_number (int, optional): The backup the writer loads, as in start(). Followers load the
+      latest backup instead, and move to the writer's one in refresh().
+    """
+    if fcntl is None:
+        # Without file locks the processes cannot agree on a writer: run alone
+        start(backup_number)
+        return
+
+    generation = _open_generation()
+    _SHARED_STATE['generation'] = generation
+    if _take_writer_lock():
+        _start_writer(backup_number)
+    else:
+        _SHARED_STATE['role'] = 'follower'
+        _SHARED_STATE['seen'] = _read_generation()
+        start(0, read_only=True)
+
+def _open_generation():
+    """
+    Maps the shared generation counter (backups/generation) in memory, creating it if needed.
+    """
+    path = MAIN_DIR / 'generation'
+    with open(path, 'ab') as file:
+        if file.tell() < 8:
+            file.write(bytes(8 - file.tell()))
+    with open(path, 'r+b') as file:
+        return mmap.mmap(file.fileno(), 8)
+
+def _read_generation():
+    """
+    Returns the value of the shared generation counter.
+    """
+    return struct.unpack_from('<Q', _SHARED_STATE['generation'])[0]
+
+def _bump_generation():
+    """
+    Increments the shared generation counter. Only called by the writer process.
+    """
+    struct.pack_into('<Q', _SHARED_STATE['generation'], 0, _read_generation() + 1)
+
+def _take_writer_lock():
+    """
+    Tries to become the writer process by taking the writer lock, which is released when the process exits.
+
+    Returns:
+    - bool: True if the lock was taken, False if another process holds it.
+    """
+    lock = open(MAIN_DIR / 'writer.lock', 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _SHARED_STATE['lock'] = lock
+    return True
+
+def _start_writer(backup_number):
+    """
+    Starts the KB in the process holding the writer lock and starts accepting forwarded mutations.
+    """
+    _SHARED_STATE['role'] = 'writer'
+    start(backup_number)
+
+    # A socket left by a writer that died cannot be reused
+    address = str(MAIN_DIR / 'writer.sock')
+    if os.path.exists(address):
+        os.remove(address)
+    _SHARED_STATE['listener'] = connection.Listener(address, family='AF_UNIX')
+    threading.Thread(target=_serve_mutations, args=(_SHARED_STATE['listener'],), name='kb-writer',
+                     daemon=True).start()
+    with KB_LOCK:
+        _bump_generation()  # The followers may have loaded another backup
+
+def _serve_mutations(listener):
+    """
+    Accepts the connections of the followers, serving each of them in its own thread so that their
+    mutations are journaled together.
+    """
+    while True:
+        try:
+            conn = listener.accept()
+        except OSError:
+            return  # Closed by shutdown()
+        threading.Thread(target=_serve_mutation, args=(conn,), daemon=True).start()
+
+def _serve_mutation(conn):
+    """
+    Applies a mutation forwarded by a follower and replies, once it is journaled, whether it was accepted,
+    the reasons why a batch was rejected and the generation the follower must catch up with to see it.
+    """
+    with conn:
+        try:
+            errors = []
+            sequence = _apply_mutation(conn.recv(), errors)
+            if sequence is not None:
+                _wait_for_mutation(sequence)
+            conn.send({'applied': sequence is not None, 'errors': errors, 'generation': _read_generation(),
+                       'error': None})
+        except Exception as e:
+            print('FORWARDED MUTATION FAILED:', e)
+            conn.send({'applied': False, 'errors': [], 'generation': None, 'error': str(e)})
+
+def _forward_mutation(record):
+    """
+    Has the writer process apply a mutation, then catches up with it. If the writer is gone, the
+    process tries to become the writer and applies the mutation itself.
+
+    Parameters:
+    - record (dict): The 'mutation' name ('add_kpi' or 'add_kpis') and its arguments.
+
+    Returns:
+    - tuple: True if the mutation was applied, False if it was rejected, and the reasons why a batch of
+      KPIs was rejected as the writer found them (those of a single KPI are printed by the writer).
 
-def start(backup_number=1):
+    Raises:
+    - RuntimeError: If the writer failed to apply or journal it.
     """
-    Initializes the global ontology and related variables. 
-    This function must necessarily be called every time it is desired 
-    to initialize the KB and use other methods to interact.
-    
-    Parameters:
-    - backup_number (int, optional): The number indicating which backup file to load, inside the backup folder.
-      If not specified, it reads the configuration file to determine the latest backup.
+    try:
+        with connection.Client(str(MAIN_DIR / 'writer.sock'), family='AF_UNIX') as conn:
+            conn.send(record)
+            reply = conn.recv()
+    except (OSError, EOFError):
+        with KB_LOCK:
+            if _SHARED_STATE['role'] == 'follower':
+                if not _take_writer_lock():
+                    return False, ['THE WRITER PROCESS IS NOT REACHABLE']
+                _start_writer(0)
+        errors = []
+        sequence = _apply_mutation(record, errors)
+        if sequence is not None:
+            _wait_for_mutation(sequence)
+        return sequence is not None, errors
+
+    if reply['error'] is not None:
+        raise RuntimeError('Mutation failed in the writer process: ' + reply['error'])
+    refresh()
+    return reply['applied'], reply['errors']
+
+def needs_refresh():
+    """
+    Tells whether refresh() has anything to catch up with, at the cost of a single read of shared memory.
+    """
+    return _SHARED_STATE['role'] == 'follower' and _read_generation() != _SHARED_STATE['seen']
 
-    Global Variables Modified:
-    - SAVE_INT: Save interval value read or set.
-    - ONTO: The ontology object loaded from the backup.
-    - PARSABLE_FORMULA, HUMAN_READABLE_FORMULA, UNIT_OF_MEASURE, DEPENDS_ON,
-      OPERATION_CASS, MACHINE_CASS, KPI_CLASS: Specific ontology classes extracted.
+def refresh():
     """
-    # Declare global variables to ensure they are modified globally
-    global SAVE_INT, ONTO, PARSABLE_FORMULA, HUMAN_READABLE_FORMULA
-    global UNIT_OF_MEASURE, DEPENDS_ON, OPERATION_CASS, MACHINE_CASS, KPI_CLASS
+    Brings the SNAPSHOT of a follower process (see start_shared) up to date with the writer: applies the
+    mutations journaled since the last call or, if the writer took a new backup or was started again
+    meanwhile, loads its read model. Costs a single read of shared memory when nothing changed, and does
+    nothing in other processes.
+    """
+    if not needs_refresh():
+        return
+    with KB_LOCK:
+        generation = _read_generation()
+        if generation == _SHARED_STATE['seen']:
+            return
+        with open(CONFIG_PATH, 'r') as cfg:
+            number = int(cfg.read())
+        if number != SAVE_INT or _read_epoch() != SNAPSHOT['revision'][0]:
+            start(0, read_only=True)
+        else:
+            draft = _draft()
+            if _replay_journal(draft):
+                _publish(draft)
+        _SHARED_STATE['seen'] = generation
 
-    if backup_number:
-        # Load ontology with the specified backup number
-        ONTO = or2.get_ontology(str(MAIN_DIR / (str(backup_number - 1) + '.owl'))).load()
-        SAVE_INT = backup_number
-        # Update the configuration file with the new backup number
-        with open(CONFIG_PATH, 'w+') as cfg:
-            cfg.write(str(backup_number))
+def _extract_label(lab):
+    if isinstance(lab, list):
+        return str(lab.first())
     else:
-        # Read the latest save interval from the configuration file
-        with open(CONFIG_PATH, 'r') as cfg:
-            SAVE_INT = int(cfg.read())
-        # Load ontology corresponding to the latest save interval
-        ONTO = or2.get_ontology(str(MAIN_DIR / (str(SAVE_INT - 1) + '.owl'))).load()
-
-    # Search and assign specific ontology classes by their labels
-    PARSABLE_FORMULA = ONTO.search(label='parsable_computation_formula')[0]
-    HUMAN_READABLE_FORMULA = ONTO.search(label='human_readable_formula')[0]
-    UNIT_OF_MEASURE = ONTO.search(label='unit_of_measure')[0]
-    DEPENDS_ON = ONTO.search(label='depends_on')[0]
-    OPERATION_CASS = ONTO.search(label='operation')[0]
-    MACHINE_CASS = ONTO.search(label='machine')[0]
-    KPI_CLASS = ONTO.search(label='kpi')[0]
+        return str(lab)
+    
+def _formula_references(snapshot, kpi):
+    """
+    Lists the KPI labels referenced by the formula of a KPI, read from its parsed formula.
 
-    # Print success message
-    print("Ontology successfully initialized!")
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - kpi (str): The label of the KPI.
 
-def _generate_hash_code(input_data):
+    Returns:
+    - list: The referenced KPI labels in order of appearance (empty if the KPI has no valid formula).
     """
-    Generates a compact, alphanumeric hash code for a given input string.
+    if kpi not in snapshot['formula_ast']:
+        return []
+    return kbf.kpi_references(snapshot['formula_ast'][kpi])
+
+def _add_dependencies(draft, kpi):
+    """
+    Adds the edges from a KPI to the KPIs its parsed formula references to the dependency graph of a draft.
 
     Parameters:
-    - input_data (str): The input string to generate the hash code from.
+    - draft (dict): The draft being built.
+    - kpi (str): The label of the KPI.
+    """
+    refs = tuple(dict.fromkeys(_formula_references(draft, kpi)))
+    _writable(draft, draft, 'kpi_dependencies')[kpi] = refs
+    dependents = _writable(draft, draft, 'kpi_dependents')
+    for ref in refs:
+        _writable(draft, dependents, ref, set).add(kpi)
 
-    Returns:
-    - hash_code (str): A shortened alphanumeric hash code derived from the input data.
+def _sort_kpis(snapshot):
     """
-    # Compute a SHA-256 hash of the input string
-    hash_obj = hashlib.sha256(input_data.encode())
-    # Convert the hash to a URL-safe Base64 encoded string
-    hash_b64 = base64.urlsafe_b64encode(hash_obj.digest()).decode()
-    # Clean up unwanted characters ('-' and '_')
-    hash_b64_clean = hash_b64.replace('-', '').replace('_', '')
-    # Truncate the hash to 22 characters for brevity
-    hash_code = hash_b64_clean[:22]
-    return hash_code
+    Sorts the KPIs of the dependency graph of a snapshot topologically (Kahn's algorithm).
 
-def _get_similarity(a, b, method='w2v'):
+    Returns:
+    - list: The KPI labels, every KPI after the KPIs it references. KPIs on a reference cycle are
+      reported and left out, as their formulas cannot be resolved.
     """
-    Computes similarity between two strings using a chosen method.
+    dependencies = snapshot['kpi_dependencies']
+
+    # Count, for every KPI, the references to other KPIs of the graph still to be placed
+    pending = {kpi: sum(ref in dependencies for ref in refs) for kpi, refs in dependencies.items()}
+    ready = deque(kpi for kpi, count in pending.items() if count == 0)
+    order = []
+
+    while ready:
+        kpi = ready.popleft()
+        order.append(kpi)
+        for dependent in snapshot['kpi_dependents'].get(kpi, ()):
+            pending[dependent] -= 1
+            if pending[dependent] == 0:
+                ready.append(dependent)
+
+    if len(order) < len(pending):
+        print('CYCLIC KPI REFERENCES:', sorted(set(pending) - set(order)))
+    return order
+
+def _reaches(snapshot, sources, kpi):
+    """
+    Checks whether a KPI is among the given KPIs or is transitively referenced by one of them.
 
     Parameters:
-    - a (str): First string to compare.
-    - b (str): Second string to compare.
-    - method (str, optional): The method to use, default is 'levenshtein'.
+    - snapshot (dict): The version of the KB to read.
+    - sources (iterable): Labels of the KPIs to start from.
+    - kpi (str): The label of the KPI to look for.
 
     Returns:
-    - similarity (float): A value between 0 and 1 indicating similarity.
+    - bool: True if kpi can be reached from sources in the dependency graph.
     """
-    if method == 'levenshtein':
-        # Compute Levenshtein distance
-        distance = Levenshtein.distance(a, b)
-        # Convert distance to a similarity score
-        similarity = 1 - distance / max(len(a), len(b))
-        return similarity
-    else:
-        # Print error if method is not recognized
-        print('METHOD NOT FOUND')
-        return 
+    stack = list(sources)
+    if not snapshot['kpi_dependents'].get(kpi):
+        # No formula references the KPI, so only the sources themselves can be it
+        return kpi in stack
+    visited = set(stack)
+    while stack:
+        current = stack.pop()
+        if current == kpi:
+            return True
+        for ref in snapshot['kpi_dependencies'].get(current, ()):
+            if ref not in visited:
+                visited.add(ref)
+                stack.append(ref)
+    return False
+
+def _dependents_closure(snapshot, kpi):
+    """
+    Lists a KPI and every KPI that transitively references it.
 
-def _backup():
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - kpi (str): The label of the KPI.
+
+    Returns:
+    - set: The labels of the KPIs whose expansion includes kpi, kpi included.
     """
-    Creates a backup of the current ontology and manages cleanup of old backups.
+    stack = [kpi]
+    found = {kpi}
+    while stack:
+        for dependent in snapshot['kpi_dependents'].get(stack.pop(), ()):
+            if dependent not in found:
+                found.add(dependent)
+                stack.append(dependent)
+    return found
+
+def _kpi_closure(snapshot, kpi):
+    """
+    Returns the formulas of a KPI and of every KPI it transitively references, memoized in the
+    'kpi_closure' of the snapshot (readers of the same version all store the same expansions).
 
-    Global Variables Used:
-    - SAVE_INT: Determines the naming and management of backups.
-    - ONTO: The ontology object being saved.
+    The graph is explored breadth-first so that labels appear in the order in which the formulas
+    reference them, each KPI being expanded once even if several formulas share it.
 
-    File Management:
-    - Saves the ontology in RDF/XML format.
-    - Deletes older backups based on the fine and coarse grain intervals.
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - kpi (str): The label of a KPI with a valid formula.
+
+    Returns:
+    - dict: Maps KPI labels to their formulas, or None if a referenced KPI is missing or ambiguous.
     """
-    global SAVE_INT
-    coarse_grain = 8  # Defines the coarse-grain interval
-    max_fine_b = 3  # Maximum fine-grain backups to keep
-    max_coarse_b = 2  # Maximum coarse-grain backups to keep
+    memo = snapshot['kpi_closure']
+    if kpi in memo:
+        return memo[kpi]
+
+    closure = {kpi: _lookup(snapshot, kpi)[0]['formula']}
+    to_unroll = deque([(kpi, 0)])  # KPIs to expand, with their depth of nesting
+    depth = 0
+    while to_unroll:
+        current, depth = to_unroll.popleft()
+        for ref in snapshot['kpi_dependencies'].get(current, ()):
+            if ref in closure:
+                continue
+            target = _lookup(snapshot, ref)
+            if len(target) != 1 or target[0]['formula'] is None:
+                closure = None
+                break
+            closure[ref] = target[0]['formula']
+            to_unroll.append((ref, depth + 1))
+        if closure is None:
+            break
+
+    kbm.observe('kb_formula_unroll_depth', depth, kbm.DEPTH_BUCKETS)
+    with _CLOSURE_LOCK:
+        memo[kpi] = closure
+    return closure
 
-    # Save the current ontology
-    ONTO.save(file=str(MAIN_DIR / (str(SAVE_INT) + '.owl')), format="rdfxml")
-
-    # Delete old backups based on the fine-grain interval
-    if (SAVE_INT - max_fine_b) % coarse_grain == 0:
-        # Delete the corresponding coarse-grain backup if it exceeds limits
-        if (SAVE_INT - max_fine_b) / coarse_grain - max_coarse_b > 0:
-            os.remove(str(MAIN_DIR / (str(SAVE_INT - max_fine_b - max_coarse_b * coarse_grain) + '.owl')))
-    else:        
-        # Delete excess fine-grain backups
-        if SAVE_INT - max_fine_b > 0:
-            os.remove(str(MAIN_DIR / (str(SAVE_INT - max_fine_b) + '.owl')))
-
-    # Increment the save interval and update the configuration file
-    SAVE_INT += 1
-    with open(CONFIG_PATH, 'w+') as cfg:
-        cfg.write(str(SAVE_INT))
-    
-def _extract_label(lab):
-    if isinstance(lab, list):
-        return str(lab.first())
-    else:
-        return str(lab)
-    
 def _fix():
     for el in get_instances('kpi'):
-        target = ONTO.search(label=el)[0]
+        target = _search(el)[0]
         if el in ['energy_efficiency', 'non_operative_time', 'operative_consumption', 'total_consumption', 'total_energy_cost']:
             DEPENDS_ON[target] = [OPERATION_CASS]
         else:
@@ -175,21 +2115,25 @@ def _fix():
 
  
  
-def get_formulas(kpi):
+def get_formulas(kpi, snapshot=None):
     """
     Retrieves and expands formulas associated with a given KPI.
 
     This function identifies the formula for a KPI and recursively unrolls any nested KPIs 
-    referenced within the formula until all dependencies are fully resolved.
+    referenced within the formula until all dependencies are fully resolved. The expansion is
+    read from the KPI dependency graph, where it is memoized.
 
     Parameters:
     - kpi (str): The label of the KPI whose formulas need to be expanded.
+    - snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
 
     Returns:
     - kpi_formula (dict): A dictionary mapping KPI labels to their formulas.
     """
-    # Search for the KPI in the ontology.
-    target = ONTO.search(label=kpi)
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+
+    # Search for the KPI in the read model.
+    target = _lookup(snapshot, kpi)
     
     # Ensure exactly one match is found; otherwise, report an error.
     if not target or len(target) > 1:
@@ -198,37 +2142,24 @@ def get_formulas(kpi):
     
     target = target[0]  # Select the first result.
     
-    # Verify the target is a KPI.
-    if not any(issubclass(cls, KPI_CLASS) for cls in target.is_a):
+    # Verify the target is a KPI with a formula.
+    if not target['kpi'] or target['formula'] is None:
         print(kpi,"IS NOT A VALID KPI")
         return
     
-    # Initialize lists for formulas to unroll and store resolved formulas.
-    to_unroll = [PARSABLE_FORMULA[target][0]]
-    kpi_formula = {kpi: PARSABLE_FORMULA[target][0]}
-    
-    # Expand all formulas by resolving nested KPI references.
-    while to_unroll:
-        # Match every KPI reference contained in the formula to_unroll[0]
-        matches = re.findall(r'R°[A-Za-z_]+°[A-Za-z_]*°[A-Za-z_]*°[A-Za-z_]*°', to_unroll.pop(0))
-        
-        for match in matches:
-            # For every macth append the kpi to to_unroll and save the data to be returnedù
-            # And recursively match KPI references
-            kpi_name = re.match(r'R°([A-Za-z_]+)°[A-Za-z_]*°[A-Za-z_]*°[A-Za-z_]*°', match).group(1)
-            target = ONTO.search(label=kpi_name)
-            
-            if not target or len(target) > 1:
-                print("DOUBLE OR NONE REFERENCED KPI")
-                return
-            
-            target = target[0]
-            to_unroll.append(PARSABLE_FORMULA[target][0])
-            kpi_formula[kpi_name] = PARSABLE_FORMULA[target][0]
+    # A KPI whose formula could not be parsed does not reference other KPIs.
+    if kpi not in snapshot['formula_ast']:
+        return {kpi: target['formula']}
+
+    # Look up the formulas of every KPI it transitively references.
+    kpi_formula = _kpi_closure(snapshot, kpi)
+    if kpi_formula is None:
+        print("DOUBLE OR NONE REFERENCED KPI")
+        return
     
-    return kpi_formula
+    return dict(kpi_formula)
 
-def get_closest_kpi_formulas(kpi, method='levenshtein'):
+def get_closest_kpi_formulas(kpi, method='levenshtein', snapshot=None):
     """
     Finds the formulas associated with a KPI or the closest matching KPI.
 
@@ -238,33 +2169,78 @@ def get_closest_kpi_formulas(kpi, method='levenshtein'):
     Parameters:
     - kpi (str): The label of the KPI to search for.
     - method (str, optional): The similarity metric to use (default is 'levenshtein').
+    - snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
 
     Returns:
     - tuple:
       - formulas (dict): A dictionary mapping KPI labels to their formulas.
       - similarity (float): The similarity score (1 for exact matches).
     """
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+
     # Attempt to retrieve the exact formulas for the given KPI.
-    ret = get_formulas(kpi)
+    ret = get_formulas(kpi, snapshot)
     
     if not ret:
-        # Initialize variables to track the closest match and similarity.
-        max_val = -math.inf
-        max_label = ''
-        
-        # Compare the KPI with all individuals in the ontology.
-        for ind in KPI_CLASS.instances():
-            similarity = _get_similarity(kpi, ind.label.en.first(), method)
-            if max_val < similarity:
-                max_val = similarity
-                max_label = ind.label.en.first()
+        # Find the closest KPI label through the fuzzy index.
+        matches = get_closest_labels(kpi, 'kpi_formulas', method, snapshot=snapshot)
+        max_label, max_val = matches[0] if matches else ('', -math.inf)
         
         # Return the formulas for the closest matching label.
-        return get_formulas(max_label), max_val
+        return get_formulas(max_label, snapshot), max_val
     else:
         return ret, 1  # Return exact match with similarity score of 1.
 
+def get_entity_counts(snapshot=None):
+    """
+    Counts the entities of the KB.
+
+    Parameters:
+    - snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
+
+    Returns:
+    - dict: The number of 'class', 'instance' and 'property' entities, and of 'kpi' instances.
+    """
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+    counts = {'class': 0, 'instance': 0, 'property': 0}
+    for record in snapshot['read_model']['entities'].values():
+        counts[record['kind']] += 1
+    counts['kpi'] = len(snapshot['hierarchy']['instances'].get(
+        snapshot['read_model']['labels'].get('kpi', [None])[0], ()))
+    return counts
+
+def get_kpi_page(after=None, limit=None, snapshot=None):
+    """
+    Lists a page of the KPIs, in the order get_instances('kpi') returns them, so that their formulas
+    can be retrieved a page at a time.
+
+    Parameters:
+    - after (str, optional): The cursor of the page: the label of the last KPI of the previous page
+      (default is to start from the first KPI).
+    - limit (int, optional): The maximum number of KPIs in the page (default is every remaining KPI).
+    - snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
 
+    Returns:
+    - tuple: The labels of the KPIs of the page, and the cursor of the next page (None if it is the last one),
+      or None if the cursor is not a KPI.
+    """
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+    kpis = snapshot['hierarchy']['instances'].get(snapshot['read_model']['labels'].get('kpi', [None])[0], [])
+
+    # New KPIs are appended to the list, so the position of the cursor never moves back
+    first = 0
+    if after is not None:
+        position = _KPI_POSITIONS['positions'].get(after)
+        if position is None or position >= len(kpis) or kpis[position] != after:
+            positions = _KPI_POSITIONS['positions'] = {lab: i for i, lab in enumerate(kpis)}
+            position = positions.get(after)
+            if position is None:
+                print(after, 'IS NOT A VALID CURSOR')
+                return None
+        first = position + 1
+
+    last = len(kpis) if limit is None else min(first + limit, len(kpis))
+    return kpis[first:last], kpis[last - 1] if last < len(kpis) else None
 
 def add_kpi(superclass, label, description, unit_of_measure, parsable_computation_formula, 
             human_readable_formula=None, depends_on_machine=False, depends_on_operation=False):
@@ -286,27 +2262,292 @@ def add_kpi(superclass, label, description, unit_of_measure, parsable_computatio
 
     Returns:
     - None: Prints errors or creates the KPI instance.
+
+    Notes:
+    - Readers keep answering from the previous SNAPSHOT until the KPI is complete in the next one.
+    - The KPI is journaled by a background worker. With DURABILITY set to 'flush' this function
+      returns once it is written to the journal, with 'enqueue' as soon as it is scheduled.
+    """
+    record = {'mutation': 'add_kpi', 'superclass': superclass, 'label': label, 'description': description,
+              'unit_of_measure': unit_of_measure, 'parsable_computation_formula': parsable_computation_formula,
+              'human_readable_formula': human_readable_formula, 'depends_on_machine': depends_on_machine,
+              'depends_on_operation': depends_on_operation}
+
+    if _SHARED_STATE['role'] == 'follower':
+        # Only the writer process mutates the KB
+        applied, errors = _forward_mutation(record)
+        for error in errors:
+            print(error)
+        if applied:
+            print('KPI', label, 'successfully added to the ontology!')
+        return
+
+    if READ_ONLY:
+        print('THE KB IS READ-ONLY')
+        return
+
+    sequence = _apply_mutation(record)
+    if sequence is None:
+        return
+    if DURABILITY == 'flush':
+        _wait_for_mutation(sequence)
+    print('KPI', label, 'successfully added to the ontology!')
+
+def add_kpis(kpis):
+    """
+    Adds many KPIs to the ontology at once, e.g. to import the catalog of a new plant.
+
+    Every KPI is validated before any is created: the batch is rejected as a whole if one of them fails
+    a check of add_kpi, if two of them share a label, or if their formulas reference each other in a
+    cycle. Formulas may reference KPIs of the batch, whatever their position in it. The KPIs are then
+    created in a single SNAPSHOT version and journaled as one mutation.
+
+    Parameters:
+    - kpis (list): Dictionaries with the parameters of add_kpi as keys; 'human_readable_formula',
+      'depends_on_machine' and 'depends_on_operation' are optional.
+
+    Returns:
+    - list: The reasons why the batch was rejected (also printed), one per invalid KPI; empty if every
+      KPI was added.
+    """
+    kpis = [dict({'human_readable_formula': None, 'depends_on_machine': False, 'depends_on_operation': False},
+                 **kpi) for kpi in kpis]
+
+    if not kpis:
+        return []
+
+    # Report every invalid KPI before trying to add any of them
+    errors = _validate_kpis(SNAPSHOT, kpis)[0]
+    if not errors:
+        record = {'mutation': 'add_kpis', 'kpis': kpis}
+        if _SHARED_STATE['role'] == 'follower':
+            # Only the writer process mutates the KB
+            applied, errors = _forward_mutation(record)
+            if not applied and not errors:
+                errors = ['THE BATCH WAS REJECTED BY THE WRITER PROCESS']
+        elif READ_ONLY:
+            errors = ['THE KB IS READ-ONLY']
+        else:
+            # The KB may have changed since the batch was validated
+            sequence = _apply_mutation(record, errors)
+            if sequence is None and not errors:
+                errors = ['THE BATCH WAS REJECTED']
+            elif sequence is not None and DURABILITY == 'flush':
+                _wait_for_mutation(sequence)
+
+    for error in errors:
+        print(error)
+    if not errors:
+        print(len(kpis), 'KPIS successfully added to the ontology!')
+    return errors
+
+def _validate_kpis(snapshot, kpis):
+    """
+    Checks a batch of new KPIs against a version of the KB, reading only its read model and indexes.
+
+    Parameters:
+    - snapshot (dict): The version of the KB to check against.
+    - kpis (list): The KPIs, as dictionaries with every parameter of add_kpi.
+
+    Returns:
+    - tuple: One message per invalid KPI, naming its position in the batch and its label, and the labels
+      of the valid KPIs in an order they can be created in (see _batch_order).
+    """
+    fields = ('superclass', 'label', 'description', 'unit_of_measure', 'parsable_computation_formula',
+              'human_readable_formula', 'depends_on_machine', 'depends_on_operation')
+    labels = snapshot['read_model']['labels']
+    kpi_class = labels.get('kpi', [None])[0]
+    errors = []
+    seen = set()  # Labels of the KPIs checked so far
+    batch = {}  # Maps the label of every valid KPI to the KPI labels its formula references
+    positions = {}  # Maps the label of every valid KPI to its position in the batch
+
+    for position, kpi in enumerate(kpis):
+        name = 'KPI ' + str(position) + ' (' + str(kpi.get('label')) + '):'
+        missing = [field for field in fields[:5] if not isinstance(kpi.get(field), str)]
+        unknown = sorted(set(kpi) - set(fields))
+        if missing or unknown:
+            errors.append(' '.join([name, 'INVALID FIELDS'] + missing + unknown))
+            continue
+        if kpi['label'] in seen:
+            errors.append(name + ' DUPLICATE LABEL IN THE BATCH')
+            continue
+        seen.add(kpi['label'])
+        if kpi['label'] in labels:
+            errors.append(name + ' ALREADY EXISTS')
+            continue
+        superclass = labels.get(kpi['superclass'], ())
+        if len(superclass) != 1:
+            errors.append(name + ' DOUBLE OR NONE REFERENCED SUPERCLASS')
+            continue
+        if not _is_subclass(snapshot, superclass[0], kpi_class):
+            errors.append(name + ' NOT A VALID SUPERCLASS')
+            continue
+        try:
+            batch[kpi['label']] = tuple(dict.fromkeys(kbf.kpi_references(
+                kbf.parse_formula(kpi['parsable_computation_formula']))))
+            positions[kpi['label']] = position
+        except kbf.FormulaSyntaxError as e:
+            errors.append(name + ' INVALID FORMULA: ' + str(e))
+
+    # References between the KPIs of the batch, direct or through KPIs of the KB, must not form a cycle
+    order, cyclic = _batch_order(snapshot, batch)
+    errors.extend('KPI ' + str(position) + ' (' + kpis[position]['label'] + '): WOULD CREATE A CYCLIC REFERENCE'
+                  for position in sorted(positions[label] for label in cyclic))
+    return errors, order
+
+def _batch_order(snapshot, batch):
+    """
+    Orders a batch of new KPIs so that every KPI comes after the KPIs of the batch its formula depends on,
+    directly or through KPIs of the KB (iterative depth-first search).
+
+    Parameters:
+    - snapshot (dict): The version of the KB the KPIs are added to.
+    - batch (dict): Maps the label of every new KPI to the distinct KPI labels its formula references.
+
+    Returns:
+    - tuple: The labels of the batch in dependency order, and the set of those on a reference cycle.
+    """
+    def references(kpi):
+        return batch[kpi] if kpi in batch else snapshot['kpi_dependencies'].get(kpi, ())
+
+    state = {}  # Maps the visited labels to 'open' while they are on the path, then to 'done'
+    order = []
+    cyclic = set()
+    for root in batch:
+        if root in state:
+            continue
+        path = [root]
+        refs = [iter(references(root))]
+        state[root] = 'open'
+        while path:
+            ref = next(refs[-1], None)
+            if ref is None:
+                # Every reference has been visited: the KPI can be placed
+                done = path.pop()
+                refs.pop()
+                state[done] = 'done'
+                if done in batch:
+                    order.append(done)
+            elif ref not in state:
+                path.append(ref)
+                refs.append(iter(references(ref)))
+                state[ref] = 'open'
+            elif state[ref] == 'open':
+                # A reference back to the path closes a cycle
+                cyclic.update(kpi for kpi in path[path.index(ref):] if kpi in batch)
+    return order, cyclic
+
+def _apply_mutation(record, errors=None):
+    """
+    Applies a mutation, publishes the resulting SNAPSHOT and schedules its journaling.
+
+    Parameters:
+    - record (dict): The 'mutation' name ('add_kpi' or 'add_kpis') and its arguments.
+    - errors (list, optional): Collects the reasons why a batch of KPIs is rejected instead of printing them.
+
+    Returns:
+    - int: The sequence number of the mutation, to be passed to _wait_for_mutation, or None if it was
+      rejected (the reason is printed).
+    """
+    arguments = dict(record)
+    mutation = arguments.pop('mutation')
+    with KB_LOCK:
+        draft = _draft()
+        # The read model changes are journaled too, for the processes that do not load the ontology
+        if mutation == 'add_kpis':
+            kpis = _create_kpis(draft, arguments['kpis'], errors)
+            if kpis is None:
+                return None
+            journaled = dict(record, kpis=kpis)
+        else:
+            change = _create_kpi(draft, **arguments)
+            if change is None:
+                return None
+            journaled = dict(record, read_model=change)
+        epoch, number, mutations = draft['revision']
+        draft['revision'] = (epoch, number, mutations + 1)
+        _publish(draft)
+        return _schedule_mutation(journaled)
+
+def _create_kpis(draft, kpis, errors=None):
+    """
+    Validates a batch of new KPIs and adds all of them to the ontology and to every index of a draft,
+    or none of them. Must be called while holding KB_LOCK.
+
+    Parameters:
+    - draft (dict): The draft being built.
+    - kpis (list): The KPIs, as dictionaries with every parameter of add_kpi.
+    - errors (list, optional): Collects the reasons why the batch is rejected (they are printed otherwise).
+
+    Returns:
+    - list: The KPIs in the order they were created, each with its read model changes under 'read_model',
+      or None if the batch was rejected.
+    """
+    found, order = _validate_kpis(draft, kpis)
+    if found:
+        if errors is None:
+            for error in found:
+                print(error)
+        else:
+            errors.extend(found)
+        return None
+
+    # Create every KPI after those it depends on, so that the KPI order can simply be extended
+    by_label = {kpi['label']: kpi for kpi in kpis}
+    created = []
+    for label in order:
+        kpi = by_label[label]
+        created.append(dict(kpi, read_model=_create_kpi(draft, views=False, **kpi)))
+
+    # Materialize the views of the new KPIs and of their classes once for the whole batch
+    _refresh_views(draft, dict.fromkeys(iri for kpi in created
+                                        for iri in [kpi['read_model']['iri']] + kpi['read_model']['classes']))
+    return created
+
+def _create_kpi(draft, superclass, label, description, unit_of_measure, parsable_computation_formula,
+                human_readable_formula=None, depends_on_machine=False, depends_on_operation=False, views=True):
+    """
+    Validates a new KPI and adds it to the ontology and to every index of a draft, without saving.
+    Takes the parameters of add_kpi after the draft and must be called while holding KB_LOCK. With views
+    False the property views are left to the caller (see _refresh_views).
+
+    Returns:
+    - dict: The changes of the read model (see _insert_kpi), or None if the KPI was rejected (the reason
+      is printed).
     """
     if not human_readable_formula:
         human_readable_formula = parsable_computation_formula
     
     # Validate that the KPI label does not already exist.
-    if ONTO.search(label=label):
+    if _search(label):
         print('KPI', label, 'ALREADY EXISTS')
-        return
+        return None
     
     # Validate that the superclass is defined and unique.
-    target = ONTO.search(label=superclass)
+    target = _search(superclass)
     if not target or len(target) > 1:
         print("DOUBLE OR NONE REFERENCED KPI")
-        return
+        return None
     
     target = target[0]
     
     # Ensure the superclass is valid (either a KPI class or derived from it).
-    if not (KPI_CLASS == target or any(KPI_CLASS in cls.ancestors() for cls in target.is_a)):
+    if not _is_subclass(draft, target.iri, KPI_CLASS.iri):
         print("NOT A VALID SUPERCLASS")
-        return
+        return None
+
+    # Validate the formula against the grammar.
+    try:
+        formula_ast = kbf.parse_formula(parsable_computation_formula)
+    except kbf.FormulaSyntaxError as e:
+        print('INVALID FORMULA:', e)
+        return None
+
+    # Reject formulas that would close a reference cycle through KPIs already referencing the label.
+    if _reaches(draft, kbf.kpi_references(formula_ast), label):
+        print('KPI', label, 'WOULD CREATE A CYCLIC REFERENCE')
+        return None
     
     # Create the KPI and assign attributes.
     new_el = target(_generate_hash_code(label))
@@ -323,13 +2564,67 @@ def add_kpi(superclass, label, description, unit_of_measure, parsable_computatio
         DEPENDS_ON[new_el] = [OPERATION_CASS]
     elif depends_on_machine:
         DEPENDS_ON[new_el] = [MACHINE_CASS]
-    
-    _backup()  # Save changes.
-    print('KPI', label, 'successfully added to the ontology!')
+
+    _index_entity(new_el)  # Make the new KPI reachable by label.
+    change = {'iri': new_el.iri, 'record': _entity_record(new_el),
+              'classes': list(draft['hierarchy']['ancestors'][target.iri])}
+    _insert_kpi(draft, label, formula_ast, change, views)
+    return change
+
+def _insert_kpi(draft, label, formula_ast, change, views=True):
+    """
+    Adds a new KPI to every index of a draft.
+
+    Parameters:
+    - draft (dict): The draft being built.
+    - label (str): The label of the KPI.
+    - formula_ast: The syntax tree of its parsable computation formula.
+    - change (dict): Its read model changes, as returned by _create_kpi and journaled: 'iri' (its IRI),
+      'record' (its read model record) and 'classes' (IRIs of the classes it is an instance of).
+    - views (bool, optional): Whether to update the property views it changes (default is True).
+    """
+    model = _writable(draft, draft, 'read_model')
+    entities = _writable(draft, model, 'entities')
+    entities[change['iri']] = change['record']
+    iris = _writable(draft, _writable(draft, model, 'labels'), label, list)
+    if change['iri'] not in iris:
+        iris.append(change['iri'])
+    class_instances = _writable(draft, _writable(draft, draft, 'hierarchy'), 'instances')
+    for iri in change['classes']:  # The KPI is an instance of the superclass and of its ancestors.
+        if iri in class_instances:
+            _writable(draft, class_instances, iri, list).append(label)
+    _writable(draft, draft, 'formula_ast')[label] = formula_ast
+    _add_dependencies(draft, label)
+
+    # Formulas referencing the new label could not be resolved until now: forget their expansions.
+    with _CLOSURE_LOCK:  # Readers may be adding to the memo being copied
+        memo = _writable(draft, draft, 'kpi_closure')
+    for kpi in _dependents_closure(draft, label):
+        memo.pop(kpi, None)
+    if draft['kpi_dependents'].get(label):
+        draft['kpi_order'] = _sort_kpis(draft)
+    else:
+        _writable(draft, draft, 'kpi_order', list).append(label)
+    for kind in FUZZY_KINDS:
+        _fuzzy_insert(draft, kind, label)
+
+    # The views of the classes the KPI is an instance of list it among their instances
+    if views:
+        _refresh_views(draft, [change['iri']] + change['classes'])
+
+def _refresh_views(draft, iris):
+    """
+    Computes again the property views of the given entities in a draft, for those with a label of their own.
+    """
+    entities = draft['read_model']['entities']
+    views = _writable(draft, draft, 'property_views')
+    for iri in iris:
+        if iri in entities and _has_own_label(draft, iri):
+            views[iri] = _property_view(draft, entities[iri])
 
 
 
-def get_instances(owl_class_label):
+def get_instances(owl_class_label, snapshot=None):
     """
     Retrieves all instances of a given OWL class.
 
@@ -338,12 +2633,15 @@ def get_instances(owl_class_label):
 
     Parameters:
     - owl_class_label (str): The label of the OWL class or instance to search for.
+    - snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
 
     Returns:
     - list: Labels of all matching instances, or an empty list if none are found.
     """
-    # Search for the class or individual in the ontology using the provided label.
-    target = ONTO.search(label=owl_class_label)
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+
+    # Search for the class or individual in the read model using the provided label.
+    target = _lookup(snapshot, owl_class_label)
     
     # Validate that the search returned a unique result.
     if not target or len(target) > 1:
@@ -351,31 +2649,20 @@ def get_instances(owl_class_label):
         return
     
     target = target[0]  # Extract the single match.
-    instances = set()  # Initialize a set to store the instances.
     
     # Check if the target is an OWL class.
-    if isinstance(target, or2.ThingClass):
-        # Start with the target class and explore all its subclasses.
-        classes_to_process = [target]
-        while classes_to_process:
-            current_class = classes_to_process.pop()
-            
-            # Add all instances of the current class to the set.
-            instances.update(i.label.en.first() for i in current_class.instances())
-            
-            # Add subclasses of the current class to the processing queue.
-            classes_to_process.extend(current_class.subclasses())
-    # If the target is an individual, add it directly to the set of instances.
-    elif isinstance(target, or2.Thing):
-        instances.add(owl_class_label)
+    if target['kind'] == 'class':
+        # Read the instances of the class and its subclasses from the hierarchy index.
+        return list(snapshot['hierarchy']['instances'][snapshot['read_model']['labels'][owl_class_label][0]])
+    # If the target is an individual, return it directly.
+    elif target['kind'] == 'instance':
+        return [owl_class_label]
     else:
         # If the input is neither a class nor an individual, print an error message.
         print("INPUT IS NEITHER A CLASS NOR AN INSTANCE")
-    
-    # Return the list of instances found.
-    return list(instances)
+        return []
 
-def get_closest_class_instances(owl_class_label, method='levenshtein'):
+def get_closest_class_instances(owl_class_label, method='levenshtein', snapshot=None):
     """
     Retrieves all instances of a given OWL class or individual, if not exact match is found search for the
     most similar element in the KB.
@@ -383,47 +2670,33 @@ def get_closest_class_instances(owl_class_label, method='levenshtein'):
     Parameters:
     - owl_class_label (str): The label of the class or individual to search for.
     - method (str): The similarity method (default is 'levenshtein').
+    - snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
 
     Returns:
     - tuple:
       - list: Instances of the closest matching class or individual.
       - float: The similarity score of the closest match.
     """
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+
     # Attempt to retrieve the instances of the exact class or individual.
-    ret = get_instances(owl_class_label)
+    ret = get_instances(owl_class_label, snapshot)
     
     # If no instances are found, look for the closest match.
     if not ret:
-        max_val = -math.inf  # Initialize the highest similarity score.
-        max_label = ''  # Initialize the label of the closest match.
-        
-        # Iterate over all classes in the ontology.
-        for ind in ONTO.classes():
-            # Compute the similarity between the input and the current class label.
-            similarity = _get_similarity(owl_class_label, ind.label.en.first(), method)
-            # Update the closest match if the similarity is higher.
-            if max_val < similarity:
-                max_val = similarity
-                max_label = ind.label.en.first()
-        
-        # Iterate over all individuals in the ontology.
-        for ind in ONTO.individuals():
-            # Compute the similarity between the input and the current individual label.
-            similarity = _get_similarity(owl_class_label, ind.label.en.first(), method)
-            # Update the closest match if the similarity is higher.
-            if max_val < similarity:
-                max_val = similarity
-                max_label = ind.label.en.first()
+        # Find the closest class or individual label through the fuzzy index.
+        matches = get_closest_labels(owl_class_label, 'class_instances', method, snapshot=snapshot)
+        max_label, max_val = matches[0] if matches else ('', -math.inf)
         
         # Retrieve the instances of the closest matching label and return them.
-        return get_instances(max_label), max_val
+        return get_instances(max_label, snapshot), max_val
     else:
         # If exact match is found, return the instances with similarity score of 1.
         return ret, 1
 
 
 
-def get_object_properties(owl_label):
+def get_object_properties(owl_label, snapshot=None):
     """
     Retrieves all the properties (annotation, object, and data properties) associated with an ontology entity
     based on its label. It also returns information about superclasses, subclasses, and instances if the element
@@ -431,6 +2704,7 @@ def get_object_properties(owl_label):
 
     Args:
         owl_label (str): The label of the ontology element (class or individual) whose properties are to be retrieved.
+        snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
 
     Returns:
         dict: A dictionary containing the information associated with the entity, including:
@@ -443,68 +2717,74 @@ def get_object_properties(owl_label):
             - 'entity_type': The nature of the referred entity which can be class, istance or property 
             - 'ontology_property_name': List of every entity related to the referenced entoty with the 'ontology_property_name' property
     """
-    # Search for the target element using its label in the ontology.
-    target = ONTO.search(label=owl_label)
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+
+    # Search for the target element using its label in the read model.
+    target = _lookup(snapshot, owl_label)
     
     if not target or len(target) > 1:
         print("DOUBLE OR NONE REFERENCED KPI")
         return
     
-    target = target[0]  # Extract the single matching element.
-    
-    properties = {'label': _extract_label(target.label)}  # Initialize properties dictionary with the label.
-    
-    # Iterate over annotation properties to gather description and other annotations.
-    for prop in ONTO.annotation_properties():
-        references = prop[target]
-        if references:
-            if prop._name == 'description':
-                properties['description'] = _extract_label(prop[target])  # Handle description property
-            else:
-                properties[_extract_label(prop.label)] = _extract_label(prop[target])  # Handle other annotations
-    
-    # Iterate over object properties to gather object property values.
-    for prop in ONTO.object_properties():
-        references = prop[target]
-        if references:
-            properties[_extract_label(prop.label)] = [_extract_label(x.label) for x in references]  # List of related objects
+    # Read the materialized view of the element, copying its lists so that callers cannot modify the snapshot.
+    view = snapshot['property_views'].get(snapshot['read_model']['labels'][owl_label][0])
+    if view is None:
+        view = _property_view(snapshot, target[0])
+    return {name: list(value) if isinstance(value, list) else value for name, value in view.items()}
+
+def _property_view(snapshot, target):
+    """
+    Computes what get_object_properties returns for an entity.
+
+    Parameters:
+    - snapshot (dict): The version of the KB to read.
+    - target (dict): The read model record of the entity.
+
+    Returns:
+    - dict: The properties of the entity (see get_object_properties).
+    """
+    entities = snapshot['read_model']['entities']
+    properties = {'label': target['label']}  # Initialize properties dictionary with the label.
     
-    # Iterate over data properties to gather data property values.
-    for prop in ONTO.data_properties():
-        references = prop[target]
-        if references:
-            properties[_extract_label(prop.label)] = _extract_label(references)  # Single data property value
-            
-            # Special handling for PARSABLE_FORMULA, extracting dependencies.
-            if prop == PARSABLE_FORMULA:
-                depends_on_kpi = []
-                matches = re.findall(r'R°[A-Za-z_]+°[A-Za-z_]*°[A-Za-z_]*°[A-Za-z_]*°', references[0])  
-                for match in matches:
-                    kpi_name = re.match(r'R°([A-Za-z_]+)°[A-Za-z_]*°[A-Za-z_]*°[A-Za-z_]*°', match).group(1)
-                    depends_on_kpi.append(kpi_name)
-                properties['depends_on_other_kpi'] = depends_on_kpi
-
-    # Check if the target is a class (ThingClass) and retrieve its superclass and subclass information.
-    if isinstance(target, or2.ThingClass):
-        properties['superclasses'] = [_extract_label(superclass.label) for superclass in target.is_a if 
-                                      isinstance(superclass, or2.ThingClass) and 
-                                      _extract_label(superclass.label) != 'None']
-        properties['subclasses'] = [_extract_label(subclass.label) for subclass in target.subclasses()]
-        properties['instances'] = get_instances(_extract_label(target.label))
+    # Add the values of the annotation, object and data properties of the element.
+    for name, value in target['facts']:
+        if name == 'depends_on_other_kpi':
+            # Dependencies are extracted from the parsed formula.
+            value = _formula_references(snapshot, target['label'])
+        properties[name] = list(value) if isinstance(value, list) else value
+
+    # Add superclass, subclass and instance information for classes, superclasses for individuals.
+    if target['kind'] == 'class':
+        properties['superclasses'] = list(target['superclasses'])
+        properties['subclasses'] = [entities[iri]['label'] for iri in target['subclasses'] if iri in entities]
+        properties['instances'] = get_instances(target['label'], snapshot)
         properties['entity_type'] = 'class'
-        
-    # Check if the target is an individual (Thing) and retrieve its superclass information.
-    elif isinstance(target, or2.Thing):
-        properties['superclasses'] = [_extract_label(superclass.label) for superclass in target.is_a if 
-                                      isinstance(superclass, or2.ThingClass) and 
-                                      _extract_label(superclass.label) != 'None']
+    elif target['kind'] == 'instance':
+        properties['superclasses'] = list(target['superclasses'])
         properties['entity_type'] = 'instance'
     else:
         properties['entity_type'] = 'property'
 
     return properties
+
+def _has_own_label(snapshot, iri):
+    """
+    Tells whether the label of an entity designates it alone, so that get_object_properties can reach it by it.
+    """
+    model = snapshot['read_model']
+    return model['labels'].get(model['entities'][iri]['label']) == [iri]
+
+def _build_property_views(draft):
+    """
+    Materializes into a draft the get_object_properties result of every entity with a label of its own.
+    Entities sharing their label are computed when requested, if another of their labels reaches them.
+    """
+    views = _writable(draft, draft, 'property_views')
+    for iri, record in draft['read_model']['entities'].items():
+        if _has_own_label(draft, iri):
+            views[iri] = _property_view(draft, record)
     
-def get_closest_object_properties(owl_label, method='levenshtein'):
+def get_closest_object_properties(owl_label, method='levenshtein', snapshot=None):
     """
     Apply get_object_properties to the entity whose label is the closest match to the given label.
     The closeness is determined by a similarity measure (default is Levenshtein distance).
@@ -512,56 +2792,163 @@ def get_closest_object_properties(owl_label, method='levenshtein'):
     Args:
         owl_label (str): The label of the ontology element whose closest match is to be found.
         method (str): The similarity measure to use for finding the closest match (default: 'levenshtein').
+        snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
 
     Returns:
         tuple: A tuple containing:
             - dict: The properties of the closest matching element.
             - float: The similarity score (between 0 and 1) of the closest match.
     """
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+
     # Attempt to retrieve properties for the exact match of the owl_label.
-    ret = get_object_properties(owl_label)
+    ret = get_object_properties(owl_label, snapshot)
     
     if not ret:
-        max_val = -math.inf  # Initialize a variable to track the maximum similarity score.
-        max_label = ''  # Initialize a variable to store the label of the closest match.
-
-        # Check similarity with all classes in the ontology.
-        for ind in ONTO.classes():
-            similarity = _get_similarity(owl_label, ind.label.en.first(), method)
-            if max_val < similarity:
-                max_val = similarity
-                max_label = ind.label.en.first()
-
-        # Check similarity with all individuals in the ontology.
-        for ind in ONTO.individuals():
-            similarity = _get_similarity(owl_label, ind.label.en.first(), method)
-            if max_val < similarity:
-                max_val = similarity
-                max_label = ind.label.en.first()
-
-        # Check similarity with all object properties in the ontology.
-        for ind in ONTO.object_properties():
-            similarity = _get_similarity(owl_label, _extract_label(ind.label), method)
-            if max_val < similarity:
-                max_val = similarity
-                max_label = ind.label.en.first()
-
-        # Check similarity with all data properties in the ontology.
-        for ind in ONTO.data_properties():
-            similarity = _get_similarity(owl_label, _extract_label(ind.label), method)
-            if max_val < similarity:
-                max_val = similarity
-                max_label = ind.label.en.first()
-
-        # Check similarity with all annotation properties in the ontology.
-        for ind in ONTO.annotation_properties():
-            similarity = _get_similarity(owl_label, _extract_label(ind.label), method)
-            if max_val < similarity:
-                max_val = similarity
-                max_label = ind.label.en.first()
+        # Find the closest class, individual or property label through the fuzzy index.
+        matches = get_closest_labels(owl_label, 'object_properties', method, snapshot=snapshot)
+        max_label, max_val = matches[0] if matches else ('', -math.inf)
 
         # Return the properties of the closest match along with the similarity score.
-        return get_object_properties(max_label), max_val
+        return get_object_properties(max_label, snapshot), max_val
     else:
         return ret, 1  # If the exact match is found, return its properties with a similarity of 1.
 
+def resolve_labels(items, snapshot=None):
+    """
+    Resolves many labels at once, each like the get_closest_* function matching its kind.
+
+    Exact matches are served from the label index. The labels without an exact match are grouped
+    by kind and method, and every group is matched against the candidate labels in a single pass.
+
+    Args:
+        items (list): Dictionaries with the keys:
+            - 'label' (str): The label to resolve.
+            - 'kind' (str): 'kpi_formulas', 'class_instances' or 'object_properties'.
+            - 'method' (str, optional): The similarity method to use (default: 'levenshtein').
+        snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
+
+    Returns:
+        list: One dictionary per item, in the same order, containing:
+            - 'label': The requested label.
+            - 'kind': The requested kind.
+            - 'match': The label actually resolved (the closest one if there is no exact match).
+            - 'similarity': The similarity score of the match (1 for exact matches).
+            - 'result': What the get_closest_* function for the kind would return for the match.
+    """
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+    lookups = {'kpi_formulas': get_formulas, 'class_instances': get_instances,
+               'object_properties': get_object_properties}
+    results = []
+    misses = {}  # Maps (kind, method) to {label: [positions of the items requesting it]}
+
+    # Serve exact matches and collect the labels that need a fuzzy fallback.
+    for position, item in enumerate(items):
+        label, kind = item['label'], item['kind']
+        method = item.get('method') or 'levenshtein'
+        results.append({'label': label, 'kind': kind, 'match': None, 'similarity': None, 'result': None})
+
+        if kind not in lookups:
+            print(kind, 'IS NOT A VALID KIND')
+            continue
+
+        result = lookups[kind](label, snapshot)
+        if result:
+            results[position].update(match=label, similarity=1, result=result)
+        else:
+            misses.setdefault((kind, method), {}).setdefault(label, []).append(position)
+
+    # Resolve every group of misses together.
+    for (kind, method), positions in misses.items():
+        queries = list(positions)
+        matches = _closest_labels(snapshot, kind, method, queries)
+
+        for query, match in zip(queries, matches):
+            max_label, max_val = match[0] if match else ('', -math.inf)
+            result = lookups[kind](max_label, snapshot)
+            for position in positions[query]:
+                results[position].update(match=max_label, similarity=max_val, result=result)
+
+    return results
+
+def evaluate_kpi(kpi, data, machines=None, operations=None, snapshot=None):
+    """
+    Computes the value of a KPI from its parsable formula, resolving the KPIs it references.
+
+    Evaluation is vectorized with NumPy: A° aggregations reduce whole axes and S° operators
+    apply element-wise, broadcasting the operands against each other.
+
+    Args:
+        kpi (str): The label of the KPI to compute.
+        data (dict): Maps the name of every D° data series the formulas use to a NumPy array of
+            shape (time, machine, operation).
+        machines (list, optional): Names of the machines along the machine axis, needed when a
+            formula selects a specific machine.
+        operations (list, optional): Names of the operations along the operation axis, needed when
+            a formula selects a specific operation (e.g. 'working' or 'idle').
+        snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
+
+    Returns:
+        tuple: A tuple containing:
+            - numpy.ndarray: The value of the KPI.
+            - str: The axes the value is still indexed by, in 'tmo' order ('' for a scalar).
+    """
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+    formula_ast = snapshot['formula_ast']
+    target = _lookup(snapshot, kpi)
+
+    if not target or len(target) > 1:
+        print("DOUBLE OR NONE REFERENCED KPI")
+        return
+
+    if kpi not in formula_ast:
+        print(kpi, "IS NOT A VALID KPI")
+        return
+
+    return kbf.evaluate(formula_ast[kpi], data, formula_ast.get, machines, operations)
+
+def evaluate_kpis(data, kpis=None, machines=None, operations=None, snapshot=None):
+    """
+    Computes many KPIs together, evaluating every subexpression they have in common only once.
+
+    KPIs are evaluated in topological order, so the value of a KPI referenced by others is
+    computed once and reused, as are identical aggregations of the same data series.
+
+    Args:
+        data (dict): Maps the name of every D° data series the formulas use to a NumPy array of
+            shape (time, machine, operation).
+        kpis (list, optional): Labels of the KPIs to compute (default is get_instances('kpi')).
+        machines (list, optional): Names of the machines along the machine axis.
+        operations (list, optional): Names of the operations along the operation axis.
+        snapshot (dict, optional): The version of the KB to read (default is the published SNAPSHOT).
+
+    Returns:
+        tuple: A tuple containing:
+            - dict: Maps every KPI label to its (value, axes) pair as returned by evaluate_kpi,
+              or to None if it could not be evaluated.
+            - dict: Statistics on the work saved by sharing subexpressions (see kb_formula.evaluate_many).
+    """
+    snapshot = SNAPSHOT if snapshot is None else snapshot
+    formula_ast = snapshot['formula_ast']
+    if kpis is None:
+        kpis = get_instances('kpi', snapshot)
+
+    # Evaluate the requested KPIs in topological order.
+    requested = set()
+    for kpi in kpis:
+        if kpi in formula_ast:
+            requested.add(kpi)
+        else:
+            print(kpi, "IS NOT A VALID KPI")
+    ordered = [kpi for kpi in snapshot['kpi_order'] if kpi in requested]
+    ordered += [kpi for kpi in kpis if kpi in requested and kpi not in ordered]
+
+    results, stats = kbf.evaluate_many({kpi: formula_ast[kpi] for kpi in ordered}, data,
+                                       formula_ast.get, machines, operations)
+
+    for kpi, result in results.items():
+        if isinstance(result, ValueError):
+            print('KPI', kpi, 'COULD NOT BE EVALUATED:', result)
+            results[kpi] = None
+
+    return results, stats
@@ -0,0 +1,194 @@
+"""
+Counters and histograms of the knowledge base and of its API, exposed in the Prometheus text format
+by the GET /metrics endpoint of main.py.
+
+Recording a value only updates a few numbers under a lock, so the instrumentation costs next to nothing
+when nobody scrapes the metrics: they are formatted by render() only when requested. Counters bumped on
+every label lookup use tally() instead, which counts in the calling thread without taking the lock.
+Every process keeps its own metrics (e.g. each uvicorn worker); the processes working for another one
+hand theirs over with export() and merge().
+"""
+import bisect  # Bucket of an observed value
+import math  # Infinite upper bound of the last bucket
+import threading  # Guards the metrics against concurrent updates
+
+# === BUCKETS ===
+# Upper bounds of the buckets of the histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)  # Counts of labels, KPIs, ...
+DEPTH_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 32)  # Levels of nested KPI references
+
+# === REGISTRY ===
+# Maps the name of every metric to its type and help text
+METRICS = {
+    'kb_http_requests_total': ('counter', 'HTTP requests answered, by method, route and status code.'),
+    'kb_http_request_duration_seconds': ('histogram', 'Time to answer an HTTP request, by method and route.'),
+    'kb_http_rejected_total': ('counter', 'Requests answered 503 because their endpoint was serving its limit, by route.'),
+    'kb_label_lookups_total': ('counter', 'Lookups of a label, in the read model or in the ontology label index.'),
+    'kb_fuzzy_searches_total': ('counter', 'Approximate label matches, by kind.'),
+    'kb_fuzzy_candidates': ('histogram', 'Candidate labels of an approximate label match, by kind.'),
+    'kb_fuzzy_verified': ('histogram', 'Candidate labels whose Levenshtein similarity was computed, by kind.'),
+    'kb_fuzzy_search_duration_seconds': ('histogram', 'Time of an approximate label match, by kind.'),
+    'kb_closest_cache_lookups_total': ('counter', 'Closest-label queries answered from the cache or not, by kind.'),
+    'kb_formula_unroll_depth': ('histogram', 'Levels of nested KPI references of an expanded formula.'),
+    'kb_journal_appends_total': ('counter', 'Appends to the mutation journal.'),
+    'kb_journal_bytes_total': ('counter', 'Bytes appended to the mutation journal.'),
+    'kb_backup_duration_seconds': ('histogram', 'Time to take a backup of the ontology and its read model.'),
+    'kb_backup_bytes_total': ('counter', 'Bytes of the backup and read model files written.'),
+    'kb_entities': ('gauge', 'Entities of the published snapshot, by kind.'),
+    'kb_generation': ('gauge', 'Generation of the published snapshot.'),
+}
+
+_LOCK = threading.Lock()
+_COUNTERS = {}  # Maps (name, labels) to the value of a counter
+_HISTOGRAMS = {}  # Maps (name, labels) to [buckets, counts per bucket (the last one being +Inf), sum]
+_LOCAL = threading.local()  # The 'tallies' of the current thread
+_TALLIES = []  # The tallies of every thread, each mapping (name, labels) to a count, summed by render()
+
+def inc(name, value=1, labels=()):
+    """
+    Increments a counter.
+
+    Parameters:
+    - name (str): The name of the counter, one of METRICS.
+    - value (int or float, optional): The increment (default is 1).
+    - labels (tuple, optional): (label name, label value) pairs identifying the series.
+    """
+    key = (name, labels)
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+def tally(name, value=1, labels=()):
+    """
+    Increments a counter in the tallies of the calling thread, without taking the lock shared by every
+    thread. Only that thread writes them; render() adds them to the counters of inc().
+
+    Parameters:
+    - name (str): The name of the counter, one of METRICS.
+    - value (int, optional): The increment (default is 1).
+    - labels (tuple, optional): (label name, label value) pairs identifying the series.
+    """
+    tallies = getattr(_LOCAL, 'tallies', None)
+    if tallies is None:
+        tallies = _LOCAL.tallies = {}
+        with _LOCK:
+            _TALLIES.append(tallies)
+    key = (name, labels)
+    tallies[key] = tallies.get(key, 0) + value
+
+def observe(name, value, buckets=LATENCY_BUCKETS, labels=()):
+    """
+    Records a value in a histogram.
+
+    Parameters:
+    - name (str): The name of the histogram, one of METRICS.
+    - value (int or float): The observed value.
+    - buckets (tuple, optional): The upper bounds of its buckets (default is LATENCY_BUCKETS).
+    - labels (tuple, optional): (label name, label value) pairs identifying the series.
+    """
+    key = (name, labels)
+    position = bisect.bisect_left(buckets, value)
+    with _LOCK:
+        histogram = _HISTOGRAMS.get(key)
+        if histogram is None:
+            histogram = _HISTOGRAMS[key] = [buckets, [0] * (len(buckets) + 1), 0]
+        histogram[1][position] += 1
+        histogram[2] += value
+
+def reset():
+    """
+    Forgets every recorded value.
+    """
+    with _LOCK:
+        _COUNTERS.clear()
+        _HISTOGRAMS.clear()
+        for tallies in _TALLIES:
+            tallies.clear()
+
+def export():
+    """
+    Returns every recorded value, for merge() to add them to the metrics of another process.
+
+    Returns:
+    - tuple: The counters, mapping (name, labels) to their value, and the histograms, mapping (name, labels)
+      to (buckets, counts per bucket, sum).
+    """
+    with _LOCK:
+        counters = dict(_COUNTERS)
+        tallies = [tallies.copy() for tallies in _TALLIES]  # A copy is atomic, even while its thread counts
+        histograms = {key: (buckets, list(counts), total) for key, (buckets, counts, total) in _HISTOGRAMS.items()}
+    for thread_tallies in tallies:
+        for key, value in thread_tallies.items():
+            counters[key] = counters.get(key, 0) + value
+    return counters, histograms
+
+def merge(values):
+    """
+    Adds the values exported by another process to the metrics of this one.
+
+    Parameters:
+    - values (tuple): What export() returned in the other process.
+    """
+    counters, histograms = values
+    with _LOCK:
+        for key, value in counters.items():
+            _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+        for key, (buckets, counts, total) in histograms.items():
+            histogram = _HISTOGRAMS.get(key)
+            if histogram is None:
+                histogram = _HISTOGRAMS[key] = [buckets, [0] * len(counts), 0]
+            for position, count in enumerate(counts):
+                histogram[1][position] += count
+            histogram[2] += total
+
+def _series(name, labels, extra=()):
+    """
+    Formats the name and labels of a series, e.g. name{method="GET",route="/"}.
+    """
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return name
+    values = ['%s="%s"' % (label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+              for label, value in pairs]
+    return name + '{' + ','.join(values) + '}'
+
+def _number(value):
+    """
+    Formats a value as the Prometheus text format expects it.
+    """
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(gauges=()):
+    """
+    Formats every metric in the Prometheus text format (version 0.0.4).
+
+    Parameters:
+    - gauges (iterable, optional): (name, labels, value) triples of the gauges, read when scraping.
+
+    Returns:
+    - str: The exposition, one # HELP and # TYPE header per metric followed by its series.
+    """
+    counters, histograms = export()
+
+    lines = {name: [] for name in METRICS}
+    for (name, labels), value in sorted(counters.items()):
+        lines[name].append(_series(name, labels) + ' ' + _number(value))
+    for (name, labels), (buckets, counts, total) in sorted(histograms.items(), key=lambda item: item[0]):
+        cumulative = 0
+        for bound, count in zip(buckets + (math.inf,), counts):
+            cumulative += count
+            lines[name].append(_series(name + '_bucket', labels, [('le', _number(bound))]) + ' ' + str(cumulative))
+        lines[name].append(_series(name + '_sum', labels) + ' ' + _number(total))
+        lines[name].append(_series(name + '_count', labels) + ' ' + str(cumulative))
+    for name, labels, value in gauges:
+        lines[name].append(_series(name, labels) + ' ' + _number(value))
+
+    output = []
+    for name, (kind, description) in METRICS.items():
+        if lines[name]:
+            output.append('# HELP ' + name + ' ' + description)
+            output.append('# TYPE ' + name + ' ' + kind)
+            output.extend(lines[name])
+    return '\n'.join(output) + '\n'
@@ -1,8 +1,22 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import weakref
 import kb_interface as kbi
+import kb_metrics as kbm
 
 app = FastAPI()
 # Enable CORS
@@ -16,7 +30,195 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def startup_event():
-    kbi.start()
+    # Every worker process serves the same backups: one of them becomes the writer
+    kbi.MATCH_PROCESSES = MATCH_PROCESSES
+    kbi.start_shared()
+    kbi.start_match_processes()
+
+@app.middleware("http")
+async def follow_writer(request, call_next):
+    # Catch up with the mutations applied by the writer process before answering. Loading the read model of
+    # a new backup takes a while: it runs in KB_EXECUTOR, once for every request arriving meanwhile, so that
+    # the event loop keeps serving the requests in progress and /health, which does not wait for it
+    if request.url.path != '/health' and kbi.needs_refresh():
+        if REFRESH['future'] is None or REFRESH['future'].done():
+            REFRESH['future'] = asyncio.ensure_future(in_executor(kbi.refresh))
+        await asyncio.shield(REFRESH['future'])
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_metrics(request, call_next):
+    # Count every request and time it, by the route it matched so that paths with ids share a series
+    begin = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get('route')
+        path = route.path if route is not None else 'unmatched'
+        kbm.inc('kb_http_requests_total', labels=(('method', request.method), ('route', path), ('status', str(status))))
+        kbm.observe('kb_http_request_duration_seconds', time.perf_counter() - begin,
+                    labels=(('method', request.method), ('route', path)))
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Finish the lookups in progress, then write the backups still pending before the process exits
+    KB_EXECUTOR.shutdown(wait=True)
+    kbi.shutdown()
+
+# Serialized responses of the GET read endpoints, valid for the KB revision of their ETag
+RESPONSE_CACHE = {'etag': None, 'responses': OrderedDict()}
+RESPONSE_CACHE_SIZE = 1024  # Responses kept, the least recently used being dropped first
+RESPONSE_LOCK = threading.Lock()
+STREAM_CHUNK_SIZE = 1 << 16  # Bytes of NDJSON lines gathered before a chunk of a streamed response is sent
+
+# Threads running the KB work of the async endpoints, so that a slow approximate match never blocks the
+# event loop (and /health) while it runs
+KB_EXECUTOR = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4), thread_name_prefix='kb')
+# Processes running the approximate matches of large label sets, which would otherwise hold the GIL in the
+# threads of KB_EXECUTOR and keep the event loop waiting for it (see kb_interface.MATCH_PROCESSES)
+MATCH_PROCESSES = os.cpu_count() or 1
+# Requests each endpoint serves at once: beyond that, requests are answered 503 at once instead of queuing
+ENDPOINT_LIMITS = {'/kpi-formulas': 16, '/class-instances': 16, '/object-properties': 16,
+                   '/batch-lookup': 4, '/get_all_formulas/': 4, '/add_kpis/': 2}
+IN_FLIGHT = dict.fromkeys(ENDPOINT_LIMITS, 0)  # Requests being served, by endpoint
+IN_FLIGHT_LOCK = threading.Lock()
+REFRESH = {'future': None}  # The kbi.refresh() running in KB_EXECUTOR, awaited by the requests arriving meanwhile
+
+@contextlib.contextmanager
+def endpoint_slot(route):
+    """
+    Reserves one of the ENDPOINT_LIMITS[route] requests an endpoint serves at once, for the duration of the
+    with block.
+
+    Raises:
+    - HTTPException: 503, with a Retry-After header, if the endpoint is already serving as many requests.
+    """
+    reserve_slot(route)
+    try:
+        yield
+    finally:
+        release_slot(route)
+
+def reserve_slot(route):
+    """
+    Reserves one of the ENDPOINT_LIMITS[route] requests an endpoint serves at once, to be given back with
+    release_slot.
+
+    Raises:
+    - HTTPException: 503, with a Retry-After header, if the endpoint is already serving as many requests.
+    """
+    with IN_FLIGHT_LOCK:
+        busy = IN_FLIGHT[route] >= ENDPOINT_LIMITS[route]
+        if not busy:
+            IN_FLIGHT[route] += 1
+    if busy:
+        kbm.inc('kb_http_rejected_total', labels=(('route', route),))
+        raise HTTPException(status_code=503, detail="Too many concurrent requests, retry later.",
+                            headers={'Retry-After': '1'})
+
+def release_slot(route):
+    """
+    Gives back a request reserved with reserve_slot.
+    """
+    with IN_FLIGHT_LOCK:
+        IN_FLIGHT[route] -= 1
+
+def stream_in_slot(route, chunks):
+    """
+    Wraps the chunks of a streamed response so that it holds one of the ENDPOINT_LIMITS[route] requests of
+    the endpoint until it is sent, or dropped by a client that went away, even before its first chunk.
+
+    Raises:
+    - HTTPException: 503, as endpoint_slot does, if the endpoint is already serving as many requests.
+    """
+    reserve_slot(route)
+
+    def stream():
+        try:
+            yield from chunks
+        finally:
+            release()
+
+    body = stream()
+    release = weakref.finalize(body, release_slot, route)  # Runs once, when called or when body is collected
+    return body
+
+async def in_executor(function, *args):
+    """
+    Runs function(*args) in KB_EXECUTOR, returning its result without blocking the event loop.
+    """
+    return await asyncio.get_running_loop().run_in_executor(KB_EXECUTOR, functools.partial(function, *args))
+
+async def iterate_in_executor(chunks):
+    """
+    Yields the chunks of a streamed response, each produced in KB_EXECUTOR like the work of the other endpoints.
+    """
+    end = object()
+    while True:
+        chunk = await in_executor(next, chunks, end)
+        if chunk is end:
+            return
+        yield chunk
+
+def snapshot_headers(request):
+    """
+    Takes the published KB snapshot for a GET read endpoint, with the ETag derived from its revision: the
+    epoch of the writer's start, the backup it started from and the mutations applied since, which every
+    worker process agrees on.
+
+    Parameters:
+    - request (Request): The request, whose If-None-Match header is checked.
+
+    Returns:
+    - tuple: The snapshot, the ETag and X-KB-Generation headers, and whether the If-None-Match header
+      names the current ETag.
+    """
+    snapshot = kbi.SNAPSHOT
+    etag = '"%d-%d-%d"' % snapshot['revision']
+    headers = {'ETag': etag, 'X-KB-Generation': str(snapshot['generation'])}
+    if_none_match = request.headers.get('if-none-match', '')
+    not_modified = etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    return snapshot, headers, not_modified
+
+def cached_response(request, compute):
+    """
+    Answers a GET read endpoint from the published KB snapshot, with an ETag derived from its revision.
+
+    Parameters:
+    - request (Request): The request, whose path and query parameters key the cache.
+    - compute (callable): Computes the response content from a snapshot (see kb_interface.SNAPSHOT).
+
+    Returns:
+    - Response: 304 if the If-None-Match header names the current ETag, otherwise the JSON content,
+      serialized once per (endpoint, query parameters, generation).
+    """
+    snapshot, headers, not_modified = snapshot_headers(request)
+    etag = headers['ETag']
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+    with RESPONSE_LOCK:
+        if RESPONSE_CACHE['etag'] != etag:
+            # The KB changed: every cached response is stale
+            RESPONSE_CACHE['etag'] = etag
+            RESPONSE_CACHE['responses'].clear()
+        body = RESPONSE_CACHE['responses'].get(key)
+        if body is not None:
+            RESPONSE_CACHE['responses'].move_to_end(key)
+
+    if body is None:
+        body = json.dumps(jsonable_encoder(compute(snapshot)), ensure_ascii=False, allow_nan=False,
+                          separators=(',', ':')).encode('utf-8')
+        with RESPONSE_LOCK:
+            if RESPONSE_CACHE['etag'] == etag:
+                RESPONSE_CACHE['responses'][key] = body
+                if len(RESPONSE_CACHE['responses']) > RESPONSE_CACHE_SIZE:
+                    RESPONSE_CACHE['responses'].popitem(last=False)
+    return Response(body, media_type='application/json', headers=headers)
 
 class KPIData(BaseModel):
     superclass: str
@@ -28,33 +230,97 @@ class KPIData(BaseModel):
     depends_on_machine: bool = False  # Default value set to False
     depends_on_operation: bool = False  # Default value set to False
 
+class LabelLookup(BaseModel):
+    label: str
+    kind: Literal["kpi_formulas", "class_instances", "object_properties"]
+    method: str = "levenshtein"
+
+class BatchLookup(BaseModel):
+    items: List[LabelLookup]
+
 @app.get("/")
 def root():
     return {"message": "knowledge base"}
 
 @app.get("/get_formulas/")
-def get_formulas(kpi_label: str = None):
+def get_formulas(request: Request, kpi_label: str = None):
     try:
-        result = kbi.get_formulas(kpi_label)
-
-        if kpi_label:
-            return result
-
-        return result
+        return cached_response(request, lambda snapshot: kbi.get_formulas(kpi_label, snapshot))
 
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
 
+def ndjson_chunks(lines):
+    """
+    Serializes the lines of an NDJSON response as they are produced, gathered in chunks of about STREAM_CHUNK_SIZE bytes.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        data = (json.dumps(line, ensure_ascii=False, allow_nan=False, separators=(',', ':')) + '\n').encode('utf-8')
+        chunk.append(data)
+        size += len(data)
+        if size >= STREAM_CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk)
+
 @app.get("/get_all_formulas/")
-def get_all_formulas():
+def get_all_formulas(
+    request: Request,
+    cursor: Optional[str] = Query(None, description="The next_cursor of the previous page"),
+    limit: Optional[int] = Query(None, ge=1, description="The maximum number of KPIs of the page"),
+    stream: bool = Query(False, description="Stream one NDJSON line per KPI")
+):
+    """
+    Endpoint to retrieve the expanded formulas of every KPI, optionally a page at a time.
+
+    Parameters:
+    - cursor (str, optional): Where the page starts: the next_cursor returned with the previous page.
+    - limit (int, optional): The maximum number of KPIs of the page (default is every remaining KPI).
+    - stream (bool, optional): Stream the page as NDJSON, also selected by an Accept: application/x-ndjson header.
+
+    Returns:
+    - JSON containing:
+      - formulas (list): The formulas of every KPI of the page, as /get_formulas/ returns them.
+      - next_cursor (str): The cursor of the next page, None after the last one (only when paginating).
+    - Or, when streaming, one {"kpi": label, "formulas": formulas} line per KPI, the cursor of the next
+      page being in the X-Next-Cursor header.
+    """
+    def page(snapshot):
+        ret = kbi.get_kpi_page(cursor, limit, snapshot)
+        if ret is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        return ret
+
+    def compute(snapshot):
+        # Every formula is read from the same version of the KB
+        labels, next_cursor = page(snapshot)
+        result = {"formulas": [kbi.get_formulas(lab, snapshot) for lab in labels]}
+        if cursor is not None or limit is not None:
+            result["next_cursor"] = next_cursor
+        return result
+
     try:
-        result = []
-        for lab in kbi.ONTO.search(label='kpi')[0].instances():
-            ret = kbi.get_formulas(lab.label[0][:])
-            result.append(ret)
-        
-        return {"formulas": result}
+        if not (stream or 'application/x-ndjson' in request.headers.get('accept', '')):
+            with endpoint_slot('/get_all_formulas/'):
+                return cached_response(request, compute)
+
+        snapshot, headers, not_modified = snapshot_headers(request)
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+        labels, next_cursor = page(snapshot)
+        if next_cursor is not None:
+            headers['X-Next-Cursor'] = next_cursor
+        # The formulas are expanded lazily in KB_EXECUTOR, while the response is sent: the slot is held until then
+        lines = ({"kpi": lab, "formulas": kbi.get_formulas(lab, snapshot)} for lab in labels)
+        return StreamingResponse(iterate_in_executor(stream_in_slot('/get_all_formulas/', ndjson_chunks(lines))),
+                                 media_type='application/x-ndjson', headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -69,6 +335,41 @@ def add_kpi(kpi: KPIData):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/add_kpis/")
+async def add_kpis(request: Request):
+    """
+    Endpoint to import many KPIs at once: they are all validated first, then either all added and
+    persisted together, or none of them.
+
+    Parameters:
+    - The request body: a JSON array of KPIData objects, or one KPIData object per line with the
+      application/x-ndjson content type.
+
+    Returns:
+    - JSON containing the number of KPIs added, or a 422 error listing the reasons why the batch was rejected.
+    """
+    body = await request.body()
+    try:
+        if 'ndjson' in request.headers.get('content-type', ''):
+            items = [json.loads(line) for line in body.decode('utf-8').splitlines() if line.strip()]
+        else:
+            items = json.loads(body)
+        if not isinstance(items, list):
+            raise ValueError('Expected a JSON array of KPIs')
+        kpis = [KPIData(**item).model_dump() for item in items]
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    with endpoint_slot('/add_kpis/'):
+        try:
+            # Validating and journaling the batch blocks: keep it off the event loop
+            errors = await run_in_threadpool(kbi.add_kpis, kpis)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    if errors:
+        raise HTTPException(status_code=422, detail={"errors": errors})
+    return {"message": str(len(kpis)) + " kpis added"}
+
 @app.get("/get_onto_path/")
 def get_onto_path():
     path = kbi.get_onto_path()
@@ -76,6 +377,7 @@ def get_onto_path():
 
 @app.get("/kpi-formulas")
 async def get_kpi_formulas(
+    request: Request,
     kpi: str = Query(..., description="The label of the KPI to retrieve formulas for"),
     method: Optional[str] = Query("levenshtein", description="The similarity method to use")
 ):
@@ -91,16 +393,24 @@ async def get_kpi_formulas(
       - formulas (dict): The formulas of the found KPI.
       - similarity (float): The similarity score.
     """
-    try:
-        formulas, similarity = kbi.get_closest_kpi_formulas(kpi, method)
+    def compute(snapshot):
+        formulas, similarity = kbi.get_closest_kpi_formulas(kpi, method, snapshot)
         if not formulas:
             raise HTTPException(status_code=404, detail="No matching KPI formulas found.")
         return {"formulas": formulas, "similarity": similarity}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+    with endpoint_slot('/kpi-formulas'):
+        try:
+            # The approximate match is CPU-bound: run it in KB_EXECUTOR
+            return await in_executor(cached_response, request, compute)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/class-instances")
 async def get_class_instances(
+    request: Request,
     owl_class_label: str = Query(..., description="The label of the OWL class or instance to search for"),
     method: Optional[str] = Query("levenshtein", description="The similarity method to use for comparison")
 ):
@@ -116,18 +426,26 @@ async def get_class_instances(
       - instances (list): Instances of the closest matching class or individual.
       - similarity (float): The similarity score of the closest match.
     """
-    try:
-        instances, similarity = kbi.get_closest_class_instances(owl_class_label, method)
+    def compute(snapshot):
+        instances, similarity = kbi.get_closest_class_instances(owl_class_label, method, snapshot)
         if not instances:
             raise HTTPException(status_code=404, detail="No matching class or individual instances found.")
         return {"instances": instances, "similarity": similarity}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+    with endpoint_slot('/class-instances'):
+        try:
+            # The approximate match is CPU-bound: run it in KB_EXECUTOR
+            return await in_executor(cached_response, request, compute)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/object-properties")
 async def get_object_properties(
+    request: Request,
     label: str = Query(..., description="The label of the ontology object to query."),
-    method: str = Query("levenshtein", description="The similarity method to use (e.g., 'levenshtein').")
+    method: str = Query("levenshtein", description="The similarity method to use ('levenshtein' or 'w2v').")
 ):
     """
     Endpoint to retrieve properties of an ontology object by label.
@@ -137,14 +455,56 @@ async def get_object_properties(
     Returns:
         dict: The properties and similarity of the closest match.
     """
-    try:
-        properties, similarity = kbi.get_closest_object_properties(label, method)
+    def compute(snapshot):
+        properties, similarity = kbi.get_closest_object_properties(label, method, snapshot)
         if not properties:
             raise HTTPException(status_code=404, detail="Object not found")
         return {"properties": properties, "similarity": similarity}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+    with endpoint_slot('/object-properties'):
+        try:
+            # The approximate match is CPU-bound: run it in KB_EXECUTOR
+            return await in_executor(cached_response, request, compute)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/batch-lookup")
+async def batch_lookup(batch: BatchLookup):
+    """
+    Endpoint to resolve many labels in one request, each like the lookup endpoint matching its kind
+    (/kpi-formulas, /class-instances or /object-properties).
+
+    Parameters:
+    - batch (BatchLookup): The labels to resolve, each with its kind and similarity method.
+
+    Returns:
+    - JSON containing:
+      - results (list): For each item, in order, the requested label and kind, the matched label,
+        its similarity and the formulas, instances or properties of the match.
+    """
+    with endpoint_slot('/batch-lookup'):
+        try:
+            # The approximate matches are CPU-bound: run them in KB_EXECUTOR
+            results = await in_executor(kbi.resolve_labels, [item.model_dump() for item in batch.items])
+            return {"results": results}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+def metrics():
+    """
+    Endpoint exposing the metrics of this process in the Prometheus text format: request counts and latencies
+    per route, and the internals of the KB (label lookups, approximate matches, formula expansions, journal
+    and backups, entities of the published snapshot).
+    """
+    snapshot = kbi.SNAPSHOT
+    gauges = [('kb_entities', (('kind', kind),), count) for kind, count in kbi.get_entity_counts(snapshot).items()]
+    gauges.append(('kb_generation', (), snapshot['generation']))
+    return PlainTextResponse(kbm.render(gauges), media_type='text/plain; version=0.0.4')
 
 @app.get("/health")
-def health_check():
+async def health_check():
+    # Answered by the event loop itself, without waiting for a thread of the pool (nor for the GIL they hold)
     return {"status":"ok"}
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 import requests
 
@@ -35,3 +37,96 @@ def test_post_kpi():
     response = requests.post(url, json=data)
 
     assert response.status_code == 200
+
+def test_batch_lookup():
+    url = f"{BASE_URL}/batch-lookup"
+
+    data = {"items": [
+        {"label": "consumption_sum", "kind": "kpi_formulas"},
+        {"label": "consumpton_sum", "kind": "kpi_formulas"},
+        {"label": "testing_machine", "kind": "class_instances"},
+        {"label": "depends_on", "kind": "object_properties"},
+    ]}
+
+    response = requests.post(url, json=data)
+    assert response.status_code == 200
+
+    results = response.json()["results"]
+    assert [r["match"] for r in results] == ["consumption_sum", "consumption_sum", "testing_machine", "depends_on"]
+    assert results[0]["similarity"] == 1 and results[1]["similarity"] < 1
+    assert results[1]["result"]["consumption_sum"] == 'A°sum°mo[ A°sum°t[ D°consumption_sum°t°m°o° ] ]'
+    assert sorted(results[2]["result"]) == ['testing_machine_1', 'testing_machine_2', 'testing_machine_3']
+
+def test_lookup_without_match():
+    # A lookup matching nothing answers 404, not an internal error
+    response = requests.get(f"{BASE_URL}/class-instances", params={"owl_class_label": "energy_efficiency_kpi"})
+    assert response.status_code == 404
+
+def test_conditional_get():
+    url = f"{BASE_URL}/kpi-formulas"
+    params = {"kpi": "consumption_sum"}
+
+    response = requests.get(url, params=params)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    # An unchanged KB answers with 304 and no body
+    response = requests.get(url, params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 304 and not response.content
+
+    # Adding a KPI bumps the revision, and with it the ETag
+    data = {"superclass": "downtime_kpi", "label": "etag_kpi", "description": "desc", "unit_of_measure": "s",
+            "parsable_computation_formula": "R°time_sum°T°m°o°"}
+    assert requests.post(f"{BASE_URL}/add_kpi/", json=data).status_code == 200
+    response = requests.get(url, params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+    assert response.json()["formulas"]["consumption_sum"] == 'A°sum°mo[ A°sum°t[ D°consumption_sum°t°m°o° ] ]'
+
+def test_add_kpis():
+    url = f"{BASE_URL}/add_kpis/"
+    kpis = [{"superclass": "downtime_kpi", "label": "import_top", "description": "desc", "unit_of_measure": "s",
+             "parsable_computation_formula": "S°+[ R°import_bottom°T°m°o° ; C°1° ]"},
+            {"superclass": "downtime_kpi", "label": "import_bottom", "description": "desc", "unit_of_measure": "s",
+             "parsable_computation_formula": "R°time_sum°T°m°o°"}]
+
+    # A rejected batch lists the invalid KPIs and adds none of them
+    response = requests.post(url, json=kpis + [dict(kpis[1], superclass="machine")])
+    assert response.status_code == 422
+    assert response.json()["detail"]["errors"] == ["KPI 2 (import_bottom): DUPLICATE LABEL IN THE BATCH"]
+
+    # The same KPIs as NDJSON
+    body = "\n".join(json.dumps(kpi) for kpi in kpis)
+    response = requests.post(url, data=body.encode("utf-8"), headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    response = requests.get(f"{BASE_URL}/get_formulas/", params={"kpi_label": "import_top"})
+    assert list(response.json()) == ["import_top", "import_bottom", "time_sum"]
+
+def test_get_all_formulas_pages():
+    url = f"{BASE_URL}/get_all_formulas/"
+    formulas = requests.get(url).json()["formulas"]
+
+    # Following the cursors gives every formula once, in order
+    pages = []
+    params = {"limit": 10}
+    while True:
+        page = requests.get(url, params=params).json()
+        pages.extend(page["formulas"])
+        if page["next_cursor"] is None:
+            break
+        params["cursor"] = page["next_cursor"]
+    assert pages == formulas
+
+    # Streaming gives one line per KPI
+    response = requests.get(url, params={"stream": "true"}, stream=True)
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.iter_lines() if line]
+    assert [line["formulas"] for line in lines] == formulas
+    assert requests.get(url, params={"cursor": "not_a_kpi"}).status_code == 400
+
+def test_metrics():
+    requests.get(f"{BASE_URL}/class-instances", params={"owl_class_label": "testing_machin"})
+    response = requests.get(f"{BASE_URL}/metrics")
+    assert response.status_code == 200 and response.headers["Content-Type"].startswith("text/plain")
+    assert 'kb_http_requests_total{method="GET",route="/class-instances",status="200"}' in response.text
+    assert 'kb_fuzzy_searches_total{kind="class_instances"}' in response.text
+    assert 'kb_entities{kind="kpi"}' in response.text
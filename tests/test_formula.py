@@ -0,0 +1,88 @@
+import os
+import re
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import kb_formula as kbf
+
+
+def test_parse_nested_formula():
+    ast = kbf.parse_formula('A°sum°mo[S°*[ S°/[ R°bad_cycles_sum°T°m°o° ; R°cycles_sum°T°m°o° ] ; C°100°]]')
+
+    assert ast == kbf.Aggregation('sum', 'mo', kbf.Operation('*', (
+        kbf.Operation('/', (kbf.KpiRef('bad_cycles_sum', 'T', 'm', 'o'), kbf.KpiRef('cycles_sum', 'T', 'm', 'o'))),
+        kbf.Constant(100.0))))
+    assert kbf.kpi_references(ast) == ['bad_cycles_sum', 'cycles_sum']
+
+
+def test_references_match_regex_on_ontology_formulas():
+    # Every formula shipped with the KB parses, and yields the references the old regex found
+    with open(os.path.join(os.path.dirname(__file__), '..', 'KB_original.owl'), encoding='utf-8') as owl:
+        formulas = re.findall(r'>([ASRDC]°[^<]*)<', owl.read())
+
+    assert formulas
+    for formula in formulas:
+        expected = re.findall(r'R°([A-Za-z_]+)°[A-Za-z_]*°[A-Za-z_]*°[A-Za-z_]*°', formula)
+        assert kbf.kpi_references(kbf.parse_formula(formula)) == expected
+
+
+@pytest.mark.parametrize('formula', ['form', 'A°sum°x[ C°1° ]', 'S°+[ C°1° ; C°2° ', 'S°%[ C°1° ]', 'C°1° C°2°'])
+def test_invalid_formulas_raise(formula):
+    with pytest.raises(kbf.FormulaSyntaxError):
+        kbf.parse_formula(formula)
+
+
+def test_evaluate_references_and_selections():
+    rng = np.random.default_rng(0)
+    data = {'time_sum': rng.random((10, 3, 2)), 'cycles_sum': rng.random((10, 3, 2))}
+    kpis = {
+        'time_sum': kbf.parse_formula('A°sum°mo[ A°sum°t[ D°time_sum°t°m°o° ] ]'),
+        'cycles_sum': kbf.parse_formula('A°sum°mo[ A°sum°t[ D°cycles_sum°t°m°o° ] ]'),
+    }
+
+    # Per machine-operation ratio of two referenced KPIs, then averaged
+    ratio = kbf.parse_formula('A°mean°mo[ S°/[ R°cycles_sum°T°m°o° ; R°time_sum°T°m°o° ] ]')
+    value, axes = kbf.evaluate(ratio, data, kpis.get)
+    assert axes == ''
+    assert np.isclose(value, (data['cycles_sum'].sum(0) / data['time_sum'].sum(0)).mean())
+
+    # Operation selected by name, machine axis left in the result
+    share = kbf.parse_formula('S°*[ S°/[ R°time_sum°T°m°working° ; R°time_sum°T°M°idle° ] ; C°100° ]')
+    value, axes = kbf.evaluate(share, data, kpis.get, operations=['working', 'idle'])
+    assert axes == 'm'
+    assert np.allclose(value, data['time_sum'][:, :, 0].sum(0) / data['time_sum'][:, :, 1].sum() * 100)
+
+
+def test_evaluate_reports_missing_inputs():
+    with pytest.raises(ValueError):
+        kbf.evaluate(kbf.parse_formula('A°sum°t[ D°power°t°m°o° ]'), {}, {}.get)
+    with pytest.raises(ValueError):
+        kbf.evaluate(kbf.parse_formula('R°missing°T°m°o°'), {}, {}.get)
+
+
+def test_evaluate_reports_reference_cycles():
+    kpis = {'a': kbf.parse_formula('S°+[ R°b°T°m°o° ; C°1° ]'), 'b': kbf.parse_formula('A°sum°t[ R°a°t°M°O° ]')}
+    with pytest.raises(kbf.ReferenceCycleError) as error:
+        kbf.evaluate(kpis['a'], {}, kpis.get)
+    assert error.value.cycle == ['b', 'a', 'b']
+
+    # The other formulas of a batch are still evaluated
+    nodes = dict(kpis, c=kbf.parse_formula('C°2°'))
+    results, stats = kbf.evaluate_many(nodes, {}, kpis.get)
+    assert isinstance(results['a'], kbf.ReferenceCycleError) and isinstance(results['b'], kbf.ReferenceCycleError)
+    assert results['c'][0] == 2 and stats['naive_evaluations'] > 0
+
+
+def test_evaluate_many_shares_subexpressions():
+    data = {'time_sum': np.arange(24.0).reshape(4, 3, 2)}
+    kpis = {'time_sum': kbf.parse_formula('A°sum°mo[ A°sum°t[ D°time_sum°t°m°o° ] ]')}
+    nodes = dict(kpis, time_share=kbf.parse_formula('A°sum°mo[ S°/[ R°time_sum°T°m°o° ; R°time_sum°T°M°O° ] ]'))
+
+    results, stats = kbf.evaluate_many(nodes, data, kpis.get)
+
+    for label, node in nodes.items():
+        assert np.isclose(results[label][0], kbf.evaluate(node, data, kpis.get)[0])
+    assert stats['reused'] > 0 and stats['evaluations'] < stats['naive_evaluations']
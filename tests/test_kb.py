@@ -156,7 +156,7 @@ if 'add_kpi' in to_test:
 
     print('Testing add_kpi and backups')
     for i in range(200):
-        kbi.add_kpi(*['downtime_kpi', str(i), 'desc','unit', 'form'])
+        kbi.add_kpi(*['downtime_kpi', str(i), 'desc','unit', 'C°0°'])
 
     time.sleep(2)
             
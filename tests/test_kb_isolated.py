@@ -0,0 +1,615 @@
+"""
+Tests of kb_interface. Every test starts the KB on its own copy of the initial backup in a temporary
+folder, so that it neither depends on the state other tests leave behind nor writes to the backups
+folder of the repository.
+"""
+import gzip
+import json
+import os
+import pathlib
+import pickle
+import random
+import shutil
+import string
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+import kb_interface as kbi  # noqa: E402
+
+
+def misspell(label, n):
+    """
+    Returns label with n random characters inserted, replaced or removed.
+    """
+    chars = list(label)
+    for _ in range(n):
+        operation = random.choice(['insert', 'replace', 'remove'])
+        if operation == 'insert':
+            chars.insert(random.randint(0, len(chars)), random.choice(string.ascii_letters + string.digits))
+        elif chars:
+            position = random.randint(0, len(chars) - 1)
+            if operation == 'replace':
+                chars[position] = random.choice(string.ascii_letters + string.digits)
+            else:
+                del chars[position]
+    return ''.join(chars)
+
+
+@pytest.fixture
+def kb_backups(tmp_path, monkeypatch):
+    # Redirect backups and configuration to a temporary copy of the initial backup
+    shutil.copy(ROOT / 'backups' / '0.owl', tmp_path / '0.owl')
+    (tmp_path / 'config.cfg').write_text('1')
+    monkeypatch.setattr(kbi, 'MAIN_DIR', tmp_path)
+    monkeypatch.setattr(kbi, 'CONFIG_PATH', tmp_path / 'config.cfg')
+    monkeypatch.setattr(kbi, 'SAVE_INT', 1)
+    monkeypatch.setitem(kbi._PERSIST_STATE, 'journaled', 0)
+    monkeypatch.setitem(kbi._PERSIST_STATE, 'journal_started', None)
+    yield tmp_path
+    kbi.shutdown()  # Journal what is pending and stop the worker before the folder is removed
+
+
+@pytest.fixture
+def kb(kb_backups):
+    # The KB started on the temporary copy
+    kbi.start(1)
+    return kb_backups
+
+
+def test_label_index_matches_search(kb):
+    # Every indexed label, and the label of a KPI added later, resolves like ONTO.search
+    for label, entities in kbi.LABEL_INDEX.items():
+        assert entities == kbi.ONTO.search(label=label)
+    kbi.add_kpi('downtime_kpi', '199', 'desc', 'unit', 'C°0°')
+    assert kbi.LABEL_INDEX['199'] == kbi.ONTO.search(label='199')
+    assert kbi.get_instances('199') == ['199']
+    assert 'riveting_machine' in kbi.DUPLICATE_LABELS
+
+
+def test_closest_labels_match_linear_scan(kb):
+    # The fuzzy index returns the same ranking as comparing against every candidate
+    random.seed(3)
+    index = pickle.dumps(kbi.SNAPSHOT['fuzzy_index'])
+    for kind in kbi.FUZZY_KINDS:
+        candidates = kbi.SNAPSHOT['fuzzy_labels'][kind]
+        for lab in random.sample(candidates, 20):
+            query = misspell(lab, 3)
+            scan = sorted(((kbi._get_similarity(query, c, 'levenshtein'), -i, c) for i, c in enumerate(candidates)),
+                          reverse=True)
+            expected = [(c, s) for s, _, c in scan if s >= 0.4][:3]
+            assert kbi.get_closest_labels(query, kind, top_k=3, threshold=0.4) == expected
+    # Searching does not modify the published index, which backups save without holding KB_LOCK
+    assert pickle.dumps(kbi.SNAPSHOT['fuzzy_index']) == index
+
+
+def test_w2v_closest_labels_match_pairwise_similarity(kb):
+    # The vector matrix ranks the labels like comparing the query with every candidate
+    random.seed(5)
+    for kind in kbi.FUZZY_KINDS:
+        candidates = kbi.SNAPSHOT['fuzzy_labels'][kind]
+        for lab in random.sample(candidates, 20):
+            query = misspell(lab, 2)
+            similarities = [kbi._get_similarity(query, c, 'w2v') for c in candidates]
+            matches = kbi.get_closest_labels(query, kind, 'w2v', top_k=3)
+            assert [s for _, s in matches] == pytest.approx(sorted(similarities, reverse=True)[:3], abs=1e-5)
+            for c, s in matches:
+                assert s == pytest.approx(similarities[candidates.index(c)], abs=1e-5)
+        assert kbi.get_closest_labels(candidates[0], kind, 'w2v')[0] == (candidates[0], pytest.approx(1.0))
+
+
+def test_add_kpi_rejects_invalid_formula(kb):
+    kbi.add_kpi('downtime_kpi', 'broken_formula_kpi', 'desc', 'unit', 'A°sum°mo[ R°time_sum°T°m°o°')
+    assert not kbi._search('broken_formula_kpi')
+    assert kbi.get_object_properties('power_mean')['depends_on_other_kpi'] == ['consumption_sum', 'time_sum']
+
+
+def test_dependency_graph_tracks_added_kpis(kb):
+    order = kbi.SNAPSHOT['kpi_order']
+    assert order.index('consumption_sum') < order.index('total_consumption') \
+        < order.index('total_carbon_footprint') < order.index('carbon_footprint_per_cycle')
+
+    # A reference to a KPI that does not exist yet leaves the formula unresolvable
+    kbi.add_kpi('downtime_kpi', 'dag_top', 'desc', 'unit', 'S°+[ R°dag_bottom°T°m°o° ; R°time_sum°T°m°o° ]')
+    assert kbi.get_formulas('dag_top') is None
+
+    # Closing a cycle through it is rejected
+    kbi.add_kpi('downtime_kpi', 'dag_bottom', 'desc', 'unit', 'R°dag_top°T°m°o°')
+    assert not kbi._search('dag_bottom')
+
+    # Adding the missing KPI makes the dependent formula resolvable
+    kbi.add_kpi('downtime_kpi', 'dag_bottom', 'desc', 'unit', 'A°sum°mo[ R°cost_sum°T°m°o° ]')
+    assert list(kbi.get_formulas('dag_top')) == ['dag_top', 'dag_bottom', 'time_sum', 'cost_sum']
+    order = kbi.SNAPSHOT['kpi_order']
+    assert order.index('dag_bottom') < order.index('dag_top')
+
+
+def test_closest_label_cache_invalidated_by_add_kpi(kb):
+    query = 'energy_consumption_totl'
+    before = kbi.get_closest_cache_info()
+    first = kbi.get_closest_labels(query, 'kpi_formulas')
+    assert kbi.get_closest_labels(query, 'kpi_formulas') == first
+    info = kbi.get_closest_cache_info()
+    assert (info['hits'] - before['hits'], info['misses'] - before['misses']) == (1, 1)
+
+    # Adding a closer KPI replaces the labels the entries were matched against
+    kbi.add_kpi('energy_kpi', 'energy_consumption_total', 'desc', 'kWh', 'A°sum°mo[ R°consumption_sum°T°m°o° ]')
+    assert kbi.get_closest_labels(query, 'kpi_formulas') == [('energy_consumption_total', 1 - 1 / 24)]
+    assert kbi.get_closest_cache_info()['misses'] - before['misses'] == 2
+
+    # A batch shares the cache with single lookups
+    [result] = kbi.resolve_labels([{'label': query, 'kind': 'kpi_formulas'}])
+    assert result['match'] == 'energy_consumption_total'
+    assert kbi.get_closest_cache_info()['hits'] - before['hits'] == 2
+
+
+def test_matching_processes_match_like_the_calling_thread(kb, monkeypatch):
+    import kb_metrics as kbm
+    random.seed(7)
+    queries = {kind: [misspell(lab, 3) for lab in random.sample(kbi.SNAPSHOT['fuzzy_labels'][kind], 10)]
+               for kind in kbi.FUZZY_KINDS}
+    expected = {(kind, method): kbi._match_labels(kbi.SNAPSHOT, kind, method, queries[kind], 3, 0)
+                for kind in kbi.FUZZY_KINDS for method in ('levenshtein', 'w2v')}
+
+    monkeypatch.setattr(kbi, 'MATCH_PROCESSES', 1)
+    monkeypatch.setattr(kbi, 'MATCH_PROCESS_MIN_LABELS', 0)
+    assert all(future.result() for future in kbi.start_match_processes())
+    kbm.reset()
+    for (kind, method), matches in expected.items():
+        assert kbi._match_in_pool(kbi.SNAPSHOT, kind, method, queries[kind], 3, 0) == matches
+    # The process hands its metrics over
+    assert 'kb_fuzzy_searches_total{kind="kpi_formulas"} 20\n' in kbm.render()
+
+    # The process replays the journal up to the revision it is asked for, then matches the new KPI
+    kbi.add_kpi('energy_kpi', 'energy_consumption_total', 'desc', 'kWh', 'A°sum°mo[ R°consumption_sum°T°m°o° ]')
+    assert kbi.get_closest_labels('energy_consumption_totl', 'kpi_formulas') == [('energy_consumption_total', 1 - 1 / 24)]
+
+    # A revision it cannot reach is matched in the calling thread
+    epoch, number, mutations = kbi.SNAPSHOT['revision']
+    ahead = dict(kbi.SNAPSHOT, revision=(epoch, number, mutations + 1))
+    assert kbi._match_in_pool(ahead, 'kpi_formulas', 'levenshtein', ['energy_consumption_totl'], 1, 0) is None
+    assert kbi.get_closest_labels('energy_consumption_tot', 'kpi_formulas', snapshot=ahead)[0][0] == 'energy_consumption_total'
+
+
+def test_kpi_pages_cover_every_kpi(kb):
+    pages = []
+    cursor = None
+    while True:
+        labels, cursor = kbi.get_kpi_page(cursor, 7)
+        pages.append(labels)
+        if cursor is None:
+            break
+    assert all(len(labels) == 7 for labels in pages[:-1]) and 0 < len(pages[-1]) <= 7
+    assert sum(pages, []) == kbi.get_instances('kpi') == kbi.get_kpi_page()[0]
+    assert kbi.get_kpi_page('not_a_kpi') is None
+
+
+def test_kpi_page_cursors_follow_add_kpi(kb):
+    before = kbi.SNAPSHOT
+    assert kbi.get_kpi_page(kbi.get_instances('kpi')[-1], 5) == ([], None)
+    kbi.add_kpi('downtime_kpi', 'paged_kpi', 'desc', 'unit', 'C°1°')
+    kpis = kbi.get_instances('kpi')
+    assert kbi.get_kpi_page(kpis[-2], 5) == (['paged_kpi'], None)
+    assert kbi.get_kpi_page(kpis[-2], 5, before) == ([], None)
+    # A cursor is only valid in the versions that contain it
+    assert kbi.get_kpi_page('paged_kpi', 5, before) is None
+    assert kbi.get_kpi_page('paged_kpi', 5) == ([], None)
+
+
+def test_metrics_record_kb_internals(kb):
+    import kb_metrics as kbm
+    kbm.reset()
+    snapshot = dict(kbi.SNAPSHOT, kpi_closure={})
+    assert kbi.get_formulas('total_carbon_footprint', snapshot)
+    kbi.get_closest_labels('consumpton_sum', 'kpi_formulas', snapshot=snapshot)
+
+    text = kbm.render([('kb_generation', (), 7)])
+    assert 'kb_formula_unroll_depth_bucket{le="2"} 1\n' in text
+    assert 'kb_fuzzy_searches_total{kind="kpi_formulas"} 1\n' in text
+    assert 'kb_fuzzy_candidates_count{kind="kpi_formulas"} 1\n' in text
+    assert 'kb_label_lookups_total{index="read_model"} 4\n' in text
+    assert '# TYPE kb_generation gauge\nkb_generation 7\n' in text
+    assert 'kb_backup_duration_seconds' not in text
+
+
+def test_metrics_sum_the_tallies_of_every_thread():
+    import kb_metrics as kbm
+    kbm.reset()
+    threads = [threading.Thread(target=lambda: [kbm.tally('kb_label_lookups_total', labels=(('index', 'ontology'),))
+                                                for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    kbm.inc('kb_label_lookups_total', 5, labels=(('index', 'ontology'),))
+
+    assert 'kb_label_lookups_total{index="ontology"} 4005\n' in kbm.render()
+    kbm.reset()
+    assert 'kb_label_lookups_total' not in kbm.render()
+
+
+def test_evaluate_kpi_matches_numpy(kb):
+    rng = np.random.default_rng(1)
+    data = {'time_sum': rng.random((24, 5, 3))}
+    value, axes = kbi.evaluate_kpi('availability', data, operations=['working', 'idle', 'offline'])
+
+    time_sum = data['time_sum'].sum(0)
+    assert axes == ''
+    assert np.isclose(value, time_sum[:, 0].sum() / (time_sum[:, 1].sum() + time_sum[:, 2].sum()) * 100)
+
+
+def test_evaluate_kpis_matches_single_evaluations(kb):
+    rng = np.random.default_rng(2)
+    data = {name: rng.random((12, 4, 3)) for name in ['time_sum', 'cycles_sum', 'good_cycles_sum', 'bad_cycles_sum']}
+    kpis = ['time_sum', 'cycles_sum', 'good_cycles_sum', 'bad_cycles_sum', 'success_rate', 'failure_rate',
+            'availability', 'utilization_rate', 'non_operative_time']
+    operations = ['working', 'idle', 'offline']
+
+    results, stats = kbi.evaluate_kpis(data, kpis, operations=operations)
+
+    for kpi in kpis:
+        value, axes = kbi.evaluate_kpi(kpi, data, operations=operations)
+        assert results[kpi][1] == axes and np.allclose(results[kpi][0], value)
+    assert stats['saved_fraction'] > 0
+
+
+def test_concurrent_add_kpi_group_commit(kb, monkeypatch):
+    monkeypatch.setattr(kbi, 'DURABILITY', 'enqueue')
+    monkeypatch.setattr(kbi, 'SNAPSHOT_EVERY', 1)
+    import kb_metrics as kbm
+    kbm.reset()
+    save_int = kbi.SAVE_INT
+    labels = ['group_commit_' + str(i) for i in range(20)]
+    # The burst is made while holding KB_LOCK, which the worker waits for, so it all goes into one append
+    with kbi.KB_LOCK:
+        for lab in labels:
+            kbi.add_kpi('downtime_kpi', lab, 'desc', 'unit', 'C°1°')
+        time.sleep(0.05)  # Let the worker wake up and wait for the lock
+    kbi.flush()
+
+    # Every KPI is saved, by a single append and a single backup
+    assert all(kbi.get_instances(lab) == [lab] for lab in labels)
+    assert 'kb_journal_appends_total 1\n' in kbm.render()
+    assert kbi.SAVE_INT == save_int + 1
+    with open(kb / 'config.cfg') as cfg:
+        assert int(cfg.read()) == kbi.SAVE_INT
+    with gzip.open(kb / (str(kbi.SAVE_INT - 1) + '.owl.gz'), 'rt', encoding='utf-8') as owl:
+        saved = owl.read()
+    assert all(lab in saved for lab in labels)
+
+
+def test_failed_journal_append_is_retried(kb_backups, monkeypatch):
+    monkeypatch.setattr(kbi, 'RETRY_DELAY', 0.01)
+    kbi.start(1)
+    append_journal = kbi._append_journal
+    calls = []
+
+    def append_once_failing(records):
+        calls.append(records)
+        if len(calls) == 1:
+            raise OSError('disk full')
+        append_journal(records)
+
+    monkeypatch.setattr(kbi, '_append_journal', append_once_failing)
+    with pytest.raises(RuntimeError):
+        kbi.add_kpi('downtime_kpi', 'retried_kpi', 'desc', 'unit', 'C°1°')
+
+    # The worker writes the failed record again, ahead of the mutations made since
+    kbi.add_kpi('downtime_kpi', 'after_retry_kpi', 'desc', 'unit', 'C°1°')
+    kbi.flush()
+    journal = (kb_backups / (str(kbi.SAVE_INT - 1) + '.journal')).read_text(encoding='utf-8')
+    assert journal.index('retried_kpi') < journal.index('after_retry_kpi')
+    kbi.start(0)
+    assert kbi.get_instances('retried_kpi') == ['retried_kpi']
+
+
+def test_readers_see_whole_snapshots(kb, monkeypatch):
+    monkeypatch.setattr(kbi, 'DURABILITY', 'enqueue')
+    before = kbi.SNAPSHOT
+    kpis = kbi.get_instances('kpi', before)
+    labels = ['snapshot_' + str(i) for i in range(20)]
+    writer = threading.Thread(target=lambda: [kbi.add_kpi('downtime_kpi', lab, 'desc', 'unit',
+                                                          'S°+[ R°time_sum°T°m°o° ; C°1° ]') for lab in labels])
+    errors = []
+
+    def read():
+        while writer.is_alive():
+            # Every KPI a version lists is complete in that version
+            snapshot = kbi.SNAPSHOT
+            for lab in kbi.get_instances('kpi', snapshot)[len(kpis):]:
+                if (kbi.get_formulas(lab, snapshot) is None or lab not in snapshot['kpi_order']
+                        or lab not in snapshot['fuzzy_index']['kpi_formulas']['positions']):
+                    errors.append((snapshot['generation'], lab))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    writer.start()
+    for thread in readers:
+        thread.start()
+    writer.join()
+    for thread in readers:
+        thread.join()
+    kbi.flush()
+
+    assert not errors
+    assert kbi.SNAPSHOT['generation'] == before['generation'] + len(labels)
+    assert kbi.get_instances('kpi')[len(kpis):] == labels
+    # The version readers held before the mutations never changed
+    assert kbi.get_instances('kpi', before) == kpis
+    assert kbi.get_closest_labels('snapshot_1', 'kpi_formulas', snapshot=before)[0][0] != 'snapshot_1'
+
+
+def test_property_views_follow_add_kpi(kb):
+    kbi.add_kpi('downtime_kpi', 'viewed_kpi', 'desc', 'unit', 'S°+[ R°time_sum°T°m°o° ; C°1° ]')
+    assert kbi.get_object_properties('viewed_kpi')['depends_on_other_kpi'] == ['time_sum']
+    assert 'viewed_kpi' in kbi.get_object_properties('downtime_kpi')['instances']
+    assert 'viewed_kpi' in kbi.get_object_properties('kpi')['instances']
+
+    # Every materialized view is what computing it on request gives
+    snapshot = kbi.SNAPSHOT
+    entities = snapshot['read_model']['entities']
+    assert all(view == kbi._property_view(snapshot, entities[iri]) for iri, view in snapshot['property_views'].items())
+
+    # Callers get copies of the views
+    kbi.get_object_properties('kpi')['instances'].append('not_a_kpi')
+    assert 'not_a_kpi' not in kbi.get_object_properties('kpi')['instances']
+
+
+def test_hierarchy_index_matches_ontology(kb):
+    classes = list(kbi.ONTO.classes())
+    for sub in classes:
+        for sup in classes:
+            assert kbi._is_subclass(kbi.SNAPSHOT, sub.iri, sup.iri) == issubclass(sub, sup)
+    assert not kbi._is_subclass(kbi.SNAPSHOT, kbi._search('kpi')[0].iri, kbi._search('downtime_kpi')[0].iri)
+
+    # add_kpi refuses individuals as superclasses, and its KPIs are listed by every ancestor class
+    kbi.add_kpi('time_sum', 'not_under_a_class', 'desc', 'unit', 'C°1°')
+    assert not kbi._search('not_under_a_class')
+    kbi.add_kpi('downtime_kpi', 'indexed_kpi', 'desc', 'unit', 'C°1°')
+    for cls in classes:
+        expected = [i.label.en.first() for i in cls.instances()]
+        assert sorted(kbi.SNAPSHOT['hierarchy']['instances'][cls.iri]) == sorted(dict.fromkeys(expected))
+    assert kbi.get_instances('kpi') == kbi.SNAPSHOT['hierarchy']['instances'][kbi._search('kpi')[0].iri]
+
+
+def test_journal_replayed_on_start(kb_backups, monkeypatch):
+    monkeypatch.setattr(kbi, 'SNAPSHOT_EVERY', 3)
+    kbi.start(1)
+    labels = ['journaled_' + str(i) for i in range(5)]
+    for lab in labels:
+        kbi.add_kpi('downtime_kpi', lab, 'desc', 'unit', 'C°1°')
+
+    # One backup after three mutations, the other two are only in its journal
+    assert kbi.SAVE_INT == 2
+    assert sorted(path.name for path in kb_backups.iterdir()) == ['0.model', '0.owl', '1.journal', '1.manifest',
+                                                                   '1.model', '1.owl.gz', 'config.cfg', 'epoch']
+    kbi.flush()
+    revision = kbi.SNAPSHOT['revision']
+    with open(kb_backups / '1.journal', 'ab') as journal:
+        journal.write(b'{"mutation": "add_k')  # A record cut short by a crash
+
+    kbi.start(0)
+    assert all(kbi.get_instances(lab) == [lab] for lab in labels)
+    # The process that took the backup and the one loading it name the same content alike, in their epochs
+    assert kbi.SNAPSHOT['revision'][1:] == revision[1:] == (1, 2)
+    assert kbi.SNAPSHOT['revision'][0] > revision[0]
+    assert (kb_backups / '1.journal').read_text(encoding='utf-8').count('\n') == 2
+
+    # Restoring the first backup does not replay mutations that a later backup contains
+    kbi.start(1)
+    assert not kbi._search(labels[0])
+    kbi.start(2)
+    assert all(kbi.get_instances(lab) == [lab] for lab in labels)
+
+
+def test_backups_are_compressed_with_a_manifest(kb_backups, monkeypatch):
+    monkeypatch.setattr(kbi, 'SNAPSHOT_EVERY', 1)
+    kbi.start(1)
+    kbi.add_kpi('downtime_kpi', 'manifest_kpi', 'desc', 'unit', 'C°1°')
+    kbi.flush()
+
+    backups = kbi.list_backups()
+    assert [backup['number'] for backup in backups] == list(range(kbi.SAVE_INT))
+    assert backups[0] == {'number': 0, 'file': '0.owl'}
+    latest = backups[-1]
+    path = kb_backups / latest['file']
+    assert latest['file'] == str(kbi.SAVE_INT - 1) + '.owl.gz'
+    assert latest['bytes'] == path.stat().st_size < (kb_backups / '0.owl').stat().st_size
+    assert latest['entities'] == kbi.get_entity_counts()
+    assert not list(kb_backups.glob('*.tmp'))
+
+    # A backup is restored by its number, and one that does not match its manifest is refused
+    kbi.start(latest['number'] + 1)
+    assert kbi.get_instances('manifest_kpi') == ['manifest_kpi']
+    with open(path, 'ab') as owl:
+        owl.write(b'\0')
+    with pytest.raises(RuntimeError):
+        kbi.start(latest['number'] + 1)
+
+
+def test_add_kpis_imports_a_batch_at_once(kb_backups):
+    kbi.start(1)
+
+    # Nothing is added if one KPI of the batch is invalid
+    errors = kbi.add_kpis([
+        {'superclass': 'downtime_kpi', 'label': 'batch_top', 'description': 'desc', 'unit_of_measure': 'unit',
+         'parsable_computation_formula': 'S°+[ R°batch_bottom°T°m°o° ; R°time_sum°T°m°o° ]'},
+        {'superclass': 'downtime_kpi', 'label': 'batch_bottom', 'description': 'desc', 'unit_of_measure': 'unit',
+         'parsable_computation_formula': 'R°batch_top°T°m°o°'},
+        {'superclass': 'time_sum', 'label': 'batch_other', 'description': 'desc', 'unit_of_measure': 'unit',
+         'parsable_computation_formula': 'C°1°'},
+        {'superclass': 'downtime_kpi', 'label': 'batch_other', 'description': 'desc', 'unit_of_measure': 'unit',
+         'parsable_computation_formula': 'C°1°'},
+    ])
+    assert errors == ['KPI 2 (batch_other): NOT A VALID SUPERCLASS',
+                      'KPI 3 (batch_other): DUPLICATE LABEL IN THE BATCH',
+                      'KPI 0 (batch_top): WOULD CREATE A CYCLIC REFERENCE',
+                      'KPI 1 (batch_bottom): WOULD CREATE A CYCLIC REFERENCE']
+    assert not kbi._search('batch_top') and not kbi._search('batch_other')
+
+    # Formulas may reference KPIs that come later in the batch
+    generation = kbi.SNAPSHOT['generation']
+    assert kbi.add_kpis([
+        {'superclass': 'downtime_kpi', 'label': 'batch_top', 'description': 'desc', 'unit_of_measure': 'unit',
+         'parsable_computation_formula': 'S°+[ R°batch_bottom°T°m°o° ; R°time_sum°T°m°o° ]'},
+        {'superclass': 'cost_kpi', 'label': 'batch_bottom', 'description': 'desc', 'unit_of_measure': 'unit',
+         'parsable_computation_formula': 'A°sum°mo[ R°cost_sum°T°m°o° ]', 'depends_on_machine': True},
+    ]) == []
+    assert kbi.SNAPSHOT['generation'] == generation + 1
+    assert list(kbi.get_formulas('batch_top')) == ['batch_top', 'batch_bottom', 'time_sum', 'cost_sum']
+    assert 'batch_bottom' in kbi.get_object_properties('cost_kpi')['instances']
+    order = kbi.SNAPSHOT['kpi_order']
+    assert order.index('batch_bottom') < order.index('batch_top')
+
+    # The batch is journaled as one mutation, replayed with or without the ontology
+    assert (kb_backups / '0.journal').read_text(encoding='utf-8').count('\n') == 1
+    for read_only in (False, True):
+        kbi.start(0, read_only=read_only)
+        assert list(kbi.get_formulas('batch_top')) == ['batch_top', 'batch_bottom', 'time_sum', 'cost_sum']
+        assert 'batch_bottom' in kbi.get_instances('kpi')
+
+
+def test_sqlite_backend(kb_backups, monkeypatch):
+    monkeypatch.setattr(kbi, 'BACKEND', 'sqlite')
+    monkeypatch.setattr(kbi, 'SNAPSHOT_EVERY', 2)
+    kbi.start(1)
+    labels = ['stored_' + str(i) for i in range(3)]
+    for lab in labels:
+        kbi.add_kpi('downtime_kpi', lab, 'desc', 'unit', 'C°1°')
+
+    # The RDF/XML backup is imported once, later backups are quadstores
+    assert (kb_backups / '0.sqlite3').exists() and (kb_backups / '1.sqlite3').exists()
+    assert not (kb_backups / '1.owl').exists()
+
+    # Every process mutates its own working store; those of processes that exited are removed
+    assert (kb_backups / ('working.' + str(os.getpid()) + '.sqlite3')).exists()
+    exited = subprocess.Popen([sys.executable, '-c', ''])
+    exited.wait()
+    stale = kb_backups / ('working.' + str(exited.pid) + '.sqlite3')
+    stale.write_bytes(b'')
+
+    kbi.start(0)
+    assert all(kbi.get_instances(lab) == [lab] for lab in labels)
+    assert kbi.get_formulas('power_mean') == kbi.get_formulas('power_mean') is not None
+    assert not stale.exists()
+
+    # The quadstore can be exported back to a backup for the 'owl' backend
+    kbi.export_ontology(kb_backups / '5.owl')
+    monkeypatch.setattr(kbi, 'BACKEND', 'owl')
+    kbi.start(6)
+    assert all(kbi.get_instances(lab) == [lab] for lab in labels)
+
+
+def test_restart_changes_the_etag(kb):
+    import main
+    from starlette.requests import Request
+
+    def snapshot_headers(if_none_match=''):
+        return main.snapshot_headers(Request({'type': 'http', 'headers': [(b'if-none-match', if_none_match.encode())]}))
+
+    etag = snapshot_headers()[1]['ETag']
+    assert snapshot_headers(etag)[2]
+
+    # Started again on the same backup, the KB has the same backup number and mutations but a new epoch
+    revision = kbi.SNAPSHOT['revision']
+    kbi.start(1)
+    assert kbi.SNAPSHOT['revision'][1:] == revision[1:]
+    assert int((kb / 'epoch').read_text()) == kbi.SNAPSHOT['revision'][0] != revision[0]
+    assert not snapshot_headers(etag)[2]
+
+    # A read-only process serving the same folder takes the epoch of the writer
+    revision = kbi.SNAPSHOT['revision']
+    kbi.start(1, read_only=True)
+    assert kbi.SNAPSHOT['revision'] == revision
+
+
+def test_read_model_snapshot(kb_backups, monkeypatch):
+    kbi.start(1)
+    kbi.add_kpi('downtime_kpi', 'modeled_kpi', 'desc', 'unit', 'S°+[ R°time_sum°T°m°o° ; C°1° ]')
+    labels = list(kbi.SNAPSHOT['read_model']['labels'])
+    expected = {lab: (kbi.get_object_properties(lab), kbi.get_instances(lab), kbi.get_formulas(lab))
+                for lab in labels}
+    kbi.flush()
+
+    # A read-only start serves the same answers from the read model, without loading the ontology
+    build_read_model = kbi._build_read_model
+    monkeypatch.setattr(kbi, '_build_read_model', None)
+    with kbi.KB_LOCK:
+        kbi._backup()
+    kbi.start(0, read_only=True)
+    assert kbi.ONTO is None
+    assert {lab: (kbi.get_object_properties(lab), kbi.get_instances(lab), kbi.get_formulas(lab))
+            for lab in labels} == expected
+    assert kbi.get_closest_kpi_formulas('modeled_kpj')[0] == expected['modeled_kpi'][2]
+    kbi.add_kpi('downtime_kpi', 'refused_kpi', 'desc', 'unit', 'C°1°')
+    assert not kbi._lookup(kbi.SNAPSHOT, 'refused_kpi')
+    monkeypatch.setattr(kbi, '_build_read_model', build_read_model)
+
+    # A read model that does not match the content of its backup is rebuilt
+    with open(kb_backups / '0.owl', 'a', encoding='utf-8') as owl:
+        owl.write('\n')
+    kbi.start(1, read_only=True)
+    assert kbi.ONTO is not None and not kbi._lookup(kbi.SNAPSHOT, 'modeled_kpi')
+
+
+# Started by test_shared_processes_follow_the_writer as a follower process
+FOLLOWER = """
+import sys, json, pathlib
+sys.path.insert(0, sys.argv[1])
+import kb_interface as kbi
+kbi.MAIN_DIR = pathlib.Path(sys.argv[2])
+kbi.CONFIG_PATH = kbi.MAIN_DIR / 'config.cfg'
+def report(*values):
+    print('RESULT', json.dumps(values), flush=True)
+kbi.start_shared()
+report(kbi._SHARED_STATE['role'], kbi.ONTO is None)
+kbi.add_kpi('downtime_kpi', 'from_follower', 'desc', 'unit', 'S°+[ R°time_sum°T°m°o° ; C°1° ]')
+report(sorted(kbi.get_formulas('from_follower')))
+sys.stdin.readline()
+# Valid against the version the follower still reads, but the writer already has 'from_writer'
+report(kbi.add_kpis([{'superclass': 'downtime_kpi', 'label': 'from_writer', 'description': 'desc',
+                      'unit_of_measure': 'unit', 'parsable_computation_formula': 'C°2°'}]))
+kbi.refresh()
+report(kbi.get_instances('from_writer'), kbi.SAVE_INT, kbi.SNAPSHOT['revision'])
+"""
+
+
+def test_shared_processes_follow_the_writer(kb_backups, monkeypatch):
+    monkeypatch.setattr(kbi, 'SNAPSHOT_EVERY', 2)
+    kbi.start_shared()
+    follower = subprocess.Popen([sys.executable, '-c', FOLLOWER, str(ROOT),
+                                 str(kb_backups)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+    def result():
+        for line in follower.stdout:
+            if line.startswith('RESULT '):
+                return json.loads(line[7:])
+
+    try:
+        assert kbi._SHARED_STATE['role'] == 'writer'
+        assert result() == ['follower', True]
+
+        # The mutation of the follower is applied by the writer, and the follower sees it
+        assert result() == [['from_follower', 'time_sum']]
+        assert kbi.get_instances('from_follower') == ['from_follower']
+
+        # The follower picks up the backup the writer takes after the next mutation
+        kbi.add_kpi('downtime_kpi', 'from_writer', 'desc', 'unit', 'C°1°')
+        assert kbi.SAVE_INT == 2
+        follower.stdin.write('\n')
+        follower.stdin.flush()
+
+        # The writer rejects the batch of the follower, which gets the reasons of the writer
+        assert result() == [['KPI 0 (from_writer): ALREADY EXISTS']]
+        # Both processes name the same content alike, in the epoch of the writer
+        assert result() == [['from_writer'], 2, list(kbi.SNAPSHOT['revision'])]
+    finally:
+        follower.kill()
+        follower.wait()
+        kbi.shutdown()
+    assert kbi._SHARED_STATE['role'] is None